@@ -0,0 +1,102 @@
+"""User boost levels
+
+Revision ID: b032f89aff0b
+Revises: f36fba00a5c7
+Create Date: 2026-10-18 20:30:54.175084
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b032f89aff0b'
+down_revision: Union[str, None] = 'f36fba00a5c7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10_000
+
+# Only levels above 1 are stored, a missing row means level 1. The copied JSON is cleared in the same
+# statement, shrinking the rows that every balance write rewrites
+BACKFILL = sa.text("""
+    WITH copied AS (
+        INSERT INTO user_boost (user_id, boost_id, level)
+        SELECT u.id, b.id, (info.value ->> 'level')::int
+        FROM "user" u
+        CROSS JOIN LATERAL jsonb_each(
+            CASE WHEN jsonb_typeof(u.boosts_info::jsonb) = 'object' THEN u.boosts_info::jsonb ELSE '{}' END
+        ) AS info
+        JOIN boost b ON b.name = info.key
+        WHERE u.id > :lower AND u.id <= :upper AND (info.value ->> 'level')::int > 1
+        ON CONFLICT (user_id, boost_id) DO NOTHING
+    )
+    UPDATE "user" SET boosts_info = NULL
+    WHERE id > :lower AND id <= :upper AND boosts_info IS NOT NULL
+""")
+
+# Every boost of the catalog for every user, level 1 where user_boost has no row, in the format the
+# code before this revision reads and writes
+RESTORE = sa.text("""
+    UPDATE "user" SET boosts_info = levels.info
+    FROM (
+        SELECT u.id AS user_id, json_object_agg(b.name, json_build_object(
+            'id', b.id, 'level', coalesce(ub.level, 1), 'base_value', b.base_value,
+            'value_per_level', b.value_per_level, 'base_upgrade_cost', b.base_cost,
+            'upgrade_cost_per_level', b.cost_per_level, 'max_level', b.max_level
+        )) AS info
+        FROM "user" u
+        CROSS JOIN boost b
+        LEFT JOIN user_boost ub ON ub.user_id = u.id AND ub.boost_id = b.id
+        WHERE u.id > :lower AND u.id <= :upper
+        GROUP BY u.id
+    ) AS levels
+    WHERE "user".id = levels.user_id
+""")
+
+
+def batches(connection):
+    lower = connection.execute(sa.text('SELECT min(id) - 1 FROM "user"')).scalar()
+    while lower is not None:
+        upper = connection.execute(
+            sa.text('SELECT max(id) FROM (SELECT id FROM "user" WHERE id > :lower ORDER BY id LIMIT :limit) AS batch'),
+            {"lower": lower, "limit": BATCH_SIZE}
+        ).scalar()
+        if upper is None:
+            break
+        yield lower, upper
+        lower = upper
+
+
+def upgrade() -> None:
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.create_table('user_boost',
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('boost_id', sa.Integer(), nullable=False),
+    sa.Column('level', sa.SmallInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['boost_id'], ['boost.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'boost_id')
+    )
+    # ### end Alembic commands ###
+
+    # Copied in short transactions so the user table is never locked for long, levels written
+    # by the new code in the meantime win over the copied ones
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        for lower, upper in batches(connection):
+            connection.execute(BACKFILL, {"lower": lower, "upper": upper})
+
+
+def downgrade() -> None:
+    # Users created since the upgrade have no JSON at all, the code of the previous revision expects every boost
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        for lower, upper in batches(connection):
+            connection.execute(RESTORE, {"lower": lower, "upper": upper})
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_table('user_boost')
+    # ### end Alembic commands ###
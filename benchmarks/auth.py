@@ -0,0 +1,81 @@
+"""
+Per-request cost of check_auth_header, before and after the verified initData cache.
+
+Run from the repository root:
+    python -m benchmarks.auth
+"""
+import hashlib
+import hmac
+import json
+import os
+import time
+import timeit
+from urllib.parse import parse_qs, urlencode
+
+ITERATIONS = 50_000
+
+
+def sign_init_data(bot_token: str, user_id: int, auth_date: int) -> str:
+    fields = {
+        "auth_date": str(auth_date),
+        "query_id": "AAHdF6IQAAAAAN0XohDhrOrc",
+        "user": json.dumps({"id": user_id, "first_name": "Bench", "username": f"bench_{user_id}",
+                            "language_code": "en", "allows_write_to_pm": True}),
+    }
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new("WebAppData".encode(), bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def legacy_check_auth_header(authentication: str, bot_token: str):
+    # The pre-cache implementation, kept here as the baseline
+    init_data = parse_qs(authentication.split(" ")[1])
+    hash_value = init_data.get('hash', [None])[0]
+    init_data.pop('hash', None)
+    data_check_string = "\n".join(f"{key}={value[0]}" for key, value in sorted(init_data.items()))
+    secret_key = hmac.new("WebAppData".encode(), bot_token.encode(), hashlib.sha256).digest()
+    calculated_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    assert calculated_hash == hash_value
+    return init_data.get('id', None)
+
+
+def run_sync(coroutine):
+    # check_auth_header never awaits, so it can be driven without an event loop
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("check_auth_header suspended unexpectedly")
+
+
+def main():
+    # Imported here, the settings must see the token set below when run as a script
+    from src.users import dependencies
+    from src.users.dependencies import check_auth_header
+
+    bot_token = dependencies.settings.TELEGRAM_BOT_TOKEN
+    header = "tma " + sign_init_data(bot_token, 777000, int(time.time()))
+
+    def cold():
+        dependencies.auth_cache.clear()
+        run_sync(check_auth_header(header))
+
+    def warm():
+        run_sync(check_auth_header(header))
+
+    results = {
+        "legacy": timeit.timeit(lambda: legacy_check_auth_header(header, bot_token), number=ITERATIONS),
+        "uncached": timeit.timeit(cold, number=ITERATIONS),
+        "cached": timeit.timeit(warm, number=ITERATIONS),
+    }
+    for name, total in results.items():
+        print(f"{name:>9}: {total / ITERATIONS * 1e6:7.2f} us/request")
+
+    print(f"cache hits={dependencies.auth_cache.hits} misses={dependencies.auth_cache.misses}")
+
+
+if __name__ == "__main__":
+    # Only for this benchmark, other modules import sign_init_data with the token of the settings
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1234567890:benchmark-bot-token")
+    main()
@@ -0,0 +1,122 @@
+"""
+Concurrency stress test of the balance mutations in src.users.service.
+
+Fires many concurrent requests at a handful of users and checks the invariants the single-statement
+updates guarantee: no lost balance increments, a task reward is paid once, and concurrent boost upgrades
+never drive a balance below zero.
+
+Needs the Postgres database from the settings with migrations applied. Run from the repository root:
+    python -m benchmarks.balance_stress --users 20 --requests 200
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import delete, event, insert, select
+
+from src.database import async_engine, async_session_factory
+from src.users.catalog import catalog
+from src.users.models import Boost, Task, User, user_boost, users_tasks
+from src.users.service import add_balance, complete_task, upgrade_boost
+
+FIRST_USER_ID = 10 ** 12
+BENCH_ID = 10 ** 6
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements = 0
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+
+async def run(mutation, user_id, *args):
+    async with async_session_factory() as session:
+        result = await mutation(session, user_id, *args)
+        await session.commit()
+        return result
+
+
+async def balances(user_ids):
+    async with async_session_factory() as session:
+        rows = await session.execute(select(User.id, User.balance).where(User.id.in_(user_ids)))
+        return dict(rows.tuples().all())
+
+
+async def setup(user_ids, balance):
+    async with async_session_factory() as session:
+        await cleanup(session, user_ids)
+        await session.execute(insert(Boost).values(id=BENCH_ID, name="bench_boost", base_cost=100, cost_per_level=0,
+                                                   base_value=1, value_per_level=1, max_level=1000))
+        await session.execute(insert(Task).values(id=BENCH_ID, name="bench_task", url="", icon="", reward=500))
+        await session.execute(insert(User), [
+            {"id": user_id, "username": f"bench_{user_id}", "balance": balance, "boosts_info": {}, "is_active": True}
+            for user_id in user_ids
+        ])
+        await session.commit()
+    await catalog.load()
+
+
+async def cleanup(session, user_ids):
+    await session.execute(delete(users_tasks).where(users_tasks.c.user_id.in_(user_ids)))
+    await session.execute(delete(user_boost).where(user_boost.c.user_id.in_(user_ids)))
+    await session.execute(delete(User).where(User.id.in_(user_ids)))
+    await session.execute(delete(Task).where(Task.id == BENCH_ID))
+    await session.execute(delete(Boost).where(Boost.id == BENCH_ID))
+
+
+async def main(args):
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    async_engine.echo = False
+    counter = StatementCounter()
+    event.listen(async_engine.sync_engine, "before_cursor_execute", counter.on_execute)
+
+    await setup(user_ids, balance=1000)
+    boost = catalog.get_boost(BENCH_ID)
+    task = catalog.get_task(BENCH_ID)
+    started = time.perf_counter()
+    counter.statements = 0
+
+    # Every increment must land
+    await asyncio.gather(*(run(add_balance, user_id, 1) for user_id in user_ids for _ in range(args.requests)))
+    after_adds = await balances(user_ids)
+    assert all(balance == 1000 + args.requests for balance in after_adds.values()), after_adds
+
+    # The reward of the same task is paid exactly once per user
+    results = await asyncio.gather(*(run(complete_task, user_id, task)
+                                     for user_id in user_ids for _ in range(args.requests)))
+    paid = sum(result is not None for result in results)
+    assert paid == len(user_ids), paid
+    after_tasks = await balances(user_ids)
+    assert all(balance == after_adds[user_id] + task.reward for user_id, balance in after_tasks.items())
+
+    # Upgrades at 100 tokens each only succeed while the balance covers them
+    results = await asyncio.gather(*(run(upgrade_boost, user_id, boost, 2)
+                                     for user_id in user_ids for _ in range(args.requests)))
+    upgrades = sum(result is not None for result in results)
+    after_upgrades = await balances(user_ids)
+    assert all(balance >= 0 for balance in after_upgrades.values()), after_upgrades
+    assert all(balance == after_tasks[user_id] % boost.base_cost for user_id, balance in after_upgrades.items())
+    assert upgrades == sum(balance // boost.base_cost for balance in after_tasks.values())
+
+    elapsed = time.perf_counter() - started
+    statements = counter.statements
+
+    async with async_session_factory() as session:
+        await cleanup(session, user_ids)
+        await session.commit()
+    await async_engine.dispose()
+
+    mutations = 3 * len(user_ids) * args.requests
+    print(f"{mutations} concurrent mutations over {args.users} users in {elapsed:.2f}s "
+          f"({mutations / elapsed:.0f}/s), {statements} statements")
+    print(f"task rewards paid: {paid}, boost upgrades applied: {upgrades}, lowest balance: {min(after_upgrades.values())}")
+    print("all invariants hold")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
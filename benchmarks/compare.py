@@ -0,0 +1,78 @@
+"""
+Compares two JSON reports of benchmarks.load endpoint by endpoint.
+
+Exits with status 1 when an endpoint lost more than --threshold of its throughput, got slower by more
+than --threshold at p50, p95 or p99, or makes more than --threshold more database round trips per
+request, so it can gate a change in CI. Run from the repository root:
+    python -m benchmarks.compare before.json after.json --threshold 0.1
+"""
+import argparse
+import json
+import sys
+
+METRICS = [
+    # key, whether higher is better
+    ("throughput", True),
+    ("p50_ms", False),
+    ("p95_ms", False),
+    ("p99_ms", False),
+    ("db_queries_per_request", False),
+]
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return None
+    return (after - before) / before
+
+
+def regressed(higher_is_better, before, after, threshold):
+    relative = change(before, after)
+    if relative is None:
+        return False
+    return relative < -threshold if higher_is_better else relative > threshold
+
+
+def main(args):
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    for label, report in (("before", before), ("after", after)):
+        meta = report["meta"]
+        print(f"{label:>6}: {meta['revision'] or 'unknown'}{' (dirty)' if meta['dirty'] else ''}, "
+              f"target {meta['target']}, {meta['args']['users']} users, concurrency {meta['args']['concurrency']}")
+
+    regressions = []
+    rows = [("total", before["summary"], after["summary"])]
+    rows += [(endpoint, before["endpoints"].get(endpoint, {}), after["endpoints"].get(endpoint, {}))
+             for endpoint in sorted(set(before["endpoints"]) | set(after["endpoints"]))]
+
+    print(f"{'':>36}  " + "  ".join(f"{key:>24}" for key, _ in METRICS))
+    for endpoint, old, new in rows:
+        cells = []
+        for key, higher_is_better in METRICS:
+            old_value, new_value = old.get(key), new.get(key)
+            relative = change(old_value, new_value)
+            cell = f"{old_value if old_value is not None else '-'} -> {new_value if new_value is not None else '-'}"
+            if relative is not None:
+                cell += f" {relative:+.0%}"
+            if regressed(higher_is_better, old_value, new_value, args.threshold):
+                cell = "!" + cell
+                regressions.append(f"{endpoint} {key}")
+            cells.append(f"{cell:>24}")
+        print(f"{endpoint:>36}  " + "  ".join(cells))
+
+    if regressions:
+        print(f"\nregressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"\nno regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change treated as a regression")
+    main(parser.parse_args())
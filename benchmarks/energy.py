@@ -0,0 +1,86 @@
+"""
+Energy limiter overhead benchmark: latency of charging a tap and throughput of concurrent taps.
+
+Does not need Postgres, the buckets get fixed limits instead of the ones of the boost catalog. Run
+from the repository root:
+    python -m benchmarks.energy --users 100000
+Pass --redis to measure the Redis buckets instead of the in-process store.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from src.config import settings
+from src.users.energy import MemoryEnergyStore, RedisEnergyStore
+
+LIMITS = (1000, 3, 2)
+
+
+async def measure(operation, calls):
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        await operation()
+        timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99)]
+
+
+async def main(args):
+    from src.redis_client import close_redis, get_redis, init_redis
+
+    await init_redis()
+    store = RedisEnergyStore() if settings.REDIS_ENABLED else MemoryEnergyStore(args.users)
+    store.PREFIX = "energy:benchmark:"
+    rng = random.Random(42)
+
+    started = time.perf_counter()
+    for user_id in range(args.users):
+        await store.consume(user_id, 1, LIMITS, 0)
+    print(f"{args.users} users, store: {'redis' if settings.REDIS_ENABLED else 'memory'}, "
+          f"fill {time.perf_counter() - started:.2f}s")
+
+    operations = {
+        "new user": lambda: store.consume(args.users + rng.randrange(10 ** 9), 10, LIMITS, 0),
+        "tap": lambda: store.consume(rng.randrange(args.users), 10, None, 0),
+    }
+    print(f"{'':>8}  {'p50 µs':>8}  {'p99 µs':>8}")
+    for name, operation in operations.items():
+        p50, p99 = await measure(operation, args.calls)
+        print(f"{name:>8}  {p50:8.1f}  {p99:8.1f}")
+
+    started = time.perf_counter()
+    for _ in range(0, args.calls, args.concurrency):
+        await asyncio.gather(*(store.consume(rng.randrange(args.users), 10, None, 0) for _ in range(args.concurrency)))
+    print(f"{args.concurrency} concurrent taps: {args.calls / (time.perf_counter() - started):.0f} taps/s")
+
+    if settings.REDIS_ENABLED:
+        redis = get_redis()
+        async for keys in chunked(redis.scan_iter(match=f"{store.PREFIX}*", count=10_000)):
+            await redis.delete(*keys)
+    await close_redis()
+
+
+async def chunked(keys, size=10_000):
+    chunk = []
+    async for key in keys:
+        chunk.append(key)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--calls", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--redis", action="store_true")
+    arguments = parser.parse_args()
+
+    settings.REDIS_ENABLED = arguments.redis
+    asyncio.run(main(arguments))
@@ -0,0 +1,131 @@
+"""
+Throughput of the users endpoints with different engine configurations.
+
+Needs the Postgres database from the settings with migrations applied, Redis is not used. Requests go
+through the ASGI app in process, so the numbers compare engine settings rather than the HTTP stack.
+Run from the repository root:
+    python -m benchmarks.engine_presets --users 1000 --duration 10 --concurrency 64
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+from sqlalchemy import delete, insert
+
+from src.config import settings
+
+settings.REDIS_ENABLED = False
+settings.TAP_BUFFER_ENABLED = False
+
+from benchmarks.auth import sign_init_data  # noqa: E402
+from src.database import async_engine, async_session_factory, create_engine  # noqa: E402
+from src.main import app, lifespan  # noqa: E402
+from src.users.models import User, user_boost, users_tasks  # noqa: E402
+
+FIRST_USER_ID = 10 ** 12
+
+PRESETS = {
+    # The settings before they were configurable
+    "legacy": {"echo": True, "pool_size": 5, "max_overflow": 10, "jit": True, "pool_pre_ping": False,
+               "pool_recycle": -1, "prepared_statement_cache_size": 100},
+    "default": {},
+    "no_pre_ping": {"pool_pre_ping": False},
+    "no_statement_cache": {"prepared_statement_cache_size": 0},
+    # Against Postgres directly, shows the cost of giving up statement reuse and the client-side pool
+    "pgbouncer": {"pgbouncer": True},
+}
+
+
+def requests_for(user_id: int):
+    return [
+        ("GET", f"/users/{user_id}", None),
+        ("GET", f"/users/{user_id}/boosts", None),
+        ("GET", f"/users/{user_id}/tasks", None),
+        ("GET", f"/users/{user_id}/friends", None),
+        ("PATCH", "/users/update-user-balance", {"user_id": user_id, "tokens": 1}),
+    ]
+
+
+async def drive(client, user_ids, headers, duration, concurrency):
+    rng = random.Random(42)
+    deadline = time.perf_counter() + duration
+    completed = errors = 0
+
+    async def worker():
+        nonlocal completed, errors
+        while time.perf_counter() < deadline:
+            user_id = rng.choice(user_ids)
+            method, url, body = rng.choice(requests_for(user_id))
+            response = await client.request(method, url, json=body, headers=headers[user_id])
+            if response.status_code != 200 or response.json().get("status") == "error":
+                errors += 1
+            completed += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return completed, errors
+
+
+async def seed(user_ids):
+    async with async_session_factory() as session:
+        await cleanup(session, user_ids)
+        await session.execute(insert(User), [
+            {"id": user_id, "username": f"bench_{user_id}", "balance": 0, "is_active": True,
+             "referrer_id": FIRST_USER_ID if user_id != FIRST_USER_ID else None}
+            for user_id in user_ids
+        ])
+        await session.commit()
+
+
+async def cleanup(session, user_ids):
+    await session.execute(delete(users_tasks).where(users_tasks.c.user_id.in_(user_ids)))
+    await session.execute(delete(user_boost).where(user_boost.c.user_id.in_(user_ids)))
+    await session.execute(delete(User).where(User.id.in_(user_ids)))
+
+
+async def main(args):
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    now = int(time.time())
+    headers = {user_id: {"Authentication": f"tma {sign_init_data(settings.TELEGRAM_BOT_TOKEN, user_id, now)}"}
+               for user_id in user_ids}
+
+    await seed(user_ids)
+    results = []
+    async with lifespan(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.presets:
+                engine = create_engine(**PRESETS[name])
+                # echo writes to stdout, keep the cost of formatting the log records but not the terminal
+                for handler in logging.getLogger("sqlalchemy.engine.Engine").handlers:
+                    handler.setStream(open(os.devnull, "w"))
+                async_session_factory.configure(bind=engine)
+
+                await drive(client, user_ids, headers, 1, args.concurrency)
+                completed, errors = await drive(client, user_ids, headers, args.duration, args.concurrency)
+                results.append((name, completed / args.duration, errors))
+
+                async_session_factory.configure(bind=async_engine)
+                await engine.dispose()
+
+    async with async_session_factory() as session:
+        await cleanup(session, user_ids)
+        await session.commit()
+    await async_engine.dispose()
+
+    print(f"{args.users} users, concurrency {args.concurrency}, {args.duration}s per preset")
+    print(f"{'':>20}  {'req/s':>8}  {'errors':>6}")
+    for name, throughput, errors in results:
+        print(f"{name:>20}  {throughput:8.0f}  {errors:6d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--presets", nargs="+", default=list(PRESETS), choices=list(PRESETS))
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,69 @@
+"""
+Leaderboard latency benchmark: top-N, rank and update against a populated store.
+
+Does not need Postgres, the store is filled with random balances. Run from the repository root:
+    python -m benchmarks.leaderboard --users 1000000
+Pass --redis to measure the Redis sorted set instead of the in-process store.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from src.config import settings
+from src.users.leaderboard import MemoryLeaderboardStore, RedisLeaderboardStore
+
+
+async def chunks(balances, size=10_000):
+    for start in range(0, len(balances), size):
+        yield balances[start:start + size]
+
+
+async def measure(operation, calls):
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        await operation()
+        timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99)]
+
+
+async def main(args):
+    from src.redis_client import close_redis, init_redis
+
+    await init_redis()
+    store = RedisLeaderboardStore("leaderboard:benchmark") if settings.REDIS_ENABLED else MemoryLeaderboardStore()
+    rng = random.Random(42)
+    balances = [(user_id, rng.randint(0, 10 ** 9)) for user_id in range(args.users)]
+
+    started = time.perf_counter()
+    await store.replace(chunks(balances))
+    print(f"{args.users} users, store: {'redis' if settings.REDIS_ENABLED else 'memory'}, "
+          f"rebuild {time.perf_counter() - started:.2f}s")
+
+    operations = {
+        "top 100": lambda: store.top(100),
+        "rank": lambda: store.rank(rng.randrange(args.users)),
+        "update": lambda: store.update([(rng.randrange(args.users), rng.randint(0, 10 ** 9))]),
+    }
+    print(f"{'':>8}  {'p50 µs':>8}  {'p99 µs':>8}")
+    for name, operation in operations.items():
+        p50, p99 = await measure(operation, args.calls)
+        print(f"{name:>8}  {p50:8.1f}  {p99:8.1f}")
+
+    if settings.REDIS_ENABLED:
+        await store.replace(chunks([]))
+    await close_redis()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--calls", type=int, default=10_000)
+    parser.add_argument("--redis", action="store_true")
+    arguments = parser.parse_args()
+
+    settings.REDIS_ENABLED = arguments.redis
+    asyncio.run(main(arguments))
@@ -0,0 +1,310 @@
+"""
+Mixed-traffic load test of the users API against a database seeded by benchmarks.seed.
+
+Virtual users mostly read their profile, tap in bursts of update-user-balance calls and occasionally
+sign up under a seeded referrer, every request carrying a freshly signed Authentication header. The
+app runs in process through the ASGI transport, or pass --url to load a running server; its
+TELEGRAM_BOT_TOKEN has to match the one in the settings here. Database round trips per endpoint are
+read from the /metrics endpoint before and after the run.
+Run from the repository root:
+    python -m benchmarks.seed --users 100000
+    python -m benchmarks.load --users 100000 --duration 30 --concurrency 64 --output before.json
+Compare two reports with benchmarks.compare.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import re
+import statistics
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.auth import sign_init_data
+from benchmarks.seed import FIRST_TASK_ID, FIRST_USER_ID
+from src.config import settings
+
+DB_QUERIES = re.compile(r'^http_request_db_queries_(sum|count)\{method="([^"]*)",route="([^"]*)"\} (\S+)$')
+
+DEFAULT_MIX = {
+    "get_user": 60,
+    "tap_burst": 20,
+    "tasks": 5,
+    "boosts": 4,
+    "friends": 4,
+    "leaderboard": 3,
+    "complete_task": 2,
+    "signup": 2,
+}
+
+
+class Headers:
+    """
+        Signed Authentication headers per user, re-signed before they reach TELEGRAM_AUTH_MAX_AGE.
+    """
+
+    def __init__(self):
+        self.signed = {}
+
+    def __call__(self, user_id: int) -> dict:
+        now = int(time.time())
+        header = self.signed.get(user_id)
+        if header is None or now - header[0] > settings.TELEGRAM_AUTH_MAX_AGE // 2:
+            header = self.signed[user_id] = now, {
+                "Authentication": f"tma {sign_init_data(settings.TELEGRAM_BOT_TOKEN, user_id, now)}"
+            }
+        return header[1]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rejected = defaultdict(int)
+        self.enabled = False
+
+    async def request(self, client, endpoint, method, url, headers, body=None):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, json=body, headers=headers)
+            failed = response.status_code >= 400
+            rejected = not failed and response.json().get("status") == "error"
+        except httpx.HTTPError:
+            failed, rejected = True, False
+        if self.enabled:
+            self.latencies[endpoint].append((time.perf_counter() - started) * 1000)
+            self.errors[endpoint] += failed
+            self.rejected[endpoint] += rejected
+
+
+class Traffic:
+    """
+        Picks the next action of a virtual user according to the mix.
+
+    Args:
+        args: Command line arguments, --skew 1 picks users uniformly and higher values concentrate
+            the traffic on the first users.
+    """
+
+    def __init__(self, args, recorder: Recorder, headers: Headers):
+        self.user_count = args.users
+        self.task_count = args.tasks
+        self.skew = args.skew
+        self.max_burst = args.tap_burst
+        self.recorder = recorder
+        self.headers = headers
+        self.actions = list(args.mix)
+        self.weights = list(args.mix.values())
+        # After the seeded ids and unique across runs, benchmarks.seed --reset removes them
+        self.next_signup_id = FIRST_USER_ID + args.users + int(time.time()) * 10_000
+
+    def pick_user(self, rng) -> int:
+        return FIRST_USER_ID + int(self.user_count * rng.random() ** self.skew)
+
+    async def run(self, client, rng, deadline):
+        while time.perf_counter() < deadline:
+            action = rng.choices(self.actions, self.weights)[0]
+            await getattr(self, action)(client, rng)
+
+    async def get_user(self, client, rng):
+        user_id = self.pick_user(rng)
+        await self.recorder.request(client, "GET /users/{user_id}", "GET", f"/users/{user_id}", self.headers(user_id))
+
+    async def tap_burst(self, client, rng):
+        user_id = self.pick_user(rng)
+        for _ in range(rng.randint(1, self.max_burst)):
+            await self.recorder.request(client, "PATCH /users/update-user-balance", "PATCH",
+                                        "/users/update-user-balance", self.headers(user_id),
+                                        {"user_id": user_id, "tokens": rng.randint(1, 20)})
+
+    async def tasks(self, client, rng):
+        user_id = self.pick_user(rng)
+        await self.recorder.request(client, "GET /users/{user_id}/tasks", "GET", f"/users/{user_id}/tasks",
+                                    self.headers(user_id))
+
+    async def boosts(self, client, rng):
+        user_id = self.pick_user(rng)
+        await self.recorder.request(client, "GET /users/{user_id}/boosts", "GET", f"/users/{user_id}/boosts",
+                                    self.headers(user_id))
+
+    async def friends(self, client, rng):
+        user_id = self.pick_user(rng)
+        await self.recorder.request(client, "GET /users/{user_id}/friends", "GET", f"/users/{user_id}/friends",
+                                    self.headers(user_id))
+
+    async def leaderboard(self, client, rng):
+        user_id = self.pick_user(rng)
+        await self.recorder.request(client, "GET /users/leaderboard", "GET", "/users/leaderboard",
+                                    self.headers(user_id))
+
+    async def complete_task(self, client, rng):
+        user_id = self.pick_user(rng)
+        await self.recorder.request(client, "PATCH /users/update-user-tasks", "PATCH", "/users/update-user-tasks",
+                                    self.headers(user_id),
+                                    {"user_id": user_id, "task_id": FIRST_TASK_ID + rng.randrange(self.task_count)})
+
+    async def signup(self, client, rng):
+        user_id = self.next_signup_id
+        self.next_signup_id += 1
+        await self.recorder.request(client, "POST /users/", "POST", "/users/", self.headers(user_id),
+                                    {"id": user_id, "username": f"bench_signup_{user_id}",
+                                     "referrer_id": self.pick_user(rng)})
+
+
+async def db_queries(client) -> dict:
+    """
+    Returns:
+        dict: Sum and count of the database round trips per "METHOD route", from /metrics.
+    """
+    response = await client.get("/metrics")
+    totals = defaultdict(lambda: [0.0, 0.0])
+    for line in response.text.splitlines():
+        match = DB_QUERIES.match(line)
+        if match:
+            kind, method, route, value = match.groups()
+            totals[f"{method} {route}"][kind == "count"] += float(value)
+    return totals
+
+
+def percentiles(latencies):
+    if len(latencies) < 2:
+        value = latencies[0] if latencies else None
+        return value, value, value
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, check=True).stdout
+        return revision.strip(), bool(dirty.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def build_report(args, recorder, duration, before, after):
+    endpoints = {}
+    all_latencies = []
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        all_latencies.extend(latencies)
+        p50, p95, p99 = percentiles(latencies)
+        queries = None
+        if endpoint in after:
+            total = after[endpoint][0] - before.get(endpoint, (0, 0))[0]
+            count = after[endpoint][1] - before.get(endpoint, (0, 0))[1]
+            queries = round(total / count, 3) if count else None
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[endpoint],
+            "rejected": recorder.rejected[endpoint],
+            "throughput": round(len(latencies) / duration, 1),
+            "p50_ms": round(p50, 3),
+            "p95_ms": round(p95, 3),
+            "p99_ms": round(p99, 3),
+            "db_queries_per_request": queries,
+        }
+
+    p50, p95, p99 = percentiles(all_latencies)
+    revision, dirty = git_revision()
+    return {
+        "meta": {
+            "revision": revision,
+            "dirty": dirty,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "target": args.url or "asgi",
+            "redis": settings.REDIS_ENABLED,
+            "args": {key: value for key, value in vars(args).items() if key != "output"},
+        },
+        "summary": {
+            "requests": len(all_latencies),
+            "errors": sum(recorder.errors.values()),
+            "rejected": sum(recorder.rejected.values()),
+            "throughput": round(len(all_latencies) / duration, 1),
+            "p50_ms": round(p50, 3),
+            "p95_ms": round(p95, 3),
+            "p99_ms": round(p99, 3),
+        },
+        "endpoints": endpoints,
+    }
+
+
+async def drive(args, client):
+    recorder = Recorder()
+    traffic = Traffic(args, recorder, Headers())
+    rngs = [random.Random(args.seed + worker) for worker in range(args.concurrency)]
+
+    deadline = time.perf_counter() + args.warmup
+    await asyncio.gather(*(traffic.run(client, rng, deadline) for rng in rngs))
+
+    before = await db_queries(client)
+    recorder.enabled = True
+    started = time.perf_counter()
+    await asyncio.gather(*(traffic.run(client, rng, started + args.duration) for rng in rngs))
+    duration = time.perf_counter() - started
+    recorder.enabled = False
+    after = await db_queries(client)
+    return build_report(args, recorder, duration, before, after)
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+            report = await drive(args, client)
+    else:
+        from src.main import app, lifespan
+
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+                report = await drive(args, client)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+    summary = report["summary"]
+    print(f"{summary['requests']} requests in {args.duration:g}s, {summary['throughput']:.0f} req/s, "
+          f"{summary['errors']} errors, p50 {summary['p50_ms']:.1f} ms, p95 {summary['p95_ms']:.1f} ms, "
+          f"p99 {summary['p99_ms']:.1f} ms")
+    print(f"{'':>36}  {'req/s':>8}  {'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}  {'queries':>7}  {'errors':>6}")
+    for endpoint, stats in report["endpoints"].items():
+        queries = stats["db_queries_per_request"]
+        print(f"{endpoint:>36}  {stats['throughput']:8.1f}  {stats['p50_ms']:8.2f}  {stats['p95_ms']:8.2f}  "
+              f"{stats['p99_ms']:8.2f}  {'-' if queries is None else f'{queries:.2f}':>7}  {stats['errors']:6d}")
+
+
+def parse_mix(value: str) -> dict:
+    mix = dict(DEFAULT_MIX)
+    for item in value.split(","):
+        action, weight = item.split("=")
+        if action not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action {action}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[action] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10_000, help="users seeded by benchmarks.seed")
+    parser.add_argument("--tasks", type=int, default=20, help="tasks seeded by benchmarks.seed")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--tap-burst", type=int, default=20, help="maximum taps in a burst")
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="weights overriding the defaults, e.g. get_user=80,signup=5")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", help="base URL of a running server, the app runs in process when omitted")
+    parser.add_argument("--output", help="file the JSON report is written to")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,151 @@
+"""
+Latency and allocations of the read queries through ORM entities versus the Core read path in
+src.users.queries.
+
+Measures loading a user with their boost levels (GET /users/{user_id}) and a page of referrals
+(GET /users/{user_id}/friends) including the conversion to the response payload. Latency is timed
+without tracing. Allocations are the tracemalloc peak of a call above that of a session running
+SELECT 1, which is dominated by the driver's read buffer.
+Needs the Postgres database from the settings with migrations applied. Run from the repository root:
+    python -m benchmarks.read_path --calls 2000 --referrals 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from sqlalchemy import delete, func, insert, select
+
+from src.database import async_engine, async_session_factory
+from src.users.catalog import catalog
+from src.users.models import User, user_boost, users_tasks
+from src.users.queries import boost_levels, get_referrals, get_user_record
+from src.users.router import serialize_user
+from src.users.schemas import ReferralsGetScheme
+
+FIRST_USER_ID = 10 ** 12
+
+
+async def orm_user(user_id):
+    # GET /users/{user_id} before the Core read path
+    async with async_session_factory() as session:
+        row = (await session.execute(
+            select(
+                User,
+                func.array_agg(user_boost.c.boost_id).filter(user_boost.c.boost_id.is_not(None)),
+                func.array_agg(user_boost.c.level).filter(user_boost.c.boost_id.is_not(None)),
+            )
+            .outerjoin(user_boost, user_boost.c.user_id == User.id)
+            .where(User.id == user_id)
+            .group_by(User.id)
+        )).first()
+        user, boost_ids, levels = row
+        return serialize_user(user, boost_levels(boost_ids, levels))
+
+
+async def core_user(user_id):
+    async with async_session_factory() as session:
+        user, levels = await get_user_record(session, user_id)
+        return serialize_user(user, levels)
+
+
+async def orm_referrals(user_id, limit):
+    async with async_session_factory() as session:
+        rows = (await session.execute(
+            select(User.id, User.username, User.photo, User.balance, User.joined_at)
+            .where(User.referrer_id == user_id)
+            .order_by(User.joined_at, User.id)
+            .limit(limit)
+        )).all()
+        return [ReferralsGetScheme.model_validate(row).model_dump() for row in rows]
+
+
+async def core_referrals(user_id, limit):
+    async with async_session_factory() as session:
+        return [row._asdict() for row in await get_referrals(session, user_id, limit)]
+
+
+async def baseline():
+    async with async_session_factory() as session:
+        await session.execute(select(1))
+
+
+async def peak(call, calls):
+    peaks = []
+    tracemalloc.start()
+    for _ in range(calls):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        await call()
+        _, highest = tracemalloc.get_traced_memory()
+        peaks.append(highest - before)
+    tracemalloc.stop()
+    return statistics.median(peaks)
+
+
+async def measure(call, calls, base):
+    for _ in range(min(calls, 100)):
+        await call()
+
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - started) * 1e6)
+
+    return statistics.median(timings), (await peak(call, min(calls, 200)) - base) / 1024
+
+
+async def seed(user_id, referrals):
+    async with async_session_factory() as session:
+        await cleanup(session, user_id, referrals)
+        await session.execute(insert(User), [
+            {"id": user_id + index, "username": f"bench_{index}", "balance": index, "is_active": True,
+             "referrer_id": user_id if index else None}
+            for index in range(referrals + 1)
+        ])
+        await session.execute(insert(user_boost), [{"user_id": user_id, "boost_id": boost.id, "level": 2}
+                                                   for boost in catalog.boosts])
+        await session.commit()
+
+
+async def cleanup(session, user_id, referrals):
+    user_ids = list(range(user_id, user_id + referrals + 1))
+    await session.execute(delete(users_tasks).where(users_tasks.c.user_id.in_(user_ids)))
+    await session.execute(delete(user_boost).where(user_boost.c.user_id.in_(user_ids)))
+    await session.execute(delete(User).where(User.id.in_(user_ids)))
+
+
+async def main(args):
+    async_engine.echo = False
+    await catalog.load()
+    await seed(FIRST_USER_ID, args.referrals)
+
+    cases = [
+        ("user", "orm", lambda: orm_user(FIRST_USER_ID)),
+        ("user", "core", lambda: core_user(FIRST_USER_ID)),
+        (f"referrals x{args.referrals}", "orm", lambda: orm_referrals(FIRST_USER_ID, args.referrals)),
+        (f"referrals x{args.referrals}", "core", lambda: core_referrals(FIRST_USER_ID, args.referrals)),
+    ]
+    assert await orm_user(FIRST_USER_ID) == await core_user(FIRST_USER_ID)
+    assert await orm_referrals(FIRST_USER_ID, args.referrals) == await core_referrals(FIRST_USER_ID, args.referrals)
+
+    base = await peak(baseline, 200)
+    print(f"{args.calls} sequential calls per case, SELECT 1 session peak {base / 1024:.1f} KiB")
+    print(f"{'':>16}  {'path':>5}  {'median us':>10}  {'peak KiB':>9}")
+    for name, path, call in cases:
+        latency, allocated = await measure(call, args.calls, base)
+        print(f"{name:>16}  {path:>5}  {latency:10.0f}  {allocated:9.1f}")
+
+    async with async_session_factory() as session:
+        await cleanup(session, FIRST_USER_ID, args.referrals)
+        await session.commit()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--referrals", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
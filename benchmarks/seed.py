@@ -0,0 +1,155 @@
+"""
+Seeds the Postgres database from the settings with synthetic users for the load benchmark.
+
+Users get ids from FIRST_USER_ID up, far above real Telegram ids, so a seeded database can be cleaned
+without touching real users. Referrers are drawn with a bias towards early users, which gives a few
+large referral trees and a long tail, and a share of the users get boost levels and completed tasks.
+Rows are streamed through COPY in one pass, so memory stays flat from 10k to 10M users.
+Run from the repository root:
+    python -m benchmarks.seed --users 100000
+Pass --redis to rebuild the Redis leaderboards afterwards, --reset to only remove the synthetic data.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select, text
+
+from src.config import settings
+from src.database import async_engine, async_session_factory
+from src.users.models import Boost, Task, User, user_boost, users_tasks
+
+FIRST_USER_ID = 10 ** 12
+FIRST_TASK_ID = 10 ** 6
+STARTED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+DEFAULT_BOOSTS = [
+    # name, base_cost, cost_per_level, base_value, value_per_level, max_level
+    (settings.BOOST_TAP_NAME, 1000, 1000, 1, 1, 10),
+    (settings.BOOST_MAXIMIZER_NAME, 1000, 1000, 500, 500, 10),
+    (settings.BOOST_CHARGER_NAME, 1000, 1000, 1, 1, 10),
+]
+
+
+def generate_users(args):
+    rng = random.Random(args.seed)
+    for index in range(args.users):
+        referrer_id = None
+        if index and rng.random() < args.referral_share:
+            # Cubing skews the referrers towards early users
+            referrer_id = FIRST_USER_ID + int(index * rng.random() ** 3)
+        balance = min(int(rng.paretovariate(1.2) * 100), 10 ** 9)
+        yield (FIRST_USER_ID + index, f"bench_{index}", None, balance, None,
+               STARTED_AT + timedelta(seconds=index), True, referrer_id, 0)
+
+
+def generate_boost_levels(args, boosts):
+    rng = random.Random(args.seed + 1)
+    for index in range(args.users):
+        if rng.random() >= args.boost_share:
+            continue
+        for boost in boosts:
+            level = rng.randint(1, boost.max_level)
+            if level > 1:
+                yield FIRST_USER_ID + index, boost.id, level
+
+
+def generate_completed_tasks(args, task_ids):
+    rng = random.Random(args.seed + 2)
+    for index in range(args.users):
+        for task_id in rng.sample(task_ids, min(len(task_ids), int(rng.expovariate(1 / args.tasks_per_user)))):
+            yield FIRST_USER_ID + index, task_id
+
+
+async def copy(connection, table, columns, records):
+    # COPY through the asyncpg connection under the SQLAlchemy one, fed from a generator
+    raw = await connection.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(table, columns=columns, records=records)
+
+
+async def reset():
+    async with async_session_factory() as session:
+        await session.execute(delete(users_tasks).where(users_tasks.c.user_id >= FIRST_USER_ID))
+        await session.execute(delete(user_boost).where(user_boost.c.user_id >= FIRST_USER_ID))
+        await session.execute(delete(users_tasks).where(users_tasks.c.task_id >= FIRST_TASK_ID))
+        await session.execute(delete(User).where(User.id >= FIRST_USER_ID))
+        await session.execute(delete(Task).where(Task.id >= FIRST_TASK_ID))
+        await session.commit()
+
+
+async def seed_catalog(args):
+    async with async_session_factory() as session:
+        existing = set((await session.execute(select(Boost.name))).scalars())
+        missing = [boost for boost in DEFAULT_BOOSTS if boost[0] not in existing]
+        if missing:
+            await session.execute(insert(Boost), [
+                {"name": name, "base_cost": base_cost, "cost_per_level": cost_per_level, "base_value": base_value,
+                 "value_per_level": value_per_level, "max_level": max_level}
+                for name, base_cost, cost_per_level, base_value, value_per_level, max_level in missing
+            ])
+        await session.execute(insert(Task), [
+            {"id": FIRST_TASK_ID + index, "name": f"bench_task_{index}", "url": "https://t.me/", "icon": "bench",
+             "reward": 100 * (index + 1)}
+            for index in range(args.tasks)
+        ])
+        await session.commit()
+        boosts = (await session.execute(select(Boost))).scalars().all()
+    return boosts, [FIRST_TASK_ID + index for index in range(args.tasks)]
+
+
+async def main(args):
+    async_engine.echo = False
+    started = time.perf_counter()
+    await reset()
+    if args.reset:
+        print("synthetic data removed")
+        await async_engine.dispose()
+        return
+
+    boosts, task_ids = await seed_catalog(args)
+    async with async_engine.begin() as connection:
+        await copy(connection, "user", ["id", "username", "photo", "balance", "boosts_info", "joined_at", "is_active",
+                                        "referrer_id", "referral_count"], generate_users(args))
+        await copy(connection, "user_boost", ["user_id", "boost_id", "level"], generate_boost_levels(args, boosts))
+        await copy(connection, "users_tasks", ["user_id", "task_id"], generate_completed_tasks(args, task_ids))
+        await connection.execute(text("""
+            UPDATE "user" SET referral_count = counts.referrals
+            FROM (SELECT referrer_id, count(*) AS referrals FROM "user"
+                  WHERE id >= :first_user_id AND referrer_id IS NOT NULL GROUP BY referrer_id) AS counts
+            WHERE "user".id = counts.referrer_id
+        """), {"first_user_id": FIRST_USER_ID})
+    seeded = time.perf_counter() - started
+
+    async with async_engine.connect() as connection:
+        await connection.execution_options(isolation_level="AUTOCOMMIT")
+        for table in ("user", "user_boost", "users_tasks"):
+            await connection.execute(text(f'ANALYZE "{table}"'))
+
+    if args.redis:
+        from src.redis_client import close_redis, init_redis
+        from src.users.leaderboard import leaderboard, referral_leaderboard
+
+        await init_redis()
+        for board in (leaderboard, referral_leaderboard):
+            board.init_store()
+            await board.rebuild()
+        await close_redis()
+
+    await async_engine.dispose()
+    print(f"seeded {args.users} users, {args.tasks} tasks in {seeded:.1f}s "
+          f"({args.users / seeded:.0f} users/s), first user id {FIRST_USER_ID}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--referral-share", type=float, default=0.6, help="share of users with a referrer")
+    parser.add_argument("--boost-share", type=float, default=0.3, help="share of users with upgraded boosts")
+    parser.add_argument("--tasks-per-user", type=float, default=2.0, help="mean completed tasks per user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--redis", action="store_true")
+    parser.add_argument("--reset", action="store_true")
+    asyncio.run(main(parser.parse_args()))
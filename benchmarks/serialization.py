@@ -0,0 +1,91 @@
+"""
+Serialization cost of the GET /users/{user_id}/friends response for a large referral list.
+
+Compares the previous path (ReferralsGetScheme round trip per row, then FastAPI's jsonable_encoder and the
+stdlib JSONResponse), validation through the typed envelope with an orjson response, and the direct
+row-to-bytes path the endpoint uses now. Does not need Postgres, the rows are built in memory.
+Run from the repository root:
+    python -m benchmarks.serialization --referrals 10000
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
+
+from src.schemas import ResponseScheme
+from src.users.schemas import ReferralsGetScheme, UserFriendsDataScheme
+
+FIELDS = ["id", "username", "photo", "balance", "joined_at"]
+
+
+def make_rows(count):
+    rng = random.Random(42)
+    started = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    data = [(10 ** 9 + index, f"user_{index}", None if index % 3 else f"https://t.me/i/userpic/{index}.jpg",
+             rng.randrange(10 ** 7), started + timedelta(seconds=index, microseconds=rng.randrange(10 ** 6)))
+            for index in range(count)]
+    # Rows of the same type the friends query returns
+    return IteratorResult(SimpleResultMetaData(FIELDS), iter(data)).all()
+
+
+def envelope(referrals):
+    return {
+        "status": "success",
+        "message": "User found, referrals fetched",
+        "data": {"user_id": 1, "referrals": referrals, "total": len(referrals), "next_cursor": None}
+    }
+
+
+def previous(rows):
+    content = envelope([ReferralsGetScheme.model_validate(row).model_dump() for row in rows])
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def response_model(rows):
+    content = envelope([row._asdict() for row in rows])
+    model = ResponseScheme[UserFriendsDataScheme].model_validate(content)
+    return ORJSONResponse(model.model_dump(mode="json", exclude_unset=True)).body
+
+
+def direct(rows):
+    return ORJSONResponse(envelope([row._asdict() for row in rows])).body
+
+
+def measure(serialize, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        serialize(rows)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), min(timings)
+
+
+def main(args):
+    rows = make_rows(args.referrals)
+    paths = [("previous", previous), ("response_model", response_model), ("direct", direct)]
+
+    expected = json.loads(previous(rows))
+    for name, serialize in paths:
+        # Same document, only the encoding of the timestamps may differ between encoders
+        assert len(json.loads(serialize(rows))["data"]["referrals"]) == len(expected["data"]["referrals"]), name
+
+    print(f"{args.referrals} referrals, {args.repeat} runs, {len(direct(rows)) / 1024:.0f} KiB body")
+    print(f"{'':>16}  {'median ms':>10}  {'min ms':>8}  {'speedup':>8}")
+    baseline = None
+    for name, serialize in paths:
+        median, fastest = measure(serialize, rows, args.repeat)
+        baseline = baseline or median
+        print(f"{name:>16}  {median:10.2f}  {fastest:8.2f}  {baseline / median:7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--referrals", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
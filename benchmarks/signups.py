@@ -0,0 +1,132 @@
+"""
+Throughput of a burst of concurrent signups.
+
+Compares the previous create_user path (existence SELECT, referral UPDATE, INSERT, COMMIT and REFRESH
+per signup), a single INSERT ... ON CONFLICT statement per signup, and the signup queue coalescing the
+burst into multi-row statements. A share of the signups repeat an id of the burst, like clients
+retrying, and most are referred by an earlier user. Failed signups are the ones that raised, e.g.
+unique violations of racing duplicates. Needs the Postgres database from the settings with
+migrations applied. Run from the repository root:
+    python -m benchmarks.signups --signups 5000 --duplicates 0.2
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import delete, func, select
+
+from src.database import async_engine, async_session_factory
+from src.users.catalog import catalog
+from src.users.leaderboard import leaderboard, referral_leaderboard
+from src.users.models import User
+from src.users.queries import user_exists
+from src.users.service import create_users
+from src.users.signup_queue import SignupQueue
+
+FIRST_USER_ID = 10 ** 12
+REFERRERS = 100
+
+
+async def previous(user_id, username, referrer_id):
+    # create_user before the single-statement signup
+    async with async_session_factory() as session:
+        if await user_exists(session, user_id):
+            return None
+        new_user = User(id=user_id, username=username)
+        referral_count = await session.scalar(
+            User.__table__.update()
+            .where(User.id == referrer_id)
+            .values(referral_count=User.referral_count + 1)
+            .returning(User.referral_count)
+        )
+        if referral_count is not None:
+            new_user.referrer_id = referrer_id
+        session.add(new_user)
+        await session.commit()
+        await session.refresh(new_user)
+        return new_user
+
+
+async def single(user_id, username, referrer_id):
+    async with async_session_factory() as session:
+        rows = await create_users(session, [(user_id, username, referrer_id)])
+        await session.commit()
+    return rows[0] if rows else None
+
+
+def make_signups(args):
+    rng = random.Random(42)
+    first = FIRST_USER_ID + REFERRERS
+    signups = []
+    for index in range(args.signups):
+        user_id = first + (rng.randrange(index) if index and rng.random() < args.duplicates else index)
+        referrer_id = FIRST_USER_ID + rng.randrange(REFERRERS) if rng.random() < 0.8 else None
+        signups.append((user_id, f"bench_{user_id}", referrer_id))
+    return signups
+
+
+async def reset():
+    async with async_session_factory() as session:
+        await session.execute(delete(User).where(User.id >= FIRST_USER_ID))
+        await session.execute(User.__table__.insert(), [
+            {"id": FIRST_USER_ID + index, "username": f"bench_referrer_{index}", "balance": 0, "is_active": True}
+            for index in range(REFERRERS)
+        ])
+        await session.commit()
+
+
+async def run(signup, signups):
+    async def attempt(user_id, username, referrer_id):
+        try:
+            return await signup(user_id, username, referrer_id)
+        except Exception as error:
+            return error
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(attempt(*item) for item in signups))
+    elapsed = time.perf_counter() - started
+
+    async with async_session_factory() as session:
+        referrals = await session.scalar(
+            select(func.sum(User.referral_count)).where(User.id < FIRST_USER_ID + REFERRERS, User.id >= FIRST_USER_ID)
+        )
+    created = sum(1 for result in results if result is not None and not isinstance(result, Exception))
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    return elapsed, created, failed, referrals
+
+
+async def main(args):
+    async_engine.echo = False
+    await catalog.load()
+    for board in (leaderboard, referral_leaderboard):
+        board.init_store()
+    signups = make_signups(args)
+    unique = len({user_id for user_id, _, _ in signups})
+
+    queue = SignupQueue(max_batch=args.batch_size, max_delay=args.batch_delay)
+    cases = [("previous", previous), ("single", single), ("queue", lambda *signup: queue.submit(*signup))]
+    await queue.start()
+
+    print(f"{args.signups} concurrent signups of {unique} ids")
+    print(f"{'':>8}  {'seconds':>8}  {'signups/s':>9}  {'created':>7}  {'failed':>6}  {'referrals':>9}")
+    for name, signup in cases:
+        await reset()
+        elapsed, created, failed, referrals = await run(signup, signups)
+        print(f"{name:>8}  {elapsed:8.2f}  {args.signups / elapsed:9.0f}  {created:7d}  {failed:6d}  {referrals:9d}")
+    print(f"queue: {queue.batches} statements, {queue.inserted} users")
+
+    await queue.stop()
+    async with async_session_factory() as session:
+        await session.execute(delete(User).where(User.id >= FIRST_USER_ID))
+        await session.commit()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signups", type=int, default=5000)
+    parser.add_argument("--duplicates", type=float, default=0.2, help="share of signups repeating an earlier id")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--batch-delay", type=float, default=0.002)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,143 @@
+"""
+Tap storm load benchmark: per-tap balance writes versus the tap buffer.
+
+Needs the Postgres database from the settings with migrations applied. Run from the repository root:
+    python -m benchmarks.taps --users 500 --taps 50000 --concurrency 200
+Pass --redis to buffer in Redis instead of process memory.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import delete, event, insert, select, func
+
+from src.config import settings
+from src.database import async_engine, async_session_factory
+from src.users.models import User
+
+FIRST_USER_ID = 10 ** 12
+
+
+class WriteCounter:
+    def __init__(self):
+        self.updates = 0
+        self.commits = 0
+
+    def reset(self):
+        self.updates = self.commits = 0
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("UPDATE"):
+            self.updates += 1
+
+    def on_commit(self, conn):
+        self.commits += 1
+
+
+async def legacy_tap(user_id: int, tokens: int):
+    # The update_user_balance body before the tap buffer
+    async with async_session_factory() as session:
+        user = (await session.execute(select(User).where(User.id == user_id))).scalar()
+        user.balance += tokens
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+
+
+async def buffered_tap(user_id: int, tokens: int):
+    from src.users.tap_buffer import tap_buffer
+
+    async with async_session_factory() as session:
+        await session.scalar(select(User.balance).where(User.id == user_id))
+    await tap_buffer.add(user_id, tokens)
+
+
+async def storm(tap, taps, concurrency):
+    queue = asyncio.Queue()
+    for item in taps:
+        queue.put_nowait(item)
+
+    async def worker():
+        while not queue.empty():
+            user_id, tokens = queue.get_nowait()
+            await tap(user_id, tokens)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+async def total_balance(user_ids):
+    async with async_session_factory() as session:
+        return await session.scalar(select(func.sum(User.balance)).where(User.id.in_(user_ids)))
+
+
+async def reset_users(user_ids):
+    async with async_session_factory() as session:
+        await session.execute(delete(User).where(User.id.in_(user_ids)))
+        await session.execute(insert(User), [
+            {"id": user_id, "username": f"bench_{user_id}", "balance": 0, "boosts_info": {}, "is_active": True}
+            for user_id in user_ids
+        ])
+        await session.commit()
+
+
+async def main(args):
+    from src.redis_client import init_redis, close_redis
+    from src.users.tap_buffer import tap_buffer
+
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    rng = random.Random(42)
+    taps = [(rng.choice(user_ids), rng.randint(1, 10)) for _ in range(args.taps)]
+    expected = sum(tokens for _, tokens in taps)
+
+    async_engine.echo = False
+    counter = WriteCounter()
+    event.listen(async_engine.sync_engine, "before_cursor_execute", counter.on_execute)
+    event.listen(async_engine.sync_engine, "commit", counter.on_commit)
+
+    await reset_users(user_ids)
+    counter.reset()
+    legacy_elapsed = await storm(legacy_tap, taps, args.concurrency)
+    legacy_writes = (counter.updates, counter.commits)
+    # Concurrent read-modify-write loses updates, report it rather than failing
+    legacy_lost = expected - await total_balance(user_ids)
+
+    await reset_users(user_ids)
+    await init_redis()
+    await tap_buffer.start()
+    counter.reset()
+    buffered_elapsed = await storm(buffered_tap, taps, args.concurrency)
+    await tap_buffer.stop()
+    await close_redis()
+    buffered_writes = (counter.updates, counter.commits)
+    assert await total_balance(user_ids) == expected
+
+    async with async_session_factory() as session:
+        await session.execute(delete(User).where(User.id.in_(user_ids)))
+        await session.commit()
+    await async_engine.dispose()
+
+    print(f"{args.taps} taps over {args.users} users, concurrency {args.concurrency}, "
+          f"buffer backend: {'redis' if settings.REDIS_ENABLED else 'memory'}")
+    print(f"{'':>9}  {'taps/s':>9}  {'UPDATEs':>8}  {'COMMITs':>8}")
+    for name, elapsed, (updates, commits) in (
+        ("per-tap", legacy_elapsed, legacy_writes),
+        ("buffered", buffered_elapsed, buffered_writes),
+    ):
+        print(f"{name:>9}  {args.taps / elapsed:9.0f}  {updates:8d}  {commits:8d}")
+    print(f"tokens lost by per-tap read-modify-write: {legacy_lost}")
+    print(f"write reduction: {legacy_writes[0] / max(buffered_writes[0], 1):.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--taps", type=int, default=50_000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--redis", action="store_true")
+    arguments = parser.parse_args()
+
+    settings.REDIS_ENABLED = arguments.redis
+    asyncio.run(main(arguments))
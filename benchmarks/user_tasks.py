@@ -0,0 +1,126 @@
+"""
+/users/{user_id}/tasks: the previous three-query implementation versus the catalog and completed-set cache.
+
+Seeds 10k tasks and 1M users_tasks rows into the Postgres database from the settings (migrations applied),
+then removes them. Run from the repository root:
+    python -m benchmarks.user_tasks
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1234567890:benchmark-bot-token")
+
+import asyncpg  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+from src.config import settings  # noqa: E402
+from src.database import async_engine, async_session_factory  # noqa: E402
+from src.users.cache import completed_tasks_cache  # noqa: E402
+from src.users.catalog import catalog  # noqa: E402
+from src.users.models import User, Task, users_tasks  # noqa: E402
+from src.users.router import get_user_tasks  # noqa: E402
+from src.users.schemas import TasksGetScheme  # noqa: E402
+
+FIRST_USER_ID = 10 ** 12
+FIRST_TASK_ID = 10 ** 6
+
+
+async def legacy_get_user_tasks(user_id: int):
+    # The endpoint body before the rewrite
+    async with async_session_factory() as session:
+        user = (await session.execute(select(User).where(User.id == user_id))).scalar()
+        completed_tasks = (await session.execute(
+            select(Task).join(users_tasks).where(users_tasks.c.user_id == user_id)
+        )).scalars().all()
+        uncompleted_tasks = (await session.execute(
+            select(Task)
+            .outerjoin(users_tasks, (users_tasks.c.task_id == Task.id) & (users_tasks.c.user_id == user_id))
+            .where(users_tasks.c.user_id == None)  # noqa: E711
+        )).scalars().all()
+        return {
+            "user_id": user.id,
+            "completed_tasks": [TasksGetScheme.model_validate(task).model_dump() for task in completed_tasks],
+            "uncompleted_tasks": [TasksGetScheme.model_validate(task).model_dump() for task in uncompleted_tasks],
+        }
+
+
+async def seed(connection, users: int, tasks: int, rows: int):
+    await connection.copy_records_to_table("task", columns=["id", "name", "url", "icon", "reward"], records=[
+        (FIRST_TASK_ID + i, f"task {i}", f"https://t.me/task_{i}", "icon.png", 100) for i in range(tasks)
+    ])
+    await connection.copy_records_to_table("user", columns=["id", "username", "balance", "is_active"], records=[
+        (FIRST_USER_ID + i, f"bench_{i}", 0, True) for i in range(users)
+    ])
+    per_user = rows // users
+    rng = random.Random(42)
+    records = []
+    for i in range(users):
+        for task_id in rng.sample(range(tasks), per_user):
+            records.append((FIRST_USER_ID + i, FIRST_TASK_ID + task_id))
+    await connection.copy_records_to_table("users_tasks", columns=["user_id", "task_id"], records=records)
+    await connection.execute("ANALYZE users_tasks")
+
+
+async def cleanup(connection, users: int):
+    await connection.execute("DELETE FROM users_tasks WHERE user_id >= $1 AND user_id < $2",
+                             FIRST_USER_ID, FIRST_USER_ID + users)
+    await connection.execute('DELETE FROM "user" WHERE id >= $1 AND id < $2', FIRST_USER_ID, FIRST_USER_ID + users)
+    await connection.execute("DELETE FROM task WHERE id >= $1", FIRST_TASK_ID)
+
+
+async def measure(name, call, user_ids):
+    timings = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        await call(user_id)
+        timings.append(time.perf_counter() - started)
+    print(f"{name:>14}: p50 {statistics.median(timings) * 1000:8.2f} ms   "
+          f"p99 {statistics.quantiles(timings, n=100)[98] * 1000:8.2f} ms")
+
+
+async def main(args):
+    async_engine.echo = False
+    connection = await asyncpg.connect(user=settings.POSTGRES_USER, password=settings.POSTGRES_PASSWORD,
+                                       host=settings.POSTGRES_HOST, port=settings.POSTGRES_PORT,
+                                       database=settings.POSTGRES_DB)
+    await cleanup(connection, args.users)
+    await seed(connection, args.users, args.tasks, args.rows)
+    try:
+        await catalog.load()
+        rng = random.Random(7)
+        user_ids = [FIRST_USER_ID + rng.randrange(args.users) for _ in range(args.requests)]
+
+        async def cold(user_id):
+            completed_tasks_cache.local.clear()
+            await get_user_tasks(user_id, user_id)
+
+        async def warm(user_id):
+            await get_user_tasks(user_id, user_id)
+
+        print(f"{args.tasks} tasks, {args.rows} users_tasks rows, {args.requests} requests")
+        await measure("three queries", legacy_get_user_tasks, user_ids)
+        await measure("one query", cold, user_ids)
+        for user_id in user_ids:
+            await warm(user_id)
+        await measure("cached", warm, user_ids)
+    finally:
+        await cleanup(connection, args.users)
+        await connection.close()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--tasks", type=int, default=10_000)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=200)
+    arguments = parser.parse_args()
+
+    # The per-user completed set is kept in process memory so the benchmark needs no Redis
+    settings.REDIS_ENABLED = False
+    asyncio.run(main(arguments))
@@ -0,0 +1,91 @@
+"""
+Room fan-out benchmark: the old sequential pub/sub reader versus the queued fan-out of WebSocketManager.
+
+Sockets are in-memory fakes, so the numbers isolate the fan-out cost from the network and Redis.
+Run from the repository root:
+    python -m benchmarks.websocket_fanout
+"""
+import asyncio
+import statistics
+import time
+
+from src.users.websocket_manager import SocketSender, WebSocketManager
+
+ROOM_SIZES = (1, 100, 10_000)
+DELIVERIES_PER_ROOM = 200_000
+ROOM_ID = "user_1"
+
+
+class FakeSocket:
+    def __init__(self, latencies: list, delay: float = 0.0):
+        self.latencies = latencies
+        self.delay = delay
+
+    async def send_text(self, data: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.latencies.append(time.perf_counter() - float(data))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def legacy_fanout(sockets, messages):
+    # The reader loop before the rewrite: decode per socket and await every send in turn
+    for _ in range(messages):
+        message = {"channel": ROOM_ID.encode(), "data": str(time.perf_counter()).encode()}
+        await asyncio.sleep(0)
+        for socket in sockets:
+            data = message['data'].decode('utf-8')
+            await socket.send_text(data)
+
+
+async def queued_fanout(sockets, messages):
+    # Sockets are registered directly instead of through Redis, only the fan-out path is measured
+    manager = WebSocketManager()
+    manager.rooms[ROOM_ID] = {socket: SocketSender(socket, queue_size=32, policy="drop") for socket in sockets}
+
+    for _ in range(messages):
+        manager.dispatch(ROOM_ID, str(time.perf_counter()))
+        await asyncio.sleep(0)
+
+    senders = list(manager.rooms[ROOM_ID].values())
+    slow = [sender for sender in senders if sender.task is not None and not sender.task.done()]
+    for sender in slow:
+        sender.stop()
+    return sum(sender.dropped for sender in senders)
+
+
+async def run(fanout, room_size, messages, slow_socket):
+    latencies = []
+    sockets = [FakeSocket(latencies) for _ in range(room_size)]
+    if slow_socket:
+        sockets[0] = FakeSocket([], delay=0.01)
+
+    started = time.perf_counter()
+    dropped = await fanout(sockets, messages) or 0
+    elapsed = time.perf_counter() - started
+
+    p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+    return messages / elapsed, p99 * 1000, dropped
+
+
+async def main():
+    print(f"{'room':>6}  {'slow':>5}  {'reader':>7}  {'msg/s':>9}  {'p99 ms':>9}  {'dropped':>7}")
+    for room_size in ROOM_SIZES:
+        messages = max(20, DELIVERIES_PER_ROOM // room_size)
+        for slow_socket in (False, True):
+            if slow_socket and room_size == 1:
+                continue
+            for name, fanout in (("legacy", legacy_fanout), ("queued", queued_fanout)):
+                if name == "legacy" and slow_socket:
+                    # One 10 ms client serializes the whole room, keep the run short
+                    messages_run = min(messages, 100)
+                else:
+                    messages_run = messages
+                rate, p99, dropped = await run(fanout, room_size, messages_run, slow_socket)
+                print(f"{room_size:>6}  {str(slow_socket):>5}  {name:>7}  {rate:9.0f}  {p99:9.2f}  {dropped:>7}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,6 +4,10 @@ from src.admin.auth import AdminAuth
 from src.config import settings
 from src.database import async_engine
 from src.models import Token
+from src.token_stats import token_stats
+from src.users.cache import user_cache
+from src.users.catalog import catalog
+from src.users.leaderboard import leaderboard, referral_leaderboard
 from src.users.models import User, Boost, Task
 
 authentication_backend = AdminAuth(secret_key=settings.SECRET_KEY)
@@ -22,24 +26,48 @@ def init_admin(app):
         # can_edit = False
         # can_delete = False
 
+        async def after_model_change(self, data, model, is_created, request):
+            await user_cache.invalidate(model.id)
+            await leaderboard.update(model.id, model.balance)
+
+        async def after_model_delete(self, model, request):
+            await user_cache.invalidate(model.id)
+            await leaderboard.remove(model.id)
+            await referral_leaderboard.remove(model.id)
+
     class TaskAdmin(ModelView, model=Task):
         column_list = [Task.id, Task.name]
 
         # can_edit = False
         # can_delete = False
 
+        async def after_model_change(self, data, model, is_created, request):
+            await catalog.invalidate()
+
+        async def after_model_delete(self, model, request):
+            await catalog.invalidate()
+
     class BoostAdmin(ModelView, model=Boost):
         column_list = [Boost.id, Boost.name]
 
         # can_edit = False
         # can_delete = False
 
+        async def after_model_change(self, data, model, is_created, request):
+            await catalog.invalidate()
+
+        async def after_model_delete(self, model, request):
+            await catalog.invalidate()
+
     class TokenAdmin(ModelView, model=Token):
         column_list = [Token.id, Token.total_supply, Token.developers, Token.community, Token.mined]
 
         # can_edit = False
         # can_delete = False
 
+        async def after_model_change(self, data, model, is_created, request):
+            token_stats.cache.clear()
+
     admin.add_view(TokenAdmin)
     admin.add_view(UserAdmin)
     admin.add_view(TaskAdmin)
@@ -1,3 +1,5 @@
+from typing import List, Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -8,13 +10,82 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str
     POSTGRES_PORT: int
 
+    # host:port of streaming replicas of the primary, read with the same database and credentials
+    POSTGRES_REPLICAS: List[str] = []
+    REPLICA_MAX_LAG: float = 5.0
+    REPLICA_CHECK_INTERVAL: float = 2.0
+    READ_YOUR_WRITES_WINDOW: float = 10.0
+
+    DATABASE_ECHO: bool = False
+    DATABASE_POOL_SIZE: int = 20
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: float = 30.0
+    DATABASE_POOL_RECYCLE: int = 30 * 60
+    DATABASE_POOL_PRE_PING: bool = True
+    DATABASE_STATEMENT_TIMEOUT: int = 0  # Milliseconds, 0 disables it
+    DATABASE_PREPARED_STATEMENT_CACHE_SIZE: int = 500
+    DATABASE_JIT: bool = False
+    # PgBouncer in transaction pooling mode: no prepared statement reuse and no client-side pool
+    DATABASE_PGBOUNCER: bool = False
+
     REDIS_HOST: str
     REDIS_PORT: int
+    REDIS_ENABLED: bool = True
+    REDIS_MAX_CONNECTIONS: int = 32
 
     BOOST_TAP_NAME: str
     BOOST_MAXIMIZER_NAME: str
     BOOST_CHARGER_NAME: str
 
+    CATALOG_REFRESH_INTERVAL: float = 5.0
+    TASKS_CACHE_TTL: int = 300
+    TASKS_CACHE_SIZE: int = 100_000
+    TASKS_CACHE_TOMBSTONE_TTL: float = 2.0
+    USER_CACHE_TTL: int = 60
+    USER_CACHE_LOCAL_TTL: float = 1.0
+    USER_CACHE_SIZE: int = 100_000
+    USER_CACHE_TOMBSTONE_TTL: float = 2.0
+    REFERRALS_PAGE_SIZE: int = 50
+    REFERRALS_MAX_PAGE_SIZE: int = 200
+
+    # Share of earned tokens paid to the referrer, the referrer's referrer and so on, empty disables it
+    REFERRAL_COMMISSION_PERCENTS: List[float] = []
+
+    LEADERBOARD_SIZE: int = 100
+    LEADERBOARD_MAX_SIZE: int = 1000
+    LEADERBOARD_REBUILD_CHUNK_SIZE: int = 10_000
+
+    TOKEN_CACHE_TTL: float = 2.0
+    TOKEN_MINED_SHARDS: int = 16
+    TOKEN_FOLD_INTERVAL: float = 5.0
+
+    TAP_BUFFER_ENABLED: bool = True
+    TAP_FLUSH_INTERVAL: float = 1.0
+    TAP_FLUSH_THRESHOLD: int = 10_000
+    TAP_BATCH_STALE_AFTER: float = 60.0
+    # Must exceed the longest time an in-flight batch can wait to be replayed
+    TAP_APPLIED_BATCH_RETENTION: float = 7 * 24 * 3600.0
+    MINING_FLUSH_INTERVAL: float = 1.0
+
+    SIGNUP_BATCH_ENABLED: bool = True
+    SIGNUP_BATCH_SIZE: int = 500
+    SIGNUP_BATCH_DELAY: float = 0.002
+
+    LEDGER_ENABLED: bool = True
+    LEDGER_QUEUE_SIZE: int = 100_000
+    LEDGER_BATCH_SIZE: int = 10_000
+    LEDGER_RETRY_INTERVAL: float = 1.0
+
+    ENERGY_LIMIT_ENABLED: bool = True
+    ENERGY_STATE_SIZE: int = 100_000
+
+    WEBSOCKET_SEND_QUEUE_SIZE: int = 32
+    WEBSOCKET_SLOW_CONSUMER_POLICY: Literal["drop", "disconnect"] = "drop"
+
+    # Requests with this value in the X-Profile header are profiled, empty disables profiling
+    PROFILER_TOKEN: str = ""
+    PROFILER_INTERVAL: float = 0.001
+
     ADMIN_AUTH_TOKEN: str
     ADMIN_USERNAME: str
     ADMIN_PASSWORD: str
@@ -22,11 +93,18 @@ class Settings(BaseSettings):
     SECRET_KEY: str
 
     TELEGRAM_BOT_TOKEN: str
+    TELEGRAM_AUTH_MAX_AGE: int = 60 * 60
+    AUTH_CACHE_SIZE: int = 100_000
 
     @property
     def DATABASE_URL_asyncpg(self):
         return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
+    @property
+    def DATABASE_REPLICA_URLS_asyncpg(self) -> List[str]:
+        return [f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{replica}/{self.POSTGRES_DB}"
+                for replica in self.POSTGRES_REPLICAS]
+
     model_config = SettingsConfigDict(env_file=".env.dev")
 
 
@@ -1,16 +1,67 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from uuid import uuid4
+
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import NullPool
 from src.config import settings
 
-async_engine = create_async_engine(
-    url=settings.DATABASE_URL_asyncpg,
-    echo=True,
-    # pool_size=5,
-    # max_overflow=10,
-)
+
+def create_engine(url: str = None, **overrides) -> AsyncEngine:
+    """
+    Creates an async engine from the DATABASE_* settings.
+
+    Args:
+        url (str): Database URL, the primary from the settings by default.
+        overrides: Values replacing DATABASE_* settings, keyed by the lowercase name without the prefix,
+            e.g. pool_size=10 or pgbouncer=True.
+    """
+    options = {name[len("DATABASE_"):].lower(): value
+               for name, value in settings.model_dump().items() if name.startswith("DATABASE_")}
+    options.update(overrides)
+
+    server_settings = {}
+    if not options["jit"]:
+        server_settings["jit"] = "off"
+    if options["statement_timeout"]:
+        server_settings["statement_timeout"] = str(options["statement_timeout"])
+
+    if options["pgbouncer"]:
+        # Transaction pooling hands every transaction to any server connection: prepared statements can not
+        # be reused, and startup parameters are rejected, so jit and statement_timeout belong on the role
+        connect_args = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+        pool_args = {"poolclass": NullPool}
+    else:
+        connect_args = {
+            "statement_cache_size": options["prepared_statement_cache_size"],
+            "prepared_statement_cache_size": options["prepared_statement_cache_size"],
+            "server_settings": server_settings,
+        }
+        pool_args = {
+            "pool_size": options["pool_size"],
+            "max_overflow": options["max_overflow"],
+            "pool_timeout": options["pool_timeout"],
+            "pool_recycle": options["pool_recycle"],
+            "pool_pre_ping": options["pool_pre_ping"],
+        }
+
+    return create_async_engine(
+        url=url or settings.DATABASE_URL_asyncpg,
+        echo=options["echo"],
+        connect_args=connect_args,
+        **pool_args,
+    )
+
+
+async_engine = create_engine()
 
 async_session_factory = async_sessionmaker(async_engine)
 
+replica_engines = [create_engine(url) for url in settings.DATABASE_REPLICA_URLS_asyncpg]
+
 
 class Base(DeclarativeBase):
     pass
@@ -1,13 +1,51 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import select
 
 from src.admin.admin import init_admin
-from src.database import async_session_factory
-from src.models import Token
-from src.users.router import router as users_router
+from src.config import settings
+from src.database import async_engine
+from src.metrics import MetricsMiddleware, instrument_engine, metrics
+from src.redis_client import init_redis, close_redis, pool_stats
+from src.replicas import replica_router
+from src.responses import ORJSONResponse
+from src.token_stats import token_stats
+from src.users.cache import user_cache
+from src.users.catalog import catalog
+from src.users.energy import energy_limiter
+from src.users.leaderboard import leaderboard, referral_leaderboard
+from src.users.ledger import ledger
+from src.users.router import router as users_router, socket_manager
+from src.users.signup_queue import signup_queue
+from src.users.tap_buffer import tap_buffer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_redis()
+    await replica_router.start()
+    await catalog.start()
+    await leaderboard.start()
+    await referral_leaderboard.start()
+    await energy_limiter.start()
+    await token_stats.start()
+    await ledger.start()
+    await tap_buffer.start()
+    await signup_queue.start()
+    await socket_manager.start()
+    yield
+    await socket_manager.stop()
+    await signup_queue.stop()
+    await tap_buffer.stop()
+    await ledger.stop()
+    await token_stats.stop()
+    await catalog.stop()
+    await replica_router.stop()
+    await close_redis()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(users_router)
 init_admin(app)
 
@@ -23,27 +61,67 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+instrument_engine(async_engine)
+for replica in replica_router.replicas:
+    instrument_engine(replica.engine)
+
+
+def replica_samples(field: str) -> dict:
+    return {(f"{replica['host']}:{replica['port']}",): replica[field]
+            for replica in replica_router.stats()["replicas"] if replica[field] is not None}
+
+
+def user_cache_hits() -> dict:
+    stats = user_cache.stats()
+    return {("local",): stats["local_hits"], ("redis",): stats["redis_hits"]}
+
+
+metrics.register("redis_pool_connections", "Connections of the Redis connection pool by state.",
+                 lambda: {("in_use",): pool_stats()["connections_in_use"],
+                          ("available",): pool_stats()["connections_available"]},
+                 labels=("state",))
+metrics.register("websocket_rooms", "Rooms with at least one socket in this worker.",
+                 lambda: {(): socket_manager.stats()["rooms"]})
+metrics.register("websocket_connections", "Open WebSocket connections in this worker.",
+                 lambda: {(): socket_manager.stats()["sockets"]})
+metrics.register("redis_pubsub_subscriptions", "Redis channels the shared pub/sub connection is subscribed to.",
+                 lambda: {(): socket_manager.stats()["subscriptions"]})
+metrics.register("redis_pubsub_connected", "1 while the shared pub/sub connection is open.",
+                 lambda: {(): socket_manager.stats()["connected"]})
+metrics.register("db_replica_healthy", "1 while a replica serves reads.",
+                 lambda: {labels: int(healthy) for labels, healthy in replica_samples("healthy").items()},
+                 labels=("replica",))
+metrics.register("db_replica_lag_seconds", "Replay lag of a replica at its last check.",
+                 lambda: replica_samples("lag"), labels=("replica",))
+metrics.register("db_reads_total", "Read-only sessions by the database they were routed to.",
+                 lambda: {("replica",): replica_router.stats()["replica_reads"],
+                          ("primary",): replica_router.stats()["primary_reads"]},
+                 labels=("target",), kind="counter")
+metrics.register("user_cache_hits_total", "User payloads served from the cache by layer.", user_cache_hits,
+                 labels=("layer",), kind="counter")
+metrics.register("user_cache_loads_total", "User payloads built from the database.",
+                 lambda: {(): user_cache.stats()["loads"]}, kind="counter")
+metrics.register("user_cache_local_entries", "User payloads and tombstones kept in process memory.",
+                 lambda: {(): user_cache.stats()["local_size"]})
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.expose(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.get("/token")
-async def get_token_info():
-    async with async_session_factory() as session:
-        result = await session.execute(select(Token).limit(1))
-        token = result.scalars().first()
-        if token is None:
-            return {"status": "error", "message": "Token info is not set"}
-
-    return {
-        "status": "success",
-        "message": "Token info is fetched successfully",
-        "data": {
-            "total_supply": token.total_supply,
-            "total_supply_percent": 100,
-            "developers": token.developers,
-            "developers_percent": (token.developers / token.total_supply) * 100,
-            "community": token.community,
-            "community_percent": (token.community / token.total_supply) * 100,
-            "mined": token.mined,
-            "mined_percent": (token.mined / token.total_supply) * 100,
-        }
-    }
+async def get_token_info(request: Request):
+    token = await token_stats.get()
+    if token is None:
+        return {"status": "error", "message": "Token info is not set"}
+
+    etag, body = token
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={int(settings.TOKEN_CACHE_TTL)}"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or
+                          etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
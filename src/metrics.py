@@ -0,0 +1,341 @@
+import bisect
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.config import settings
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+class RequestStats:
+    """
+        Work done on behalf of the current request, collected from the database, Redis and response hooks.
+    """
+
+    __slots__ = ("db_queries", "db_seconds", "redis_calls", "redis_seconds", "serialization_seconds")
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.redis_calls = 0
+        self.redis_seconds = 0.0
+        self.serialization_seconds = 0.0
+
+
+# Tasks started while handling a request inherit it, their work is counted towards the request
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class Histogram:
+    """
+        Prometheus histogram with one set of cumulative buckets per label values.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): HELP text.
+        labels (tuple): Label names.
+        buckets (tuple): Upper bounds of the buckets, +Inf is implied.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Label values -> [bucket counts..., +Inf count, sum]
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, values: Tuple[str, ...], value: float) -> None:
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for values, series in sorted(self.series.items()):
+            labels = ",".join(f'{name}="{escape(value)}"' for name, value in zip(self.labels, values))
+            separator = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{labels}{separator}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """
+        Prometheus gauge or counter whose samples are read from a callback at scrape time, for state
+        other modules already keep, like pool sizes or cache hit counts.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): HELP text.
+        kind (str): "gauge" or "counter".
+        labels (tuple): Label names.
+        collect (Callable): Returns a mapping of label values to the current value.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, labels: Sequence[str],
+                 collect: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def expose(self) -> List[str]:
+        try:
+            samples = self.collect()
+        except Exception:
+            # A broken collector must not fail the whole scrape
+            logger.exception("Failed to collect %s", self.name)
+            return []
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in sorted(samples.items()):
+            labels = ",".join(f'{name}="{escape(str(label))}"' for name, label in zip(self.labels, values))
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """
+        Per-route request metrics of this worker, exposed in the Prometheus text format. Every worker
+        keeps its own series, so the scrape of a multi-worker deployment should target the workers
+        individually.
+    """
+
+    def __init__(self):
+        self.duration = Histogram("http_request_duration_seconds", "Request latency.",
+                                  ("method", "route", "status"), LATENCY_BUCKETS)
+        self.db_queries = Histogram("http_request_db_queries", "Database round trips per request.",
+                                    ("method", "route"), COUNT_BUCKETS)
+        self.db_duration = Histogram("http_request_db_duration_seconds", "Time spent in database calls per request.",
+                                     ("method", "route"), LATENCY_BUCKETS)
+        self.redis_calls = Histogram("http_request_redis_calls", "Redis commands and pipelines per request.",
+                                     ("method", "route"), COUNT_BUCKETS)
+        self.redis_duration = Histogram("http_request_redis_duration_seconds", "Time spent in Redis calls per request.",
+                                        ("method", "route"), LATENCY_BUCKETS)
+        self.serialization_duration = Histogram("http_request_serialization_duration_seconds",
+                                                "Time spent encoding response bodies per request.",
+                                                ("method", "route"), LATENCY_BUCKETS)
+        self.histograms = [self.duration, self.db_queries, self.db_duration, self.redis_calls, self.redis_duration,
+                           self.serialization_duration]
+        self.collected: List[CallbackMetric] = []
+
+    def register(self, name: str, documentation: str, collect: Callable[[], Dict[Tuple[str, ...], float]],
+                 labels: Sequence[str] = (), kind: str = "gauge") -> None:
+        """
+        Adds a metric read from collect() on every scrape, see CallbackMetric.
+        """
+        self.collected.append(CallbackMetric(name, documentation, kind, labels, collect))
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        self.duration.observe((method, route, str(status)), seconds)
+        labels = (method, route)
+        self.db_queries.observe(labels, stats.db_queries)
+        self.db_duration.observe(labels, stats.db_seconds)
+        self.redis_calls.observe(labels, stats.redis_calls)
+        self.redis_duration.observe(labels, stats.redis_seconds)
+        self.serialization_duration.observe(labels, stats.serialization_seconds)
+
+    def expose(self) -> str:
+        return "\n".join(line for metric in self.histograms + self.collected for line in metric.expose()) + "\n"
+
+
+metrics = Metrics()
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Counts the statements an engine executes and their time towards the current request.
+    """
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        stats = current_request.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += time.perf_counter() - started
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("metrics_started"):
+            context.connection.info["metrics_started"].pop()
+
+
+@contextmanager
+def track_redis() -> Iterator[None]:
+    stats = current_request.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.redis_calls += 1
+            stats.redis_seconds += time.perf_counter() - started
+
+
+@contextmanager
+def track_serialization() -> Iterator[None]:
+    stats = current_request.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.serialization_seconds += time.perf_counter() - started
+
+
+class StackSampler:
+    """
+        Samples the stack of the event loop thread from a background thread, used to profile a request
+        when pyinstrument is not installed. Samples include whatever else the loop runs concurrently.
+
+    Args:
+        interval (float): Seconds between samples.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def output_text(self) -> str:
+        """
+        Returns:
+            str: Stacks in the collapsed format of flame graph tools, most sampled first.
+        """
+        total = sum(self.samples.values())
+        lines = [f"# {total} samples every {self.interval * 1000:g} ms"]
+        lines.extend(f"{stack} {count}" for stack, count in self.samples.most_common())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+        ASGI middleware recording the metrics of every HTTP request under the path template of its route.
+
+        A request carrying the X-Profile header with the value of PROFILER_TOKEN is profiled, and the
+        profile replaces its response body. The status the endpoint responded with is returned in the
+        X-Profile-Status header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if settings.PROFILER_TOKEN and self._profile_requested(scope):
+            await self._profile(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request.reset(token)
+            route = scope.get("route")
+            metrics.observe(scope["method"], getattr(route, "path", "unmatched"), status,
+                            time.perf_counter() - started, stats)
+
+    @staticmethod
+    def _profile_requested(scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return value.decode("latin-1") == settings.PROFILER_TOKEN
+        return False
+
+    async def _profile(self, scope, receive, send):
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        if Profiler is not None:
+            profiler = Profiler(interval=settings.PROFILER_INTERVAL, async_mode="enabled")
+            profiler.start()
+            try:
+                await self.app(scope, receive, discard)
+            finally:
+                profiler.stop()
+            body = profiler.output_text(unicode=True, color=False).encode()
+        else:
+            sampler = StackSampler(settings.PROFILER_INTERVAL)
+            sampler.start()
+            try:
+                await self.app(scope, receive, discard)
+            finally:
+                # Joins the sampler thread, which wakes up within one interval
+                sampler.stop()
+            body = sampler.output_text().encode()
+
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+            (b"x-profile-status", str(status).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,77 @@
+from typing import Optional
+
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline
+
+from src.config import settings
+from src.metrics import track_redis
+
+redis_client: Optional[aioredis.Redis] = None
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        with track_redis():
+            return await super().execute(raise_on_error)
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """
+        Redis client counting its commands and pipelines towards the request metrics.
+    """
+
+    async def execute_command(self, *args, **options):
+        with track_redis():
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+async def init_redis() -> None:
+    """
+    Creates the process-wide Redis client, called once from the application lifespan.
+    """
+    global redis_client
+    if settings.REDIS_ENABLED and redis_client is None:
+        pool = aioredis.BlockingConnectionPool(host=settings.REDIS_HOST, port=settings.REDIS_PORT,
+                                               max_connections=settings.REDIS_MAX_CONNECTIONS)
+        redis_client = InstrumentedRedis(connection_pool=pool)
+
+
+async def close_redis() -> None:
+    """
+    Closes the process-wide Redis client and its connection pool.
+    """
+    global redis_client
+    if redis_client is not None:
+        await redis_client.aclose()
+        await redis_client.connection_pool.disconnect()
+        redis_client = None
+
+
+def get_redis() -> aioredis.Redis:
+    """
+    Returns the process-wide Redis client.
+
+    Returns:
+        aioredis.Redis: Redis client sharing a single connection pool.
+    """
+    if redis_client is None:
+        raise RuntimeError("Redis client is not initialized")
+    return redis_client
+
+
+def pool_stats() -> dict:
+    """
+    Returns connection counts of the process-wide Redis connection pool.
+    """
+    if redis_client is None:
+        return {"connections_in_use": 0, "connections_available": 0}
+
+    # redis-py has no public counters, these are private attributes of its ConnectionPool (5.x)
+    pool = redis_client.connection_pool
+    return {
+        "connections_in_use": len(getattr(pool, "_in_use_connections", ())),
+        "connections_available": len(getattr(pool, "_available_connections", ())),
+    }
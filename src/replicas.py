@@ -0,0 +1,194 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from src.cache import TTLCache
+from src.config import settings
+from src.database import async_session_factory, replica_engines
+from src.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Seconds of WAL the replica has received but not replayed yet, 0 when it is caught up or not a replica
+REPLICA_LAG = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica:
+    __slots__ = ("engine", "session_factory", "healthy", "lag")
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.session_factory = async_sessionmaker(engine)
+        self.healthy = False
+        self.lag: Optional[float] = None
+
+
+class ReplicaRouter:
+    """
+        Routes sessions of read-only endpoints to streaming replicas.
+
+        A background task measures the replay lag of every replica, reads go round-robin to the replicas
+        within max_lag and to the primary when there is none. A user who changed their data in the last
+        window seconds reads from the primary, so they always see their own writes. The window is shared
+        through Redis, as the next request of the user may land on another worker.
+
+    Args:
+        engines (list): Engines of the replicas, reads use the primary only when empty.
+        max_lag (float): Replay lag in seconds above which a replica is skipped.
+        check_interval (float): Seconds between lag checks.
+        window (float): Seconds a user reads from the primary after a write.
+    """
+
+    RECENT_WRITE_PREFIX = "recent_write:"
+
+    def __init__(self, engines: List[AsyncEngine], max_lag: float, check_interval: float, window: float):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.window = window
+        self.recent_writes = TTLCache(maxsize=100_000, ttl=window)
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self._next = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if not self.replicas:
+            return
+        await self.check()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    async def mark_write(self, user_id: int) -> None:
+        await self.mark_writes([user_id])
+
+    async def mark_writes(self, user_ids: Iterable[int]) -> None:
+        """
+        Starts the read-your-writes window of users, called after a committed change. Every user whose
+        cached payload is invalidated needs it, or a load from a lagging replica refills the cache.
+        """
+        if not self.replicas:
+            return
+        user_ids = set(user_ids)
+        for user_id in user_ids:
+            self.recent_writes.set(user_id, True)
+        if settings.REDIS_ENABLED and user_ids:
+            try:
+                async with get_redis().pipeline(transaction=False) as pipe:
+                    for user_id in user_ids:
+                        pipe.set(f"{self.RECENT_WRITE_PREFIX}{user_id}", 1, px=int(self.window * 1000))
+                    await pipe.execute()
+            except Exception:
+                logger.exception("Failed to share the recent writes of %d users", len(user_ids))
+
+    async def _wrote_recently(self, user_id: int) -> bool:
+        if self.recent_writes.get(user_id):
+            return True
+        if settings.REDIS_ENABLED:
+            try:
+                return bool(await get_redis().exists(f"{self.RECENT_WRITE_PREFIX}{user_id}"))
+            except Exception:
+                logger.exception("Failed to read the recent writes of user %d", user_id)
+                return True
+        return False
+
+    async def pick(self, user_id: Optional[int] = None) -> Optional[Replica]:
+        """
+        Returns:
+            Replica: Replica to read from, None to read from the primary.
+        """
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy or (user_id is not None and await self._wrote_recently(user_id)):
+            return None
+        self._next += 1
+        return healthy[self._next % len(healthy)]
+
+    @asynccontextmanager
+    async def session(self, user_id: Optional[int] = None) -> AsyncIterator[AsyncSession]:
+        """
+        Opens a session for read-only work.
+
+        Args:
+            user_id (int): User whose data is read, keeps their reads on the primary right after a write.
+        """
+        session = None
+        replica = await self.pick(user_id)
+        if replica is not None:
+            session = replica.session_factory()
+            try:
+                await session.connection()
+            except (OSError, DBAPIError, asyncio.TimeoutError):
+                logger.warning("Replica %s is unreachable, reading from the primary", replica.engine.url.host)
+                replica.healthy = False
+                await session.close()
+                session = None
+
+        if session is None:
+            self.primary_reads += 1
+            session = async_session_factory()
+        else:
+            self.replica_reads += 1
+
+        async with session:
+            yield session
+
+    async def check(self) -> None:
+        """
+        Measures the lag of every replica and updates which ones serve reads.
+        """
+        for replica in self.replicas:
+            try:
+                async with replica.engine.connect() as connection:
+                    replica.lag = float(await asyncio.wait_for(connection.scalar(REPLICA_LAG), self.check_interval))
+            except Exception:
+                if replica.healthy:
+                    logger.warning("Replica %s failed its health check", replica.engine.url.host)
+                replica.healthy, replica.lag = False, None
+                continue
+
+            healthy = replica.lag <= self.max_lag
+            if replica.healthy != healthy:
+                logger.warning("Replica %s lag is %.1fs, %s", replica.engine.url.host, replica.lag,
+                               "serving reads" if healthy else "reading from the primary")
+            replica.healthy = healthy
+
+    def stats(self) -> dict:
+        return {
+            "replicas": [{"host": replica.engine.url.host, "port": replica.engine.url.port,
+                          "healthy": replica.healthy, "lag": replica.lag} for replica in self.replicas],
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Replica health check failed")
+
+
+replica_router = ReplicaRouter(
+    engines=replica_engines,
+    max_lag=settings.REPLICA_MAX_LAG,
+    check_interval=settings.REPLICA_CHECK_INTERVAL,
+    window=settings.READ_YOUR_WRITES_WINDOW,
+)
+read_session = replica_router.session
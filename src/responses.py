@@ -0,0 +1,15 @@
+from typing import Any
+
+from fastapi.responses import ORJSONResponse as BaseORJSONResponse
+
+from src.metrics import track_serialization
+
+
+class ORJSONResponse(BaseORJSONResponse):
+    """
+        ORJSONResponse that counts the time spent encoding its body towards the request metrics.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with track_serialization():
+            return super().render(content)
@@ -0,0 +1,15 @@
+from typing import Generic, Literal, Optional, TypeVar
+
+from pydantic import BaseModel
+
+DataT = TypeVar("DataT")
+
+
+class ResponseScheme(BaseModel, Generic[DataT]):
+    """
+        Envelope every endpoint responds with, error responses carry no data.
+    """
+
+    status: Literal["success", "error"]
+    message: str
+    data: Optional[DataT] = None
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import logging
+import random
+from typing import Optional, Tuple
+
+import orjson
+from sqlalchemy import select, update
+
+from src.cache import TTLCache
+from src.config import settings
+from src.database import async_session_factory
+from src.models import Token
+from src.redis_client import get_redis
+from src.replicas import read_session
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStats:
+    """
+        Keeps Token.mined up to date from the balance changes and serves the /token payload from a
+        short-TTL cache.
+
+        Mined tokens are added to a per-worker counter, or to one of several Redis counters so that
+        concurrent increments from all workers do not contend on a single key, and are periodically
+        folded into the token row with one UPDATE.
+
+    Args:
+        fold_interval (float): Seconds between folds of the counters into the token row.
+        shards (int): Number of Redis counters.
+        cache_ttl (float): Seconds the /token payload is cached.
+    """
+
+    SHARD_PREFIX = "token:mined:"
+
+    def __init__(self, fold_interval: float, shards: int, cache_ttl: float):
+        self.fold_interval = fold_interval
+        self.shards = shards
+        self.cache = TTLCache(maxsize=1, ttl=cache_ttl)
+        self.pending = 0
+        self._stopping: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the background folder after a final fold.
+        """
+        if self._task is None:
+            return
+        # Not cancelled, a cancel landing between taking the counters and the UPDATE would lose them
+        self._stopping.set()
+        await self._task
+        self._task = None
+        await self.fold()
+
+    async def add_mined(self, tokens: int) -> None:
+        """
+        Counts tokens earned by taps, tasks and referral commissions. Spends and negative deltas are
+        not counted, so mined only grows.
+        """
+        if tokens <= 0:
+            return
+        if not settings.REDIS_ENABLED:
+            self.pending += tokens
+            return
+
+        try:
+            await get_redis().incrby(f"{self.SHARD_PREFIX}{random.randrange(self.shards)}", tokens)
+        except Exception:
+            logger.exception("Failed to count %d mined tokens", tokens)
+
+    async def _take(self) -> int:
+        if not settings.REDIS_ENABLED:
+            tokens, self.pending = self.pending, 0
+            return tokens
+
+        # Read and reset atomically, so concurrent folds of other workers never count a shard twice
+        async with get_redis().pipeline(transaction=True) as pipe:
+            for shard in range(self.shards):
+                pipe.getdel(f"{self.SHARD_PREFIX}{shard}")
+            values = await pipe.execute()
+        return sum(int(value) for value in values if value is not None)
+
+    async def _give_back(self, tokens: int) -> None:
+        if not settings.REDIS_ENABLED:
+            self.pending += tokens
+            return
+        await get_redis().incrby(f"{self.SHARD_PREFIX}0", tokens)
+
+    async def fold(self) -> int:
+        """
+        Adds the counted tokens to the token row.
+
+        Returns:
+            int: Number of tokens folded.
+        """
+        tokens = await self._take()
+        if not tokens:
+            return 0
+
+        try:
+            async with async_session_factory() as session:
+                result = await session.execute(
+                    update(Token)
+                    .where(Token.id == select(Token.id).order_by(Token.id).limit(1).scalar_subquery())
+                    .values(mined=Token.mined + tokens)
+                )
+                await session.commit()
+        except BaseException:
+            await self._give_back(tokens)
+            raise
+
+        if not result.rowcount:
+            # No token row yet, the tokens are kept until an admin creates it
+            await self._give_back(tokens)
+            return 0
+
+        self.cache.clear()
+        return tokens
+
+    async def get(self) -> Optional[Tuple[str, bytes]]:
+        """
+        Returns the /token payload.
+
+        Returns:
+            tuple: ETag and serialized JSON body, None if the token row does not exist.
+        """
+        cached = self.cache.get("token")
+        if cached is not None:
+            return cached
+
+        async with read_session() as session:
+            token = Token.__table__
+            result = await session.execute(
+                select(token.c.total_supply, token.c.developers, token.c.community, token.c.mined)
+                .order_by(token.c.id)
+                .limit(1)
+            )
+            token = result.first()
+            if token is None:
+                return None
+
+        body = orjson.dumps({
+            "status": "success",
+            "message": "Token info is fetched successfully",
+            "data": {
+                "total_supply": token.total_supply,
+                "total_supply_percent": 100,
+                "developers": token.developers,
+                "developers_percent": (token.developers / token.total_supply) * 100,
+                "community": token.community,
+                "community_percent": (token.community / token.total_supply) * 100,
+                "mined": token.mined,
+                "mined_percent": (token.mined / token.total_supply) * 100,
+            }
+        })
+        cached = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"', body
+        self.cache.set("token", cached)
+        return cached
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.fold_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.fold()
+            except Exception:
+                logger.exception("Failed to fold mined tokens into the token row")
+
+
+token_stats = TokenStats(
+    fold_interval=settings.TOKEN_FOLD_INTERVAL,
+    shards=settings.TOKEN_MINED_SHARDS,
+    cache_ttl=settings.TOKEN_CACHE_TTL,
+)
@@ -0,0 +1,68 @@
+"""
+Recomputes User.referral_count from the referrer links and rebuilds the referral leaderboard.
+
+Users are processed in keyset batches, each in its own short transaction, and only rows whose counter
+is off are written. Run from the repository root:
+    python -m src.tools.backfill_referral_counts --batch-size 10000
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from src.config import settings
+from src.database import async_engine
+from src.redis_client import close_redis, init_redis
+from src.users.leaderboard import referral_leaderboard
+
+NEXT_BATCH = text('SELECT max(id) FROM (SELECT id FROM "user" WHERE id > :lower ORDER BY id LIMIT :limit) AS batch')
+
+BACKFILL = text("""
+    UPDATE "user" SET referral_count = counts.count
+    FROM (
+        SELECT referrer.id, count(referral.id) AS count
+        FROM "user" referrer
+        LEFT JOIN "user" referral ON referral.referrer_id = referrer.id
+        WHERE referrer.id > :lower AND referrer.id <= :upper
+        GROUP BY referrer.id
+    ) AS counts
+    WHERE "user".id = counts.id AND "user".referral_count <> counts.count
+""")
+
+
+async def backfill(batch_size: int) -> int:
+    fixed = 0
+    async with async_engine.connect() as connection:
+        lower = (await connection.execute(text('SELECT min(id) - 1 FROM "user"'))).scalar()
+        await connection.commit()
+        while lower is not None:
+            upper = (await connection.execute(NEXT_BATCH, {"lower": lower, "limit": batch_size})).scalar()
+            if upper is None:
+                break
+            result = await connection.execute(BACKFILL, {"lower": lower, "upper": upper})
+            await connection.commit()
+            fixed += result.rowcount
+            lower = upper
+    return fixed
+
+
+async def main(args):
+    started = time.perf_counter()
+    fixed = await backfill(args.batch_size)
+    print(f"Fixed {fixed} referral counters in {time.perf_counter() - started:.1f}s")
+
+    if settings.REDIS_ENABLED:
+        await init_redis()
+        try:
+            referral_leaderboard.init_store()
+            print(f"Ranked {await referral_leaderboard.rebuild()} referrers")
+        finally:
+            await close_redis()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+"""
+Folds new balance_event rows into per-user checkpoints and reconciles User.balance with the ledger.
+
+A run takes the id of the last committed event as its watermark, then walks the users in keyset
+batches, each one statement in its own short transaction. For every user the events between the
+checkpoint and the watermark are added to the checkpoint, and the result is compared with
+User.balance. Events of committed changes can still be queued in a worker, so a difference is only
+trusted once the next run finds the same one. The ledger is then completed with an adjustment
+event, e.g. for balances from before the ledger, events lost with a killed worker or admin edits.
+Run from the repository root every few minutes, e.g. from cron:
+    python -m src.tools.compact_ledger --batch-size 10000 --retention-days 90
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from src.database import async_engine
+from src.users.ledger import ADJUSTMENT
+
+NEXT_BATCH = text('SELECT max(id) FROM (SELECT id FROM "user" WHERE id > :lower ORDER BY id LIMIT :limit) AS batch')
+
+COMPACT = text("""
+    WITH folded AS (
+        SELECT u.id AS user_id, u.balance, c.user_id IS NOT NULL AS checkpointed,
+            coalesce(c.balance, 0) + coalesce(events.delta, 0) AS ledger,
+            coalesce(events.last_id, c.event_id, 0) AS event_id, coalesce(c.drift, 0) AS drift
+        FROM "user" u
+        LEFT JOIN balance_checkpoint c ON c.user_id = u.id
+        LEFT JOIN LATERAL (
+            SELECT sum(e.delta) AS delta, max(e.id) AS last_id FROM balance_event e
+            WHERE e.user_id = u.id AND e.id > coalesce(c.event_id, 0) AND e.id <= :watermark
+        ) AS events ON true
+        WHERE u.id > :lower AND u.id <= :upper
+    ), adjusted AS (
+        INSERT INTO balance_event (user_id, delta, reason, ts)
+        SELECT user_id, balance - ledger, :adjustment, now() FROM folded
+        WHERE balance <> ledger AND balance - ledger = drift
+        RETURNING user_id
+    ), saved AS (
+        -- The adjustment is folded by the next run, until then the drift is cleared
+        INSERT INTO balance_checkpoint (user_id, balance, event_id, drift)
+        SELECT user_id, ledger, event_id, CASE WHEN balance - ledger = drift THEN 0 ELSE balance - ledger END
+        FROM folded
+        WHERE checkpointed OR balance <> 0 OR ledger <> 0
+        ON CONFLICT (user_id) DO UPDATE SET balance = excluded.balance, event_id = excluded.event_id,
+            drift = excluded.drift
+        RETURNING drift
+    )
+    SELECT (SELECT count(*) FROM adjusted) AS adjusted, (SELECT count(*) FROM saved WHERE drift <> 0) AS drifting
+""")
+
+PRUNE = text("""
+    DELETE FROM balance_event e USING balance_checkpoint c
+    WHERE e.user_id = c.user_id AND e.id <= c.event_id AND e.ts < now() - make_interval(days => :days)
+""")
+
+
+async def watermark(connection) -> int:
+    # SHARE mode waits for the COPYs in progress and holds new ones for the moment the maximum is read,
+    # so no event below the watermark can commit later
+    await connection.execute(text("LOCK TABLE balance_event IN SHARE MODE"))
+    last_id = (await connection.execute(text("SELECT coalesce(max(id), 0) FROM balance_event"))).scalar()
+    await connection.commit()
+    return last_id
+
+
+async def compact(batch_size: int):
+    adjusted = drifting = 0
+    async with async_engine.connect() as connection:
+        last_id = await watermark(connection)
+        lower = (await connection.execute(text('SELECT min(id) - 1 FROM "user"'))).scalar()
+        await connection.commit()
+        while lower is not None:
+            upper = (await connection.execute(NEXT_BATCH, {"lower": lower, "limit": batch_size})).scalar()
+            if upper is None:
+                break
+            row = (await connection.execute(COMPACT, {"lower": lower, "upper": upper, "watermark": last_id,
+                                                      "adjustment": ADJUSTMENT})).one()
+            await connection.commit()
+            adjusted += row.adjusted
+            drifting += row.drifting
+            lower = upper
+    return last_id, adjusted, drifting
+
+
+async def prune(days: int) -> int:
+    async with async_engine.begin() as connection:
+        return (await connection.execute(PRUNE, {"days": days})).rowcount
+
+
+async def main(args):
+    started = time.perf_counter()
+    last_id, adjusted, drifting = await compact(args.batch_size)
+    print(f"Compacted events up to {last_id}: {adjusted} balances reconciled with an adjustment, "
+          f"{drifting} differing from the ledger to be checked by the next run, "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    if args.retention_days is not None:
+        print(f"Pruned {await prune(args.retention_days)} compacted events older than {args.retention_days} days")
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--retention-days", type=int, help="delete compacted events older than this, kept by default")
+    asyncio.run(main(parser.parse_args()))
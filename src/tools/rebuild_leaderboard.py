@@ -0,0 +1,33 @@
+"""
+Rebuilds the shared balance and referral leaderboard sorted sets from Postgres.
+
+Run from the repository root, e.g. from cron, after restoring a backup or when Redis lost its data:
+    python -m src.tools.rebuild_leaderboard
+"""
+import asyncio
+import time
+
+from src.config import settings
+from src.database import async_engine
+from src.redis_client import close_redis, init_redis
+from src.users.leaderboard import leaderboard, referral_leaderboard
+
+
+async def main():
+    if not settings.REDIS_ENABLED:
+        raise SystemExit("Redis is disabled, every worker rebuilds its in-process leaderboards at startup")
+
+    await init_redis()
+    try:
+        for board in (leaderboard, referral_leaderboard):
+            started = time.perf_counter()
+            board.init_store()
+            total = await board.rebuild()
+            print(f"{board.key}: ranked {total} users in {time.perf_counter() - started:.1f}s")
+    finally:
+        await close_redis()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
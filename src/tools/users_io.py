@@ -0,0 +1,226 @@
+"""
+Exports users with their completed tasks and boost levels to files, and imports them into another database.
+
+Rows are streamed with COPY in CSV or Postgres binary format, so memory stays flat whatever the number
+of users. An export reads the three tables from one snapshot. Boost levels are written with the boost
+name, since boost ids differ between environments, and referral counters are left out.
+
+An import copies the files into temporary tables and merges them with set-based statements in one
+transaction: users first without referrers, then the referrer links of all imported users at once, so
+the files need no particular order. Completed tasks and boost levels are matched against the task and
+boost catalogs of the target database, with --on-conflict update the boost levels of the imported users
+missing from the file go back to level 1, and the referral counters of the affected users, including the
+previous referrers of relinked users, are recomputed.
+Run from the repository root:
+    python -m src.tools.users_io export backup/ --format binary
+    python -m src.tools.users_io import backup/ --format binary --on-conflict update
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from src.config import settings
+from src.database import async_engine
+from src.redis_client import close_redis, init_redis
+from src.users.leaderboard import leaderboard, referral_leaderboard
+
+# File name, query exporting it, staging table and the query giving its column types
+TABLES = [
+    (
+        "users",
+        'SELECT id, username, photo, balance, joined_at, is_active, referrer_id FROM "user" ORDER BY id',
+        "import_user",
+        'SELECT id, username, photo, balance, joined_at, is_active, referrer_id FROM "user"',
+    ),
+    (
+        "users_tasks",
+        "SELECT user_id, task_id FROM users_tasks ORDER BY user_id, task_id",
+        "import_user_task",
+        "SELECT user_id, task_id FROM users_tasks",
+    ),
+    (
+        "user_boosts",
+        "SELECT ub.user_id, b.name, ub.level FROM user_boost ub JOIN boost b ON b.id = ub.boost_id "
+        "ORDER BY ub.user_id, b.name",
+        "import_user_boost",
+        "SELECT ub.user_id, b.name, ub.level FROM user_boost ub JOIN boost b ON b.id = ub.boost_id",
+    ),
+]
+
+MERGE_USERS = {
+    "skip": """
+        INSERT INTO "user" (id, username, photo, balance, joined_at, is_active)
+        SELECT id, username, photo, balance, joined_at, is_active FROM import_user
+        ON CONFLICT (id) DO NOTHING
+    """,
+    "update": """
+        INSERT INTO "user" (id, username, photo, balance, joined_at, is_active)
+        SELECT id, username, photo, balance, joined_at, is_active FROM import_user
+        ON CONFLICT (id) DO UPDATE SET username = excluded.username, photo = excluded.photo,
+            balance = excluded.balance, joined_at = excluded.joined_at, is_active = excluded.is_active
+    """,
+}
+
+# Skipped users keep their referrer, referrers missing from both the file and the database are dropped
+LINK_REFERRERS = """
+    UPDATE "user" SET referrer_id = import_user.referrer_id
+    FROM import_user
+    JOIN "user" referrer ON referrer.id = import_user.referrer_id
+    WHERE "user".id = import_user.id AND import_user.id <> import_user.referrer_id
+        AND "user".referrer_id IS DISTINCT FROM import_user.referrer_id
+        AND ($1 OR "user".id IN (SELECT id FROM import_user_new))
+"""
+
+MERGE_TASKS = """
+    INSERT INTO users_tasks (user_id, task_id)
+    SELECT i.user_id, i.task_id FROM import_user_task i
+    JOIN "user" u ON u.id = i.user_id
+    JOIN task t ON t.id = i.task_id
+    ON CONFLICT (user_id, task_id) DO NOTHING
+"""
+
+# Only levels above 1 are stored, a missing row means level 1
+MERGE_BOOSTS = {
+    "skip": """
+        INSERT INTO user_boost (user_id, boost_id, level)
+        SELECT i.user_id, b.id, least(i.level, b.max_level) FROM import_user_boost i
+        JOIN "user" u ON u.id = i.user_id
+        JOIN boost b ON b.name = i.name
+        WHERE i.level > 1
+        ON CONFLICT (user_id, boost_id) DO NOTHING
+    """,
+    "update": """
+        INSERT INTO user_boost (user_id, boost_id, level)
+        SELECT i.user_id, b.id, least(i.level, b.max_level) FROM import_user_boost i
+        JOIN "user" u ON u.id = i.user_id
+        JOIN boost b ON b.name = i.name
+        WHERE i.level > 1
+        ON CONFLICT (user_id, boost_id) DO UPDATE SET level = excluded.level
+    """,
+}
+
+# Updated users go back to level 1 for the boosts the file has no level above 1 for
+RESET_BOOSTS = """
+    DELETE FROM user_boost ub
+    USING import_user i, boost b
+    WHERE ub.user_id = i.id AND b.id = ub.boost_id
+        AND NOT EXISTS (SELECT FROM import_user_boost ib WHERE ib.user_id = ub.user_id AND ib.name = b.name
+                        AND ib.level > 1)
+"""
+
+# Referrers of the existing imported users before the merge, relinked users leave one behind
+SAVE_PREVIOUS_REFERRERS = """
+    CREATE TEMP TABLE import_previous_referrer ON COMMIT DROP AS
+    SELECT DISTINCT "user".referrer_id AS id FROM "user"
+    JOIN import_user ON import_user.id = "user".id
+    WHERE "user".referrer_id IS NOT NULL
+"""
+
+RECOUNT_REFERRALS = """
+    UPDATE "user" SET referral_count = counts.count
+    FROM (
+        SELECT referrer.id, count(referral.id) AS count
+        FROM "user" referrer
+        LEFT JOIN "user" referral ON referral.referrer_id = referrer.id
+        WHERE referrer.id IN (SELECT id FROM import_user UNION SELECT referrer_id FROM import_user
+                              UNION SELECT id FROM import_previous_referrer)
+        GROUP BY referrer.id
+    ) AS counts
+    WHERE "user".id = counts.id AND "user".referral_count <> counts.count
+"""
+
+
+def file_path(directory: str, name: str, file_format: str) -> str:
+    return os.path.join(directory, f"{name}.{'csv' if file_format == 'csv' else 'bin'}")
+
+
+def copy_options(file_format: str) -> dict:
+    return {"format": "csv", "header": True} if file_format == "csv" else {"format": "binary"}
+
+
+def affected(status: str) -> int:
+    # Command tag of the driver, e.g. "INSERT 0 42" or "UPDATE 42"
+    return int(status.rsplit(" ", 1)[-1])
+
+
+async def export(directory: str, file_format: str) -> None:
+    os.makedirs(directory, exist_ok=True)
+    async with async_engine.connect() as connection:
+        driver = (await connection.get_raw_connection()).driver_connection
+        # One snapshot for the three files, COPY streams the rows to them as the server produces them
+        async with driver.transaction(isolation="repeatable_read", readonly=True):
+            await driver.execute("SET LOCAL statement_timeout = 0")
+            for name, query, _, _ in TABLES:
+                started = time.perf_counter()
+                path = file_path(directory, name, file_format)
+                status = await driver.copy_from_query(query, output=path, **copy_options(file_format))
+                print(f"{name}: exported {affected(status)} rows to {path} in {time.perf_counter() - started:.1f}s")
+
+
+async def import_(directory: str, file_format: str, on_conflict: str) -> None:
+    async with async_engine.connect() as connection:
+        driver = (await connection.get_raw_connection()).driver_connection
+        async with driver.transaction():
+            await driver.execute("SET LOCAL statement_timeout = 0")
+            for name, _, staging, columns in TABLES:
+                started = time.perf_counter()
+                path = file_path(directory, name, file_format)
+                # Same column types as the source, which binary COPY requires
+                await driver.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS {columns} WITH NO DATA")
+                status = await driver.copy_to_table(staging, source=path, **copy_options(file_format))
+                await driver.execute(f"ANALYZE {staging}")
+                print(f"{name}: read {affected(status)} rows from {path} in {time.perf_counter() - started:.1f}s")
+
+            started = time.perf_counter()
+            await driver.execute("""
+                CREATE TEMP TABLE import_user_new ON COMMIT DROP AS
+                SELECT id FROM import_user WHERE NOT EXISTS (SELECT FROM "user" WHERE "user".id = import_user.id)
+            """)
+            await driver.execute(SAVE_PREVIOUS_REFERRERS)
+            users = affected(await driver.execute(MERGE_USERS[on_conflict]))
+            linked = affected(await driver.execute(LINK_REFERRERS, on_conflict == "update"))
+            tasks = affected(await driver.execute(MERGE_TASKS))
+            reset = affected(await driver.execute(RESET_BOOSTS)) if on_conflict == "update" else 0
+            boosts = affected(await driver.execute(MERGE_BOOSTS[on_conflict]))
+            recounted = affected(await driver.execute(RECOUNT_REFERRALS))
+            print(f"Merged {users} users, {linked} referrer links, {tasks} completed tasks, {boosts} boost levels "
+                  f"(reset {reset}) and fixed {recounted} referral counters in {time.perf_counter() - started:.1f}s")
+
+        for table in ("user", "users_tasks", "user_boost"):
+            await driver.execute(f'ANALYZE "{table}"')
+
+
+async def main(args):
+    started = time.perf_counter()
+    if args.command == "export":
+        await export(args.directory, args.format)
+    else:
+        await import_(args.directory, args.format, args.on_conflict)
+
+        if settings.REDIS_ENABLED:
+            # Cached user payloads expire within USER_CACHE_TTL, other workers rebuild in-process boards at startup
+            await init_redis()
+            try:
+                for board in (leaderboard, referral_leaderboard):
+                    board.init_store()
+                    print(f"{board.key}: ranked {await board.rebuild()} users")
+            finally:
+                await close_redis()
+    await async_engine.dispose()
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ("export", "import"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("directory", help="directory holding users, users_tasks and user_boosts files")
+        subparser.add_argument("--format", choices=["csv", "binary"], default="binary",
+                               help="binary is faster, csv can be read and edited by other tools")
+    subparsers.choices["import"].add_argument(
+        "--on-conflict", choices=["skip", "update"], default="skip",
+        help="keep users that already exist, or overwrite their fields, referrer and boost levels",
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, Optional
+
+import orjson
+
+from src.cache import TTLCache
+from src.config import settings
+from src.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class CompletedTasksCache:
+    """
+        Per-user sets of completed task ids, kept in Redis so a completion is visible to every worker,
+        or in process memory when Redis is disabled.
+
+        Like UserCache, a completion writes a short-lived tombstone and loads only fill a key that holds
+        nothing, so a set read before a completion committed can not be stored after its invalidation.
+
+    Args:
+        ttl (int): Seconds a cached set is kept.
+        maxsize (int): Maximum number of users kept in process memory.
+        tombstone_ttl (float): Seconds after an invalidation during which loads are not cached.
+    """
+
+    TOMBSTONE = b""
+
+    def __init__(self, ttl: int, maxsize: int, tombstone_ttl: float):
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"user:{user_id}:completed_tasks"
+
+    async def get(self, user_id: int) -> Optional[FrozenSet[int]]:
+        if not settings.REDIS_ENABLED:
+            task_ids = self.local.get(user_id)
+            return task_ids if task_ids != self.TOMBSTONE else None
+
+        # A JSON array, the tombstone and a missing key are both a miss
+        payload = await get_redis().get(self._key(user_id))
+        if not payload:
+            return None
+        return frozenset(orjson.loads(payload))
+
+    async def set(self, user_id: int, task_ids: Iterable[int]) -> None:
+        """
+        Caches the set loaded from Postgres, unless the user was invalidated in the meantime.
+        """
+        task_ids = frozenset(task_ids)
+        if not settings.REDIS_ENABLED:
+            if self.local.get(user_id) is None:
+                self.local.set(user_id, task_ids)
+            return
+
+        try:
+            await get_redis().set(self._key(user_id), orjson.dumps(sorted(task_ids)), ex=self.ttl, nx=True)
+        except Exception:
+            logger.exception("Failed to cache the completed tasks of user %d", user_id)
+
+    async def invalidate(self, user_id: int) -> None:
+        if not settings.REDIS_ENABLED:
+            self.local.set(user_id, self.TOMBSTONE, ttl=self.tombstone_ttl)
+            return
+        await get_redis().set(self._key(user_id), self.TOMBSTONE, px=int(self.tombstone_ttl * 1000))
+
+
+completed_tasks_cache = CompletedTasksCache(ttl=settings.TASKS_CACHE_TTL, maxsize=settings.TASKS_CACHE_SIZE,
+                                            tombstone_ttl=settings.TASKS_CACHE_TOMBSTONE_TTL)
+
+
+class UserCache:
+    """
+        Serialized GET /users/{user_id} responses, in a process-local LRU in front of Redis.
+
+        Mutations invalidate a user by writing a short-lived tombstone, and loads only fill a key that
+        holds nothing, so a load that raced with a write can not store the old state. Concurrent misses
+        for the same user in a worker share one load. With Redis enabled the local copy lives for
+        local_ttl only, as invalidations of other workers do not reach it.
+
+    Args:
+        ttl (int): Seconds a payload is cached.
+        local_ttl (float): Seconds a payload is kept in process memory in front of Redis.
+        maxsize (int): Maximum number of users kept in process memory.
+        tombstone_ttl (float): Seconds after an invalidation during which loads are not cached.
+    """
+
+    TOMBSTONE = b""
+
+    def __init__(self, ttl: int, local_ttl: float, maxsize: int, tombstone_ttl: float):
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.redis_hits = 0
+        self.loads = 0
+        self._loading: Dict[int, asyncio.Future] = {}
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"user:{user_id}:payload"
+
+    async def get_or_load(self, user_id: int, load: Callable[[], Awaitable[Optional[bytes]]]) -> Optional[bytes]:
+        """
+        Returns the cached payload of a user, loading it on a miss.
+
+        Args:
+            load: Coroutine function building the payload, returns None if the user does not exist.
+        """
+        payload = self.local.get(user_id)
+        if payload:
+            return payload
+
+        if payload is None and settings.REDIS_ENABLED:
+            try:
+                payload = await get_redis().get(self._key(user_id))
+            except Exception:
+                logger.exception("Failed to read the cached payload of user %d", user_id)
+            if payload:
+                self.redis_hits += 1
+                self.local.set(user_id, payload, ttl=self.local_ttl)
+                return payload
+
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(user_id, load))
+            self._loading[user_id] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        # A cancelled request must not cancel the load other requests wait for
+        return await asyncio.shield(loading)
+
+    async def _load(self, user_id: int, load: Callable[[], Awaitable[Optional[bytes]]]) -> Optional[bytes]:
+        self.loads += 1
+        payload = await load()
+        if payload is None:
+            return None
+
+        if settings.REDIS_ENABLED:
+            try:
+                if await get_redis().set(self._key(user_id), payload, ex=self.ttl, nx=True):
+                    self.local.set(user_id, payload, ttl=self.local_ttl)
+            except Exception:
+                logger.exception("Failed to cache the payload of user %d", user_id)
+        elif self.local.get(user_id) is None:
+            self.local.set(user_id, payload)
+        return payload
+
+    async def invalidate(self, user_id: int) -> None:
+        await self.invalidate_many([user_id])
+
+    async def invalidate_many(self, user_ids: Iterable[int]) -> None:
+        """
+        Drops the cached payloads of users, called after their changes are committed. A failure is
+        logged, the payloads then expire after ttl.
+        """
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+
+        for user_id in user_ids:
+            self.local.set(user_id, self.TOMBSTONE, ttl=self.tombstone_ttl)
+        if not settings.REDIS_ENABLED:
+            return
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.set(self._key(user_id), self.TOMBSTONE, px=int(self.tombstone_ttl * 1000))
+                await pipe.execute()
+        except Exception:
+            logger.exception("Failed to invalidate the cached payloads of %d users", len(user_ids))
+
+    def stats(self) -> dict:
+        return {"local_hits": self.local.hits, "redis_hits": self.redis_hits, "loads": self.loads,
+                "local_size": len(self.local)}
+
+
+user_cache = UserCache(ttl=settings.USER_CACHE_TTL, local_ttl=settings.USER_CACHE_LOCAL_TTL,
+                       maxsize=settings.USER_CACHE_SIZE, tombstone_ttl=settings.USER_CACHE_TOMBSTONE_TTL)
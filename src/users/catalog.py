@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+
+from src.config import settings
+from src.database import async_session_factory
+from src.redis_client import get_redis
+from src.users.models import Boost, Task
+from src.users.schemas import TasksGetScheme
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class BoostEntry:
+    id: int
+    name: str
+    description: Optional[str]
+    base_cost: int
+    cost_per_level: int
+    base_value: int
+    value_per_level: int
+    max_level: int
+
+    def upgrade_cost(self, level: int) -> int:
+        return self.base_cost + self.cost_per_level * (level - 1)
+
+    def value(self, level: int) -> int:
+        return self.base_value + self.value_per_level * (level - 1)
+
+
+@dataclass(frozen=True, slots=True)
+class TaskEntry:
+    id: int
+    name: str
+    description: Optional[str]
+    url: str
+    icon: str
+    reward: int
+
+
+def entry_columns(entry, model) -> list:
+    """
+    Returns the table columns of the model named like the fields of an entry, in field order.
+    """
+    return [model.__table__.c[field.name] for field in fields(entry)]
+
+
+class Catalog:
+    """
+        In-process copy of the Boost and Task tables, which only change through the admin panel.
+
+        Every worker reloads its copy when the shared version counter in Redis moves,
+        the admin views bump it after each change. Without Redis the version counts the changes
+        made in this process, so values derived from the catalog can be tagged with it.
+
+    Args:
+        refresh_interval (float): Seconds between checks of the shared version counter.
+    """
+
+    VERSION_KEY = "catalog:version"
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self.boosts: List[BoostEntry] = []
+        self.boosts_by_id: Dict[int, BoostEntry] = {}
+        self.boosts_by_name: Dict[str, BoostEntry] = {}
+        self.tasks: List[TaskEntry] = []
+        self.tasks_by_id: Dict[int, TaskEntry] = {}
+        self.task_payloads: Dict[int, dict] = {}
+        self.version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def load(self) -> None:
+        """
+        Reads both tables and swaps in the new copy.
+        """
+        async with async_session_factory() as session:
+            boosts = await session.execute(select(*entry_columns(BoostEntry, Boost)).order_by(Boost.__table__.c.id))
+            boosts = [BoostEntry(*row) for row in boosts]
+            tasks = await session.execute(select(*entry_columns(TaskEntry, Task)).order_by(Task.__table__.c.id))
+            tasks = [TaskEntry(*row) for row in tasks]
+
+        self.boosts = boosts
+        self.boosts_by_id = {boost.id: boost for boost in boosts}
+        self.boosts_by_name = {boost.name: boost for boost in boosts}
+        self.tasks = tasks
+        self.tasks_by_id = {task.id: task for task in tasks}
+        # Tasks are serialized once per load instead of on every request
+        self.task_payloads = {task.id: TasksGetScheme.model_validate(task).model_dump() for task in tasks}
+
+    async def start(self) -> None:
+        self.version = await self._get_version()
+        await self.load()
+        if settings.REDIS_ENABLED:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def invalidate(self) -> None:
+        """
+        Reloads this worker's copy and tells the other workers to reload theirs.
+        """
+        if settings.REDIS_ENABLED:
+            version = await get_redis().incr(self.VERSION_KEY)
+        else:
+            version = (self.version or 0) + 1
+        # The version moves after the load, so values derived from the old copy never get the new one
+        await self.load()
+        self.version = version
+
+    def get_boost(self, boost_id: int) -> Optional[BoostEntry]:
+        return self.boosts_by_id.get(boost_id)
+
+    def get_boost_by_name(self, name: str) -> Optional[BoostEntry]:
+        return self.boosts_by_name.get(name)
+
+    def get_task(self, task_id: int) -> Optional[TaskEntry]:
+        return self.tasks_by_id.get(task_id)
+
+    def boosts_info(self, levels: Optional[Dict[int, int]] = None) -> dict:
+        """
+        Builds the boosts info of a user from the catalog.
+
+        Args:
+            levels (dict): Mapping of boost id to level, boosts missing from it are at level 1.
+        """
+        levels = levels or {}
+        return {
+            boost.name: {
+                "id": boost.id,
+                "level": levels.get(boost.id, 1),
+                "base_value": boost.base_value,
+                "value_per_level": boost.value_per_level,
+                "base_upgrade_cost": boost.base_cost,
+                "upgrade_cost_per_level": boost.cost_per_level,
+                "max_level": boost.max_level
+            }
+            for boost in self.boosts
+        }
+
+    def boost_value(self, name: str, levels: Optional[Dict[int, int]] = None) -> int:
+        """
+        Returns the effective value of a boost for the given levels, 0 if the boost does not exist.
+        """
+        boost = self.boosts_by_name.get(name)
+        if boost is None:
+            return 0
+        return boost.value((levels or {}).get(boost.id, 1))
+
+    async def _get_version(self) -> Optional[int]:
+        if not settings.REDIS_ENABLED:
+            return None
+        version = await get_redis().get(self.VERSION_KEY)
+        return int(version) if version is not None else 0
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                version = await self._get_version()
+                if version != self.version:
+                    await self.load()
+                    self.version = version
+            except Exception:
+                logger.exception("Failed to refresh the boost and task catalog")
+
+
+catalog = Catalog(refresh_interval=settings.CATALOG_REFRESH_INTERVAL)
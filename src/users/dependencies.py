@@ -1,49 +1,106 @@
 import hashlib
 import hmac
+import json
 import time
 from typing import Annotated
 from urllib.parse import parse_qs
 
-from fastapi import Header, HTTPException
+from fastapi import Header, HTTPException, WebSocket, WebSocketException, status
 
+from src.cache import TTLCache
 from src.config import settings
 
 
-async def check_auth_header(Authentication: Annotated[str, Header()]):
-    init_data = Authentication.split(" ")
-    if len(init_data) != 2:
-        raise HTTPException(status_code=400, detail="Invalid Authentication header")
+def _get_bot_secret_key(bot_token: str):
+    if not bot_token:
+        return None
+    return hmac.new("WebAppData".encode(), bot_token.encode(), hashlib.sha256).digest()
 
-    init_data = parse_qs(init_data[1])
 
-    bot_token = settings.TELEGRAM_BOT_TOKEN
-    if not bot_token:
+# The WebAppData secret only depends on the bot token, so it is derived once at startup
+bot_secret_key = _get_bot_secret_key(settings.TELEGRAM_BOT_TOKEN)
+
+# Verified Authentication headers keyed by their digest, each entry expires at auth_date + TELEGRAM_AUTH_MAX_AGE
+auth_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, clock=time.time)
+
+
+def verify_init_data(init_data_string: str):
+    """
+    Validates Telegram WebApp initData and returns the Telegram user id with the auth_date timestamp.
+
+    Args:
+        init_data_string (str): Query string part of the Authentication header.
+    """
+    if bot_secret_key is None:
         raise HTTPException(status_code=500, detail="Bot token is not set")
 
-    hash_value = init_data.get('hash', [None])[0]
+    init_data = parse_qs(init_data_string)
+
+    hash_value = init_data.pop('hash', [None])[0]
     if not hash_value:
         raise HTTPException(status_code=400, detail="Hash is missing from initData")
-    init_data.pop('hash', None)
 
     auth_date = init_data.get('auth_date', [None])[0]
     if not auth_date:
         raise HTTPException(status_code=400, detail="auth_date is missing from initData")
 
-    auth_timestamp = int(auth_date)
-    current_timestamp = int(time.time())
-    time_difference = current_timestamp - auth_timestamp
-    one_hour = 60 * 60
-    if time_difference > one_hour:
+    data_check_string = "\n".join(f"{key}={value[0]}" for key, value in sorted(init_data.items()))
+    calculated_hash = hmac.new(bot_secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+
+    if not hmac.compare_digest(calculated_hash, hash_value):
+        raise HTTPException(status_code=400, detail="Invalid hash")
+
+    telegram_id = None
+    if 'user' in init_data:
+        telegram_id = json.loads(init_data['user'][0]).get('id')
+    elif 'id' in init_data:
+        telegram_id = init_data['id'][0]
+
+    return int(telegram_id) if telegram_id is not None else None, int(auth_date)
+
+
+def authenticate(authentication: str):
+    """
+    Verifies an Authentication header value and returns the Telegram user id.
+
+    Args:
+        authentication (str): Header value in the form "<scheme> <initData>".
+    """
+    init_data = authentication.split(" ")
+    if len(init_data) != 2:
+        raise HTTPException(status_code=400, detail="Invalid Authentication header")
+
+    cache_key = hashlib.blake2b(init_data[1].encode(), digest_size=16).digest()
+    telegram_id = auth_cache.get(cache_key)
+    if telegram_id is not None:
+        return telegram_id
+
+    telegram_id, auth_timestamp = verify_init_data(init_data[1])
+
+    expires_at = auth_timestamp + settings.TELEGRAM_AUTH_MAX_AGE
+    if time.time() > expires_at:
         # raise HTTPException(status_code=400, detail="Telegram data is older than 5 minutes")
         pass
+    elif telegram_id is not None:
+        auth_cache.set(cache_key, telegram_id, expires_at=expires_at)
 
-    data_check_string = "\n".join(f"{key}={value[0]}" for key, value in sorted(init_data.items()))
+    return telegram_id
 
-    secret_key = hmac.new("WebAppData".encode(), bot_token.encode(), hashlib.sha256).digest()
-    calculated_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
 
-    if calculated_hash != hash_value:
-        raise HTTPException(status_code=400, detail="Invalid hash")
+async def check_auth_header(Authentication: Annotated[str, Header()]):
+    return authenticate(Authentication)
 
-    telegram_id = init_data.get('id', None)
-    return telegram_id
+
+async def check_websocket_auth(websocket: WebSocket):
+    """
+    Authenticates a WebSocket handshake, browsers cannot set headers on WebSockets,
+    so the initData may also be passed in the "authentication" query parameter.
+    """
+    authentication = websocket.headers.get("Authentication") or websocket.query_params.get("authentication")
+    if not authentication:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Authentication is missing")
+
+    try:
+        return authenticate(authentication)
+    except HTTPException as e:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
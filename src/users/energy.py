@@ -0,0 +1,225 @@
+import logging
+import math
+import time
+from typing import Dict, Optional, Tuple
+
+from src.cache import TTLCache
+from src.config import settings
+from src.redis_client import get_redis
+from src.users.catalog import catalog
+
+logger = logging.getLogger(__name__)
+
+# Capacity from the maximizer boost, energy regenerated per second from the charger boost and tokens
+# earned per unit of energy from the tap boost
+Limits = Tuple[int, int, int]
+
+# (tokens credited, energy left or None when not limited)
+Charge = Tuple[int, Optional[float]]
+
+# Seconds a full bucket is kept after it regenerated, afterwards it starts full again anyway
+IDLE_TTL = 60.0
+
+
+def limits_from_boost_levels(levels: Dict[int, int]) -> Limits:
+    return (
+        catalog.boost_value(settings.BOOST_MAXIMIZER_NAME, levels),
+        catalog.boost_value(settings.BOOST_CHARGER_NAME, levels),
+        max(catalog.boost_value(settings.BOOST_TAP_NAME, levels), 1),
+    )
+
+
+def bucket_ttl(capacity: int, regen_rate: int, energy: float) -> Optional[float]:
+    # Without regeneration an expired bucket would refill the energy at once
+    if regen_rate <= 0:
+        return None
+    return (capacity - energy) / regen_rate + IDLE_TTL
+
+
+class MemoryEnergyStore:
+    """
+        Keeps the energy buckets in process memory, used when Redis is disabled.
+    """
+
+    def __init__(self, maxsize: int):
+        # user_id -> [energy, updated_at, capacity, regen_rate, tap_value, catalog version of the limits],
+        # limits are None when unknown
+        self.buckets = TTLCache(maxsize=maxsize)
+
+    async def consume(self, user_id: int, tokens: int, limits: Optional[Limits],
+                      version: Optional[int]) -> Optional[Charge]:
+        now = time.monotonic()
+        bucket = self.buckets.get(user_id)
+        if limits is None:
+            if bucket is None or bucket[2] is None or bucket[5] != version:
+                return None
+            limits = bucket[2], bucket[3], bucket[4]
+        capacity, regen_rate, tap_value = limits
+
+        if bucket is None:
+            energy = float(capacity)
+        else:
+            energy = min(capacity, bucket[0] + regen_rate * max(0.0, now - bucket[1]))
+        credited = max(0, min(tokens, math.floor(energy * tap_value)))
+        energy -= credited / tap_value
+
+        self.buckets.set(user_id, [energy, now, capacity, regen_rate, tap_value, version],
+                         ttl=bucket_ttl(capacity, regen_rate, energy))
+        return credited, energy
+
+    async def refund(self, user_id: int, tokens: int) -> None:
+        bucket = self.buckets.get(user_id)
+        if bucket is None or bucket[2] is None:
+            return
+        bucket[0] = min(bucket[2], bucket[0] + tokens / bucket[4])
+
+    async def reset_limits(self, user_id: int) -> None:
+        bucket = self.buckets.get(user_id)
+        if bucket is not None:
+            bucket[2] = bucket[3] = bucket[4] = None
+
+
+class RedisEnergyStore:
+    """
+        Keeps the energy buckets in Redis hashes shared by all workers. A Lua script refills and
+        charges a bucket atomically on the Redis clock, so concurrent taps of a user on different
+        workers can not spend the same energy twice.
+    """
+
+    PREFIX = "energy:"
+
+    # KEYS[1]: bucket, ARGV: tokens, then capacity, regen_rate and tap_value or empty strings when unknown,
+    # idle TTL and the catalog version the limits belong to
+    CONSUME = """
+        local now = redis.call('TIME')
+        now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'energy', 'updated_at', 'capacity', 'regen_rate', 'tap_value',
+                                  'version')
+        local capacity, regen_rate, tap_value
+        if ARGV[2] ~= '' then
+            capacity, regen_rate, tap_value = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+        elseif bucket[3] and bucket[6] == ARGV[6] then
+            capacity, regen_rate, tap_value = tonumber(bucket[3]), tonumber(bucket[4]), tonumber(bucket[5])
+        else
+            return false
+        end
+
+        local energy = capacity
+        if bucket[1] then
+            energy = math.min(capacity, tonumber(bucket[1]) + regen_rate * math.max(0, now - tonumber(bucket[2])))
+        end
+        local credited = math.max(0, math.min(tonumber(ARGV[1]), math.floor(energy * tap_value)))
+        energy = energy - credited / tap_value
+
+        redis.call('HSET', KEYS[1], 'energy', tostring(energy), 'updated_at', tostring(now),
+                   'capacity', capacity, 'regen_rate', regen_rate, 'tap_value', tap_value, 'version', ARGV[6])
+        if regen_rate > 0 then
+            redis.call('PEXPIRE', KEYS[1], math.ceil(((capacity - energy) / regen_rate + tonumber(ARGV[5])) * 1000))
+        else
+            redis.call('PERSIST', KEYS[1])
+        end
+        return {credited, tostring(energy)}
+    """
+
+    # KEYS[1]: bucket, ARGV[1]: tokens
+    REFUND = """
+        local bucket = redis.call('HMGET', KEYS[1], 'energy', 'capacity', 'tap_value')
+        if bucket[1] and bucket[2] then
+            local energy = math.min(tonumber(bucket[2]), tonumber(bucket[1]) + tonumber(ARGV[1]) / tonumber(bucket[3]))
+            redis.call('HSET', KEYS[1], 'energy', tostring(energy))
+        end
+    """
+
+    def __init__(self):
+        self._script = None
+        self._refund_script = None
+
+    async def consume(self, user_id: int, tokens: int, limits: Optional[Limits],
+                      version: Optional[int]) -> Optional[Charge]:
+        if self._script is None:
+            self._script = get_redis().register_script(self.CONSUME)
+        result = await self._script(
+            keys=[f"{self.PREFIX}{user_id}"],
+            args=[tokens, *(limits if limits is not None else ("", "", "")), IDLE_TTL,
+                  version if version is not None else ""],
+        )
+        if result is None:
+            return None
+        return int(result[0]), float(result[1])
+
+    async def refund(self, user_id: int, tokens: int) -> None:
+        if self._refund_script is None:
+            self._refund_script = get_redis().register_script(self.REFUND)
+        await self._refund_script(keys=[f"{self.PREFIX}{user_id}"], args=[tokens])
+
+    async def reset_limits(self, user_id: int) -> None:
+        await get_redis().hdel(f"{self.PREFIX}{user_id}", "capacity", "regen_rate", "tap_value")
+
+
+class EnergyLimiter:
+    """
+        Server-side energy model of token earning, a token bucket per user charged by both the
+        update-user-balance endpoint and websocket mining.
+
+        The bucket holds up to the maximizer value of energy and regenerates the charger value per
+        second, every token costs 1 / tap value of energy. Earnings beyond the energy left are not
+        credited. Refill and charge take O(1) without reading Postgres: the limits derived from the
+        boost levels are kept with the bucket, and the caller passes them in only when the bucket
+        does not know them, e.g. for the first tap, after an upgrade or once the boost catalog
+        moved past the version the limits were derived from.
+
+    Args:
+        state_size (int): Buckets kept at most by the in-process store.
+    """
+
+    def __init__(self, state_size: int):
+        self.state_size = state_size
+        self.store = None
+
+    def init_store(self) -> None:
+        self.store = RedisEnergyStore() if settings.REDIS_ENABLED else MemoryEnergyStore(self.state_size)
+
+    async def start(self) -> None:
+        self.init_store()
+
+    async def consume(self, user_id: int, tokens: int, levels: Optional[Dict[int, int]] = None) -> Optional[Charge]:
+        """
+        Charges the energy for earned tokens.
+
+        Args:
+            levels (dict): Boost levels of the user, needed when the bucket does not know its limits.
+
+        Returns:
+            tuple: Tokens credited, at most the requested ones, and the energy left. None when the
+                limits are unknown and no levels were given. Spending tokens is not limited.
+        """
+        if not settings.ENERGY_LIMIT_ENABLED or tokens <= 0:
+            return tokens, None
+        limits = limits_from_boost_levels(levels) if levels is not None else None
+        return await self.store.consume(user_id, tokens, limits, catalog.version)
+
+    async def refund(self, user_id: int, tokens: int) -> None:
+        """
+        Gives back the energy of credited tokens that were not written, capped at the capacity.
+        Lost when the bucket forgot its limits in the meantime.
+        """
+        if not settings.ENERGY_LIMIT_ENABLED or tokens <= 0:
+            return
+        try:
+            await self.store.refund(user_id, tokens)
+        except Exception:
+            logger.exception("Failed to refund the energy of user %d", user_id)
+
+    async def reset_limits(self, user_id: int) -> None:
+        """
+        Makes the next charge ask for the boost levels again, called after an upgrade.
+        """
+        if not settings.ENERGY_LIMIT_ENABLED:
+            return
+        try:
+            await self.store.reset_limits(user_id)
+        except Exception:
+            logger.exception("Failed to reset the energy limits of user %d", user_id)
+
+
+energy_limiter = EnergyLimiter(state_size=settings.ENERGY_STATE_SIZE)
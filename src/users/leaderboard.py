@@ -0,0 +1,303 @@
+import bisect
+import logging
+import uuid
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from src.config import settings
+from src.database import async_session_factory
+from src.redis_client import get_redis
+from src.users.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class SortedKeys:
+    """
+        Sorted list split into chunks of at most 2 * LOAD keys, with a Fenwick tree over the chunk
+        lengths for positional lookups. Insert, remove and index take O(log n + LOAD).
+    """
+
+    LOAD = 1000
+
+    def __init__(self, keys: Iterable[tuple] = ()):
+        keys = sorted(keys)
+        self._chunks = [keys[start:start + self.LOAD] for start in range(0, len(keys), self.LOAD)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._length = len(keys)
+        self._build_index()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _build_index(self) -> None:
+        tree = [0] + [len(chunk) for chunk in self._chunks]
+        for position in range(1, len(tree)):
+            parent = position + (position & -position)
+            if parent < len(tree):
+                tree[parent] += tree[position]
+        self._tree = tree
+
+    def _resize(self, chunk_index: int, delta: int) -> None:
+        position = chunk_index + 1
+        while position < len(self._tree):
+            self._tree[position] += delta
+            position += position & -position
+
+    def _offset(self, chunk_index: int) -> int:
+        total = 0
+        while chunk_index > 0:
+            total += self._tree[chunk_index]
+            chunk_index -= chunk_index & -chunk_index
+        return total
+
+    def add(self, key: tuple) -> None:
+        self._length += 1
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            self._build_index()
+            return
+
+        chunk_index = bisect.bisect_left(self._maxes, key)
+        if chunk_index == len(self._maxes):
+            chunk_index -= 1
+            self._chunks[chunk_index].append(key)
+            self._maxes[chunk_index] = key
+        else:
+            bisect.insort(self._chunks[chunk_index], key)
+
+        chunk = self._chunks[chunk_index]
+        if len(chunk) > 2 * self.LOAD:
+            self._chunks[chunk_index:chunk_index + 1] = [chunk[:self.LOAD], chunk[self.LOAD:]]
+            self._maxes[chunk_index:chunk_index + 1] = [chunk[self.LOAD - 1], chunk[-1]]
+            self._build_index()
+        else:
+            self._resize(chunk_index, 1)
+
+    def remove(self, key: tuple) -> None:
+        """
+        Removes a key that is known to be present.
+        """
+        self._length -= 1
+        chunk_index = bisect.bisect_left(self._maxes, key)
+        chunk = self._chunks[chunk_index]
+        del chunk[bisect.bisect_left(chunk, key)]
+        if chunk:
+            self._maxes[chunk_index] = chunk[-1]
+            self._resize(chunk_index, -1)
+        else:
+            del self._chunks[chunk_index]
+            del self._maxes[chunk_index]
+            self._build_index()
+
+    def index(self, key: tuple) -> int:
+        """
+        Returns the position of a key that is known to be present.
+        """
+        chunk_index = bisect.bisect_left(self._maxes, key)
+        return self._offset(chunk_index) + bisect.bisect_left(self._chunks[chunk_index], key)
+
+    def head(self, count: int) -> List[tuple]:
+        keys = []
+        for chunk in self._chunks:
+            if len(keys) >= count:
+                break
+            keys.extend(chunk[:count - len(keys)])
+        return keys
+
+
+class MemoryLeaderboardStore:
+    """
+        Keeps scores in process memory, used when Redis is disabled.
+    """
+
+    def __init__(self):
+        self.scores: Dict[int, int] = {}
+        # (-score, user_id), the highest score first
+        self.entries = SortedKeys()
+
+    async def update(self, scores: Iterable[Tuple[int, int]]) -> None:
+        for user_id, score in scores:
+            previous = self.scores.get(user_id)
+            if previous == score:
+                continue
+            if previous is not None:
+                self.entries.remove((-previous, user_id))
+            self.entries.add((-score, user_id))
+            self.scores[user_id] = score
+
+    async def remove(self, user_id: int) -> None:
+        score = self.scores.pop(user_id, None)
+        if score is not None:
+            self.entries.remove((-score, user_id))
+
+    async def top(self, limit: int) -> List[Tuple[int, int]]:
+        return [(user_id, -score) for score, user_id in self.entries.head(limit)]
+
+    async def rank(self, user_id: int) -> Optional[Tuple[int, int]]:
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self.entries.index((-score, user_id)) + 1, score
+
+    async def size(self) -> int:
+        return len(self.entries)
+
+    async def replace(self, chunks: AsyncIterator[List[Tuple[int, int]]]) -> int:
+        scores = {}
+        async for chunk in chunks:
+            scores.update(chunk)
+        self.entries = SortedKeys((-score, user_id) for user_id, score in scores.items())
+        self.scores = scores
+        return len(scores)
+
+
+class RedisLeaderboardStore:
+    """
+        Keeps scores in a Redis sorted set shared by all workers.
+
+    Args:
+        key (str): Key of the sorted set.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+
+    async def update(self, scores: Iterable[Tuple[int, int]]) -> None:
+        mapping = {str(user_id): score for user_id, score in scores}
+        if mapping:
+            await get_redis().zadd(self.key, mapping)
+
+    async def remove(self, user_id: int) -> None:
+        await get_redis().zrem(self.key, str(user_id))
+
+    async def top(self, limit: int) -> List[Tuple[int, int]]:
+        entries = await get_redis().zrevrange(self.key, 0, limit - 1, withscores=True)
+        return [(int(user_id), int(score)) for user_id, score in entries]
+
+    async def rank(self, user_id: int) -> Optional[Tuple[int, int]]:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.zrevrank(self.key, str(user_id))
+            pipe.zscore(self.key, str(user_id))
+            rank, score = await pipe.execute()
+        if rank is None:
+            return None
+        return rank + 1, int(score)
+
+    async def size(self) -> int:
+        return await get_redis().zcard(self.key)
+
+    async def replace(self, chunks: AsyncIterator[List[Tuple[int, int]]]) -> int:
+        """
+        Fills a temporary key and renames it over the live one, readers never see a partial set.
+        """
+        redis = get_redis()
+        key = f"{self.key}:rebuild:{uuid.uuid4().hex}"
+        total = 0
+        try:
+            async for chunk in chunks:
+                await redis.zadd(key, {str(user_id): score for user_id, score in chunk})
+                total += len(chunk)
+            if total:
+                await redis.rename(key, self.key)
+            else:
+                await redis.delete(self.key)
+        finally:
+            await redis.delete(key)
+        return total
+
+
+class Leaderboard:
+    """
+        Users ranked by a counter column, kept up to date from every change of the column and rebuilt
+        from Postgres when the store is empty.
+
+        Scores are derived data: a failed update is logged instead of failing the request that changed
+        the column, the next change of the same user or a rebuild repairs it.
+
+    Args:
+        key (str): Redis key of the sorted set.
+        column: Column of the user table the users are ranked by.
+        chunk_size (int): Users read from Postgres per round trip during a rebuild.
+        ranks_zero (bool): Whether users with a zero score are ranked.
+    """
+
+    def __init__(self, key: str, column, chunk_size: int, ranks_zero: bool = True):
+        self.key = key
+        self.column = column
+        self.chunk_size = chunk_size
+        self.ranks_zero = ranks_zero
+        self.store = None
+
+    def init_store(self) -> None:
+        self.store = RedisLeaderboardStore(self.key) if settings.REDIS_ENABLED else MemoryLeaderboardStore()
+
+    async def start(self) -> None:
+        self.init_store()
+        if not await self.store.size():
+            await self.rebuild()
+
+    async def update(self, user_id: int, score: int) -> None:
+        await self.update_many([(user_id, score)])
+
+    async def update_many(self, scores: Iterable[Tuple[int, int]]) -> None:
+        """
+        Args:
+            scores (iterable): (user_id, score) pairs as returned by the UPDATEs of the column.
+        """
+        try:
+            await self.store.update(scores)
+        except Exception:
+            logger.exception("Failed to update the %s leaderboard", self.key)
+
+    async def remove(self, user_id: int) -> None:
+        try:
+            await self.store.remove(user_id)
+        except Exception:
+            logger.exception("Failed to remove user %d from the %s leaderboard", user_id, self.key)
+
+    async def top(self, limit: int) -> List[Tuple[int, int]]:
+        """
+        Returns:
+            list: (user_id, score) pairs of the first users, highest score first.
+        """
+        return await self.store.top(limit)
+
+    async def rank(self, user_id: int) -> Optional[Tuple[int, int]]:
+        """
+        Returns:
+            tuple: 1-based rank and score of the user, None if the user is not ranked.
+        """
+        return await self.store.rank(user_id)
+
+    async def size(self) -> int:
+        return await self.store.size()
+
+    async def rebuild(self) -> int:
+        """
+        Replaces the store contents with the scores in Postgres, streamed in chunks through a
+        server-side cursor. Scores changed while the rebuild runs may stay stale until the
+        user's next change.
+
+        Returns:
+            int: Number of ranked users.
+        """
+        return await self.store.replace(self._stream_scores())
+
+    async def _stream_scores(self) -> AsyncIterator[List[Tuple[int, int]]]:
+        query = select(User.__table__.c.id, self.column)
+        if not self.ranks_zero:
+            query = query.where(self.column > 0)
+
+        async with async_session_factory() as session:
+            result = await session.stream(query.execution_options(yield_per=self.chunk_size))
+            async for rows in result.partitions():
+                yield [tuple(row) for row in rows]
+
+
+leaderboard = Leaderboard(key="leaderboard:balance", column=User.__table__.c.balance,
+                          chunk_size=settings.LEADERBOARD_REBUILD_CHUNK_SIZE)
+referral_leaderboard = Leaderboard(key="leaderboard:referrals", column=User.__table__.c.referral_count,
+                                   chunk_size=settings.LEADERBOARD_REBUILD_CHUNK_SIZE, ranks_zero=False)
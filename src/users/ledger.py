@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from src.config import settings
+from src.database import async_engine
+
+logger = logging.getLogger(__name__)
+
+TAP = "tap"
+TASK = "task"
+BOOST = "boost"
+REFERRAL = "referral"
+# Written by src.tools.compact_ledger when User.balance changed without an event
+ADJUSTMENT = "adjustment"
+
+COLUMNS = ["user_id", "delta", "reason", "ts"]
+
+Event = Tuple[int, int, str, datetime]
+
+
+async def write_events(events: List[Event]) -> None:
+    # COPY through the asyncpg connection under the SQLAlchemy one, it commits on its own
+    async with async_engine.connect() as connection:
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table("balance_event", columns=COLUMNS, records=events)
+
+
+class BalanceLedger:
+    """
+        Write-behind journal of balance changes into the balance_event table.
+
+        Endpoints queue the events of a committed change without waiting for Postgres, a background
+        writer drains the queue and writes whatever accumulated with one COPY. When the writer falls
+        more than queue_size events behind, recording waits for room in the queue, which slows down
+        the balance endpoints instead of losing events. Events still queued when the worker is killed
+        are lost, the compaction in src.tools.compact_ledger records the difference as an adjustment.
+
+    Args:
+        queue_size (int): Events queued at most before recording waits.
+        batch_size (int): Events written by one COPY at most.
+        retry_interval (float): Seconds between attempts to write a batch that failed.
+    """
+
+    def __init__(self, queue_size: int, batch_size: int, retry_interval: float):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.written = 0
+        self.batches = 0
+        self.lost = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the writer after writing everything queued.
+        """
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def record(self, user_id: int, delta: int, reason: str) -> None:
+        await self.record_many([(user_id, delta, reason)])
+
+    async def record_many(self, events: Iterable[Tuple[int, int, str]]) -> None:
+        """
+        Queues balance changes that were committed, zero deltas are skipped.
+
+        Args:
+            events (iterable): (user_id, delta, reason) triples.
+        """
+        if not settings.LEDGER_ENABLED:
+            return
+        ts = datetime.now(timezone.utc)
+        events = [(user_id, delta, reason, ts) for user_id, delta, reason in events if delta]
+        if not events:
+            return
+        if self._task is None:
+            # Outside the app, e.g. in tools, there is no writer to hand the events to
+            await self._write(events)
+            return
+        for event in events:
+            # Returns without suspending while the queue has room
+            await self._queue.put(event)
+
+    def size(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _write(self, events: List[Event]) -> None:
+        while True:
+            try:
+                await write_events(events)
+            except Exception:
+                logger.exception("Failed to write %d balance events", len(events))
+                if self._stopping or self._task is None:
+                    self.lost += len(events)
+                    return
+                await asyncio.sleep(self.retry_interval)
+                continue
+            self.written += len(events)
+            self.batches += 1
+            return
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            event = await self._queue.get()
+            if event is None:
+                self._stopping = True
+                events = []
+            else:
+                events = [event]
+            while len(events) < self.batch_size and not self._queue.empty():
+                event = self._queue.get_nowait()
+                if event is None:
+                    self._stopping = True
+                else:
+                    events.append(event)
+            if events:
+                await self._write(events)
+
+        # Events queued after the stop marker
+        events = []
+        while not self._queue.empty():
+            event = self._queue.get_nowait()
+            if event is not None:
+                events.append(event)
+        for start in range(0, len(events), self.batch_size):
+            await self._write(events[start:start + self.batch_size])
+
+ledger = BalanceLedger(
+    queue_size=settings.LEDGER_QUEUE_SIZE,
+    batch_size=settings.LEDGER_BATCH_SIZE,
+    retry_interval=settings.LEDGER_RETRY_INTERVAL,
+)
@@ -0,0 +1,45 @@
+import time
+from typing import Dict, Optional
+
+
+class MiningSession:
+    """
+        Compact mining state of a user shared by all of their sockets in this worker.
+
+        Energy is not kept here: every tap is charged to the user's bucket in the energy limiter, the
+        one the update-user-balance endpoint charges too, so sockets on several workers and HTTP taps
+        all spend the same energy.
+
+    Args:
+        user_id (int): Telegram user id.
+        balance (int): Balance at connect time, including deltas not yet written to Postgres.
+    """
+
+    __slots__ = ("user_id", "balance", "energy", "unflushed", "flushed_at", "connections")
+
+    def __init__(self, user_id: int, balance: int):
+        self.user_id = user_id
+        self.balance = balance
+        self.energy: Optional[float] = None
+        self.unflushed = 0
+        self.flushed_at = time.monotonic()
+        self.connections = 0
+
+    def credit(self, tokens: int, energy: Optional[float]) -> None:
+        """
+        Adds the tokens the energy limiter credited for a tap.
+
+        Args:
+            energy (float): Energy left in the bucket, None when the limiter is disabled.
+        """
+        self.balance += tokens
+        self.unflushed += tokens
+        self.energy = energy
+
+    def take_unflushed(self, now: float) -> int:
+        tokens, self.unflushed = self.unflushed, 0
+        self.flushed_at = now
+        return tokens
+
+
+mining_sessions: Dict[int, MiningSession] = {}
@@ -1,5 +1,5 @@
 from typing import List, Optional, Union
-from sqlalchemy import JSON, BigInteger, Column, DateTime, ForeignKey, String, Table, func, Numeric
+from sqlalchemy import JSON, BigInteger, Column, DateTime, ForeignKey, Index, SmallInteger, String, Table, func, Numeric
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import relationship
@@ -13,19 +13,41 @@ users_tasks = Table(
     Column("task_id", ForeignKey("task.id"), primary_key=True),
 )
 
+# Boost levels of a user, a missing row means level 1. Values and costs come from the Boost catalog
+user_boost = Table(
+    "user_boost",
+    Base.metadata,
+    Column("user_id", ForeignKey("user.id"), primary_key=True),
+    Column("boost_id", ForeignKey("boost.id"), primary_key=True),
+    Column("level", SmallInteger, nullable=False),
+)
+
+# Tap buffer batches already written, recorded in the transaction of the balance update so a replayed
+# batch is skipped. Rows older than TAP_APPLIED_BATCH_RETENTION are deleted by the tap buffer
+applied_tap_batch = Table(
+    "applied_tap_batch",
+    Base.metadata,
+    Column("id", String(32), primary_key=True),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+)
+
 
 class User(Base):
     __tablename__ = "user"
+    __table_args__ = (
+        Index("ix_user_referrer_id_joined_at_id", "referrer_id", "joined_at", "id"),
+    )
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)  # Telegram user id
     username: Mapped[str] = mapped_column(String(50))  # Telegram username
     photo: Mapped[Optional[str]] = mapped_column(String(256))
     balance: Mapped[int] = mapped_column(default=0)
-    boosts_info: Mapped[Optional[dict]] = mapped_column(JSON, default=dict)
+    boosts_info: Mapped[Optional[dict]] = mapped_column(JSON)  # Legacy, boost levels live in user_boost
     joined_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     is_active: Mapped[bool] = mapped_column(default=True)
 
     referrer_id: Mapped[Optional[int]] = mapped_column(BigInteger, ForeignKey("user.id"))
+    referral_count: Mapped[int] = mapped_column(default=0, server_default="0")
     referrals: Mapped[List["User"]] = relationship(back_populates="referrer")
     referrer: Mapped[Optional["User"]] = relationship(back_populates="referrals", remote_side=[id])
 
@@ -56,3 +78,32 @@ class Boost(Base):
     base_value: Mapped[int] = mapped_column()
     value_per_level: Mapped[int] = mapped_column()
     max_level: Mapped[int] = mapped_column()
+
+
+class BalanceEvent(Base):
+    """
+        Append-only ledger of balance changes, written behind the requests by src.users.ledger.
+    """
+    __tablename__ = "balance_event"
+    __table_args__ = (
+        Index("ix_balance_event_user_id_id", "user_id", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger)  # No foreign key, the history outlives deleted users
+    delta: Mapped[int] = mapped_column(BigInteger)
+    reason: Mapped[str] = mapped_column(String(16))  # tap, task, boost, referral or adjustment
+    ts: Mapped[DateTime] = mapped_column(DateTime(timezone=True))  # When the change was committed
+
+
+class BalanceCheckpoint(Base):
+    """
+        Ledger total of a user up to an event, maintained by src.tools.compact_ledger so that
+        reconciling User.balance only reads the events after it.
+    """
+    __tablename__ = "balance_checkpoint"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    balance: Mapped[int] = mapped_column(BigInteger)  # Sum of the deltas up to event_id
+    event_id: Mapped[int] = mapped_column(BigInteger)
+    drift: Mapped[int] = mapped_column(BigInteger, server_default="0")  # User.balance - balance at the last run
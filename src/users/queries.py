@@ -0,0 +1,134 @@
+"""
+Read path of the users endpoints.
+
+Statements here select table columns with SQLAlchemy Core, so the session runs them without the ORM
+compile and loading layer: no identity map, no instrumented instances, rows come back as plain named
+tuples. The ORM models are only used for writes.
+"""
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Row, exists, func, select, tuple_
+
+from src.users.models import User, user_boost, users_tasks
+
+users = User.__table__
+
+# Fields of UserGetScheme besides boosts_info, and of ReferralsGetScheme
+USER_COLUMNS = (users.c.id, users.c.username, users.c.photo, users.c.balance, users.c.joined_at, users.c.is_active)
+REFERRAL_COLUMNS = (users.c.id, users.c.username, users.c.photo, users.c.balance, users.c.joined_at)
+
+
+def with_boost_levels(*columns):
+    """
+    Builds a SELECT of the given user columns followed by the boost ids and levels of the user,
+    aggregated in the same round trip. Pass the last two columns of a row to boost_levels().
+    """
+    return (
+        select(
+            *columns,
+            func.array_agg(user_boost.c.boost_id).filter(user_boost.c.boost_id.is_not(None)),
+            func.array_agg(user_boost.c.level).filter(user_boost.c.boost_id.is_not(None)),
+        )
+        .select_from(users)
+        .outerjoin(user_boost, user_boost.c.user_id == users.c.id)
+        .group_by(users.c.id)
+    )
+
+
+def boost_levels(boost_ids: Optional[List[int]], levels: Optional[List[int]]) -> Dict[int, int]:
+    return dict(zip(boost_ids or (), levels or ()))
+
+
+async def get_user_record(session, user_id: int) -> Optional[Tuple[Row, Dict[int, int]]]:
+    """
+    Returns:
+        tuple: Row of USER_COLUMNS and the boost levels of the user, None if the user does not exist.
+    """
+    row = (await session.execute(with_boost_levels(*USER_COLUMNS).where(users.c.id == user_id))).first()
+    if row is None:
+        return None
+    return row, boost_levels(row[-2], row[-1])
+
+
+async def get_balance_and_boost_levels(session, user_id: int) -> Optional[Tuple[int, Dict[int, int]]]:
+    row = (await session.execute(with_boost_levels(users.c.balance).where(users.c.id == user_id))).first()
+    if row is None:
+        return None
+    balance, boost_ids, levels = row
+    return balance, boost_levels(boost_ids, levels)
+
+
+async def get_boost_levels(session, user_id: int) -> Optional[Dict[int, int]]:
+    """
+    Returns:
+        dict: Boost levels of the user, None if the user does not exist.
+    """
+    row = (await session.execute(with_boost_levels(users.c.id).where(users.c.id == user_id))).first()
+    if row is None:
+        return None
+    return boost_levels(row[1], row[2])
+
+
+async def get_balance(session, user_id: int) -> Optional[int]:
+    return await session.scalar(select(users.c.balance).where(users.c.id == user_id))
+
+
+async def get_referral_count(session, user_id: int) -> Optional[int]:
+    return await session.scalar(select(users.c.referral_count).where(users.c.id == user_id))
+
+
+async def get_referrals(session, user_id: int, limit: int,
+                        after: Optional[Tuple[datetime, int]] = None) -> List[Row]:
+    """
+    Returns a page of the referrals of a user in joining order.
+
+    Args:
+        after (tuple): joined_at and id of the last referral of the previous page.
+
+    Returns:
+        list: Rows of REFERRAL_COLUMNS.
+    """
+    query = (
+        select(*REFERRAL_COLUMNS)
+        .where(users.c.referrer_id == user_id)
+        .order_by(users.c.joined_at, users.c.id)
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(tuple_(users.c.joined_at, users.c.id) > tuple_(*after))
+    return (await session.execute(query)).all()
+
+
+async def get_completed_task_ids(session, user_id: int) -> Optional[FrozenSet[int]]:
+    """
+    Checks the user and collects the ids of their completed tasks in one round trip.
+
+    Returns:
+        frozenset: Completed task ids, None if the user does not exist.
+    """
+    row = (await session.execute(
+        select(users.c.id, func.array_agg(users_tasks.c.task_id).filter(users_tasks.c.task_id.is_not(None)))
+        .select_from(users)
+        .outerjoin(users_tasks, users_tasks.c.user_id == users.c.id)
+        .where(users.c.id == user_id)
+        .group_by(users.c.id)
+    )).first()
+    if row is None:
+        return None
+    return frozenset(row[1] or ())
+
+
+async def get_profiles(session, user_ids: Iterable[int]) -> Dict[int, Row]:
+    """
+    Returns:
+        dict: Rows of id, username and photo by user id, deleted users are missing.
+    """
+    rows = await session.execute(
+        select(users.c.id, users.c.username, users.c.photo).where(users.c.id.in_(list(user_ids)))
+    )
+    return {row.id: row for row in rows}
+
+
+async def user_exists(session, user_id: int) -> bool:
+    return await session.scalar(select(exists().where(users.c.id == user_id)))
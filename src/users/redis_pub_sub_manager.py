@@ -1,41 +1,56 @@
-import os
+import asyncio
+import logging
+from typing import Callable, Optional
 
-import redis.asyncio as aioredis
+from redis.asyncio.client import PubSub
+from redis.exceptions import ConnectionError as RedisConnectionError
 
-from src.config import settings
+from src.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
 
 
 class RedisPubSubManager:
     """
-        Initializes the RedisPubSubManager.
+        Multiplexes the channel subscriptions of all rooms of this worker over a single pub/sub
+        connection taken from the process-wide Redis connection pool.
+
+        Rooms are subscribed one channel each rather than through a pattern, so a worker only
+        receives messages for the rooms it actually holds.
 
     Args:
-        host (str): Redis server host.
-        port (int): Redis server port.
+        on_message (Callable[[str, str], None]): Called with the channel and the decoded payload of every message.
     """
 
-    def __init__(self, host=settings.REDIS_HOST, port=settings.REDIS_PORT):
-        self.redis_host = host
-        self.redis_port = port
-        self.pubsub = None
+    def __init__(self, on_message: Callable[[str, str], None]):
+        self.on_message = on_message
+        self.pubsub: Optional[PubSub] = None
+        self.channels: set = set()
+        self._reader: Optional[asyncio.Task] = None
 
-    async def _get_redis_connection(self) -> aioredis.Redis:
+    async def connect(self) -> None:
         """
-        Establishes a connection to Redis.
-
-        Returns:
-            aioredis.Redis: Redis connection object.
+        Initializes the shared pubsub client, its connection is taken from the pool on the first subscription.
         """
-        return aioredis.Redis(host=self.redis_host,
-                              port=self.redis_port,
-                              auto_close_connection_pool=False)
+        if self.pubsub is None:
+            self.pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
 
-    async def connect(self) -> None:
+    async def close(self) -> None:
         """
-        Connects to the Redis server and initializes the pubsub client.
+        Stops the reader and returns the pub/sub connection to the pool.
         """
-        self.redis_connection = await self._get_redis_connection()
-        self.pubsub = self.redis_connection.pubsub()
+        if self._reader is not None:
+            reader, self._reader = self._reader, None
+            reader.cancel()
+            try:
+                await reader
+            except asyncio.CancelledError:
+                pass
+
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+        self.channels.clear()
 
     async def _publish(self, room_id: str, message: str) -> None:
         """
@@ -45,26 +60,71 @@ class RedisPubSubManager:
             room_id (str): Channel or room ID.
             message (str): Message to be published.
         """
-        await self.redis_connection.publish(room_id, message)
+        await get_redis().publish(room_id, message)
 
-    async def subscribe(self, room_id: str) -> aioredis.Redis:
+    async def subscribe(self, room_id: str) -> None:
         """
-        Subscribes to a Redis channel.
+        Subscribes the shared connection to a Redis channel.
 
         Args:
             room_id (str): Channel or room ID to subscribe to.
-
-        Returns:
-            aioredis.ChannelSubscribe: PubSub object for the subscribed channel.
         """
+        self.channels.add(room_id)
         await self.pubsub.subscribe(room_id)
-        return self.pubsub
+
+        if self._reader is None or self._reader.done():
+            self._start_reader()
 
     async def unsubscribe(self, room_id: str) -> None:
         """
-        Unsubscribes from a Redis channel.
+        Unsubscribes the shared connection from a Redis channel.
 
         Args:
             room_id (str): Channel or room ID to unsubscribe from.
         """
-        await self.pubsub.unsubscribe(room_id)
\ No newline at end of file
+        if room_id in self.channels:
+            self.channels.discard(room_id)
+            await self.pubsub.unsubscribe(room_id)
+
+    def _start_reader(self) -> None:
+        self._reader = asyncio.create_task(self._pubsub_data_reader())
+        self._reader.add_done_callback(self._on_reader_done)
+
+    def _on_reader_done(self, reader: asyncio.Task) -> None:
+        # A reader that died would leave every room of the worker silent, close() clears _reader first
+        if reader is not self._reader or reader.cancelled():
+            return
+        logger.error("Redis pub/sub reader stopped, restarting it", exc_info=reader.exception())
+        if self.pubsub is not None and self.channels:
+            self._start_reader()
+        else:
+            self._reader = None
+
+    def stats(self) -> dict:
+        return {"subscriptions": len(self.channels), "connected": int(self.pubsub is not None and
+                                                                        self.pubsub.connection is not None)}
+
+    async def _pubsub_data_reader(self) -> None:
+        """
+        Reads messages of every subscribed channel, blocking on the connection while idle.
+        """
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+            except RedisConnectionError:
+                # The pubsub client resubscribes all channels when it reconnects
+                logger.warning("Redis pub/sub connection lost, reconnecting")
+                await asyncio.sleep(1)
+                continue
+            except Exception:
+                logger.exception("Failed to read from the Redis pub/sub connection")
+                await asyncio.sleep(1)
+                continue
+
+            if message is None or message['type'] != 'message':
+                continue
+            try:
+                self.on_message(message['channel'].decode('utf-8'), message['data'].decode('utf-8'))
+            except Exception:
+                # One bad message must not stop delivery to the other rooms
+                logger.exception("Failed to dispatch a Redis pub/sub message")
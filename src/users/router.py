@@ -1,17 +1,36 @@
-import datetime
 import json
-from typing import Optional
+import time
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
-from sqlalchemy import select
-from sqlalchemy.orm import joinedload
+import orjson
+from fastapi import APIRouter, Depends, Query, Response, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
 
 from src.config import settings
 from src.database import async_session_factory
-from src.users.dependencies import check_auth_header
-from src.users.models import User, Boost, Task, users_tasks
-from src.users.schemas import UserGetScheme, UserCreateScheme, ReferralsGetScheme, TasksGetScheme, \
-    UpdateUserBoostsInfoScheme, UpdateUserTasksScheme, WebSocketMiningTokensMessageScheme, UpdateUserBalanceScheme
+from src.metrics import track_serialization
+from src.replicas import read_session, replica_router
+from src.responses import ORJSONResponse
+from src.schemas import ResponseScheme
+from src.token_stats import token_stats
+from src.users.dependencies import check_auth_header, check_websocket_auth
+from src.users.cache import completed_tasks_cache, user_cache
+from src.users.catalog import catalog
+from src.users.energy import energy_limiter
+from src.users.leaderboard import leaderboard, referral_leaderboard
+from src.users.ledger import BOOST, REFERRAL, TAP, TASK, ledger
+from src.users.mining import MiningSession, mining_sessions
+from src.users.schemas import UserCreateScheme, UpdateUserBoostsInfoScheme, UpdateUserTasksScheme, \
+    WebSocketMiningTokensMessageScheme, UpdateUserBalanceScheme, UserDataScheme, UserBoostsDataScheme, \
+    UserTasksDataScheme, UserFriendsDataScheme, UserRankDataScheme, LeaderboardDataScheme, \
+    ReferralLeaderboardDataScheme, UpdateUserBoostsInfoDataScheme, UpdateUserTasksDataScheme, \
+    UpdateUserBalanceDataScheme
+from src.users.queries import (get_balance, get_balance_and_boost_levels, get_boost_levels, get_completed_task_ids,
+                               get_profiles, get_referral_count, get_referrals, get_user_record, user_exists)
+from src.users.service import add_balance, complete_task, credit_referral_commissions, upgrade_boost
+from src.users.signup_queue import insert_signups, signup_queue
+from src.users.tap_buffer import tap_buffer
+from src.users.utils import decode_cursor, encode_cursor
 from src.users.websocket_manager import WebSocketManager
 
 router = APIRouter(
@@ -21,191 +40,273 @@ router = APIRouter(
 )
 
 
-@router.get("/{user_id}/friends")
-async def get_user_friends(user_id: int, user_telegram_id: int = Depends(check_auth_header)):
+def serialize_user(user, levels: Dict[int, int]) -> dict:
+    """
+    Builds the UserGetScheme payload of a user without validating it through the model.
+
+    Args:
+        user: User instance or row of USER_COLUMNS.
+    """
+    return {
+        "id": user.id,
+        "username": user.username,
+        "photo": user.photo,
+        "balance": user.balance,
+        "boosts_info": {boost.name: {"level": levels.get(boost.id, 1), "base_value": boost.base_value,
+                                     "value_per_level": boost.value_per_level} for boost in catalog.boosts},
+        "joined_at": user.joined_at,
+        "is_active": user.is_active
+    }
+
+
+async def load_user_payload(user_id: int) -> Optional[bytes]:
+    """
+    Returns:
+        bytes: Serialized GET /users/{user_id} response, None if the user does not exist.
+    """
+    async with read_session(user_id) as session:
+        user = await get_user_record(session, user_id)
+        if not user:
+            return None
+
+    user, levels = user
+    with track_serialization():
+        return orjson.dumps({
+            "status": "success",
+            "message": "User found",
+            "data": {"user": serialize_user(user, levels)}
+        })
+
+
+async def ranked_users(top: List[Tuple[int, int]], score_name: str) -> List[dict]:
+    """
+    Joins leaderboard entries with the public profiles of the users in one primary key lookup.
+
+    Args:
+        top (list): (user_id, score) pairs, highest score first.
+        score_name (str): Key the score is returned under.
+    """
+    if not top:
+        return []
+
+    async with read_session() as session:
+        profiles = await get_profiles(session, [user_id for user_id, _ in top])
+
+    users = []
+    for rank, (user_id, score) in enumerate(top, start=1):
+        profile = profiles.get(user_id)
+        if profile is None:
+            # Deleted since it was ranked
+            continue
+        users.append({"rank": rank, "id": user_id, "username": profile.username, "photo": profile.photo,
+                      score_name: score})
+    return users
+
+
+@router.get("/leaderboard", response_model=ResponseScheme[LeaderboardDataScheme], response_model_exclude_unset=True)
+async def get_leaderboard(limit: int = Query(settings.LEADERBOARD_SIZE, ge=1, le=settings.LEADERBOARD_MAX_SIZE),
+                          user_telegram_id: int = Depends(check_auth_header)):
+    users = await ranked_users(await leaderboard.top(limit), "balance")
+
+    return ORJSONResponse({
+        "status": "success",
+        "message": "Leaderboard found",
+        "data": {"users": users, "total": await leaderboard.size()}
+    })
+
+
+@router.get("/referrals/top", response_model=ResponseScheme[ReferralLeaderboardDataScheme],
+            response_model_exclude_unset=True)
+async def get_referrals_leaderboard(limit: int = Query(settings.LEADERBOARD_SIZE, ge=1,
+                                                       le=settings.LEADERBOARD_MAX_SIZE),
+                                    user_telegram_id: int = Depends(check_auth_header)):
+    users = await ranked_users(await referral_leaderboard.top(limit), "referral_count")
+
+    return ORJSONResponse({
+        "status": "success",
+        "message": "Referral leaderboard found",
+        "data": {"users": users, "total": await referral_leaderboard.size()}
+    })
+
+
+@router.get("/{user_id}/rank", response_model=ResponseScheme[UserRankDataScheme], response_model_exclude_unset=True)
+async def get_user_rank(user_id: int, user_telegram_id: int = Depends(check_auth_header)):
     if user_id != user_telegram_id:
         return {
             "status": "error",
             "message": "Telegram id does not match"
         }
 
-    async with async_session_factory() as session:
-        result = await session.execute(
-            select(User)
-            .options(joinedload(User.referrals))
-            .where(User.id == user_id)
-        )
-
-        user = result.scalar()
-        if not user:
-            return {
-                "status": "error",
-                "message": "User not found"
-            }
-
-        referrals = user.referrals
+    rank = await leaderboard.rank(user_id)
+    if rank is None:
         return {
-            "status": "success",
-            "message": "User found, referrals fetched",
-            "data": {"user_id": user.id,
-                     "referrals": [ReferralsGetScheme.model_validate(referral).model_dump() for referral in referrals]}
+            "status": "error",
+            "message": "User not found"
         }
 
+    rank, balance = rank
+    return {
+        "status": "success",
+        "message": "User rank found",
+        "data": {"user_id": user_id, "rank": rank, "balance": balance, "total": await leaderboard.size()}
+    }
 
-@router.get("/{user_id}/tasks")
-async def get_user_tasks(user_id: int, user_telegram_id: int = Depends(check_auth_header)):
+
+@router.get("/{user_id}/friends", response_model=ResponseScheme[UserFriendsDataScheme],
+            response_model_exclude_unset=True)
+async def get_user_friends(user_id: int, cursor: Optional[str] = None,
+                           limit: int = Query(default=settings.REFERRALS_PAGE_SIZE, ge=1,
+                                              le=settings.REFERRALS_MAX_PAGE_SIZE),
+                           user_telegram_id: int = Depends(check_auth_header)):
     if user_id != user_telegram_id:
         return {
             "status": "error",
             "message": "Telegram id does not match"
         }
 
-    async with async_session_factory() as session:
-        user = await session.execute(
-            select(User).where(User.id == user_id)
-        )
-        user = user.scalar()
-        if not user:
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            return {
+                "status": "error",
+                "message": "Invalid cursor"
+            }
+
+    async with read_session(user_id) as session:
+        referral_count = await get_referral_count(session, user_id)
+        if referral_count is None:
             return {
                 "status": "error",
                 "message": "User not found"
             }
 
-        completed_tasks = await session.execute(
-            select(Task)
-            .join(users_tasks)
-            .where(users_tasks.c.user_id == user_id)
-        )
-        completed_tasks = completed_tasks.scalars().all()
+        referrals = await get_referrals(session, user_id, limit + 1, after)
 
-        uncompleted_tasks = await session.execute(
-            select(Task)
-            .outerjoin(users_tasks, (users_tasks.c.task_id == Task.id) & (users_tasks.c.user_id == user_id))
-            .where(users_tasks.c.user_id == None)
-        )
-        uncompleted_tasks = uncompleted_tasks.scalars().all()
+    next_cursor = None
+    if len(referrals) > limit:
+        referrals = referrals[:limit]
+        next_cursor = encode_cursor(referrals[-1].joined_at, referrals[-1].id)
 
-        return {
-            "status": "success",
-            "message": "User found, tasks fetched",
-            "data": {
-                "user_id": user.id,
-                "completed_tasks": [
-                    TasksGetScheme.model_validate(task).model_dump() for task in completed_tasks
-                ],
-                "uncompleted_tasks": [
-                    TasksGetScheme.model_validate(task).model_dump() for task in uncompleted_tasks
-                ]
-            }
-        }
+    # REFERRAL_COLUMNS are the fields of ReferralsGetScheme, rows go to orjson as they are
+    return ORJSONResponse({
+        "status": "success",
+        "message": "User found, referrals fetched",
+        "data": {"user_id": user_id,
+                 "referrals": [referral._asdict() for referral in referrals],
+                 "total": referral_count,
+                 "next_cursor": next_cursor}
+    })
 
 
-@router.get("/{user_id}/boosts")
-async def get_user_boosts(user_id: int, user_telegram_id: int = Depends(check_auth_header)):
+@router.get("/{user_id}/tasks", response_model=ResponseScheme[UserTasksDataScheme], response_model_exclude_unset=True)
+async def get_user_tasks(user_id: int, user_telegram_id: int = Depends(check_auth_header)):
     if user_id != user_telegram_id:
         return {
             "status": "error",
             "message": "Telegram id does not match"
         }
 
-    async with async_session_factory() as session:
-        user = await session.execute(
-            select(User).where(User.id == user_id)
-        )
-        user = user.scalar()
-        if not user:
+    completed_task_ids = await completed_tasks_cache.get(user_id)
+    if completed_task_ids is None:
+        async with read_session(user_id) as session:
+            completed_task_ids = await get_completed_task_ids(session, user_id)
+
+        if completed_task_ids is None:
             return {
                 "status": "error",
                 "message": "User not found"
             }
 
-        return {
-            "status": "success",
-            "message": "User found",
-            "data": {"user_id": user.id, "boosts_info": user.boosts_info}
+        await completed_tasks_cache.set(user_id, completed_task_ids)
+
+    completed_tasks = []
+    uncompleted_tasks = []
+    for task in catalog.tasks:
+        if task.id in completed_task_ids:
+            completed_tasks.append(catalog.task_payloads[task.id])
+        else:
+            uncompleted_tasks.append(catalog.task_payloads[task.id])
+
+    return ORJSONResponse({
+        "status": "success",
+        "message": "User found, tasks fetched",
+        "data": {
+            "user_id": user_id,
+            "completed_tasks": completed_tasks,
+            "uncompleted_tasks": uncompleted_tasks
         }
+    })
 
 
-@router.get("/{user_id}")
-async def get_user(user_id: int, user_telegram_id: int = Depends(check_auth_header)):
+@router.get("/{user_id}/boosts", response_model=ResponseScheme[UserBoostsDataScheme], response_model_exclude_unset=True)
+async def get_user_boosts(user_id: int, user_telegram_id: int = Depends(check_auth_header)):
     if user_id != user_telegram_id:
         return {
             "status": "error",
             "message": "Telegram id does not match"
         }
-    async with async_session_factory() as session:
-        user = await session.execute(
-            select(User).where(User.id == user_id)
-        )
-        user = user.scalar()
-        if not user:
+
+    async with read_session(user_id) as session:
+        levels = await get_boost_levels(session, user_id)
+        if levels is None:
             return {
                 "status": "error",
                 "message": "User not found"
             }
 
+    return ORJSONResponse({
+        "status": "success",
+        "message": "User found",
+        "data": {"user_id": user_id, "boosts_info": catalog.boosts_info(levels)}
+    })
+
+
+@router.get("/{user_id}", response_model=ResponseScheme[UserDataScheme], response_model_exclude_unset=True)
+async def get_user(user_id: int, user_telegram_id: int = Depends(check_auth_header)):
+    if user_id != user_telegram_id:
         return {
-            "status": "success",
-            "message": "User found",
-            "data": {"user": UserGetScheme.model_validate(user).model_dump()}
+            "status": "error",
+            "message": "Telegram id does not match"
         }
+    payload = await user_cache.get_or_load(user_id, lambda: load_user_payload(user_id))
+    if payload is None:
+        return {
+            "status": "error",
+            "message": "User not found"
+        }
+    return Response(payload, media_type="application/json")
 
 
-@router.post("/")
+@router.post("/", response_model=ResponseScheme[UserDataScheme], response_model_exclude_unset=True)
 async def create_user(new_user_data: UserCreateScheme, user_telegram_id: int = Depends(check_auth_header)):
     if new_user_data.id != user_telegram_id:
         return {
             "status": "error",
             "message": "Telegram id does not match"
         }
-    async with async_session_factory() as session:
-        existing_user = await session.execute(
-            select(User).where(User.id == new_user_data.id)
-        )
-        existing_user = existing_user.scalar()
-        if existing_user:
-            return {
-                "status": "error",
-                "message": "User already exists"
-            }
-
-        new_user = User(id=new_user_data.id, username=new_user_data.username)
-
-        if new_user_data.referrer_id:
-            referrer = await session.execute(
-                select(User).where(User.id == new_user_data.referrer_id)
-            )
-            referrer = referrer.scalar()
-            if referrer:
-                new_user.referrer = referrer
-
-        boosts = await session.execute(select(Boost))
-        default_boosts_info = {}
-        for boost in boosts.scalars():
-            default_boosts_info[boost.name] = {
-                "id": boost.id,
-                "level": 1,
-                "base_value": boost.base_value,
-                "value_per_level": boost.value_per_level,
-                "base_upgrade_cost": boost.base_cost,
-                "upgrade_cost_per_level": boost.cost_per_level,
-                "max_level": boost.max_level
-            }
-
-        new_user.boosts_info = default_boosts_info
-
-        session.add(new_user)
-        await session.commit()
-        await session.refresh(new_user)
+    signup = (new_user_data.id, new_user_data.username, new_user_data.referrer_id)
+    if settings.SIGNUP_BATCH_ENABLED:
+        new_user = await signup_queue.submit(*signup)
+    else:
+        new_user = (await insert_signups([signup])).get(new_user_data.id)
 
+    if new_user is None:
         return {
-            "status": "success",
-            "message": "User successfully created",
-            "data": {"user": UserGetScheme.model_validate(new_user).model_dump()}
+            "status": "error",
+            "message": "User already exists"
         }
 
+    return ORJSONResponse({
+        "status": "success",
+        "message": "User successfully created",
+        "data": {"user": serialize_user(new_user, {})}
+    })
 
-@router.patch("/update-boosts-info")
+
+@router.patch("/update-boosts-info", response_model=ResponseScheme[UpdateUserBoostsInfoDataScheme],
+              response_model_exclude_unset=True)
 async def update_user_boosts_info(update_info: UpdateUserBoostsInfoScheme,
                                   user_telegram_id: int = Depends(check_auth_header)):
     if update_info.user_id != user_telegram_id:
@@ -214,61 +315,50 @@ async def update_user_boosts_info(update_info: UpdateUserBoostsInfoScheme,
             "message": "Telegram id does not match"
         }
 
-    async with async_session_factory() as session:
-        user = await session.execute(
-            select(User).where(User.id == update_info.user_id)
-        )
-        user = user.scalar()
-        if not user:
-            return {
-                "status": "error",
-                "message": "User not found"
-            }
-
-        boost = await session.execute(
-            select(Boost).where(Boost.id == update_info.boost_id)
-        )
-        boost = boost.scalar()
-        if not boost:
-            return {
-                "status": "error",
-                "message": f"Boost with id {update_info.boost_id} not found"
-            }
+    boost = catalog.get_boost(update_info.boost_id)
+    if not boost:
+        return {
+            "status": "error",
+            "message": f"Boost with id {update_info.boost_id} not found"
+        }
 
-        if update_info.boost_level > boost.max_level or update_info.boost_level < 1:
-            return {
-                "status": "error",
-                "message": f"Boost level is incorrect"
-            }
+    if update_info.boost_level > boost.max_level or update_info.boost_level < 1:
+        return {
+            "status": "error",
+            "message": f"Boost level is incorrect"
+        }
 
-        update_cost = boost.base_cost + (boost.cost_per_level * (update_info.boost_level - 1))
-        if user.balance < update_cost:
+    async with async_session_factory() as session:
+        balance = await upgrade_boost(session, update_info.user_id, boost, update_info.boost_level)
+        if balance is None:
+            if not await user_exists(session, update_info.user_id):
+                return {
+                    "status": "error",
+                    "message": "User not found"
+                }
             return {
                 "status": "error",
                 "message": "Not enough balance"
             }
 
-        user.boosts_info[boost.name]["level"] = update_info.boost_level
-        user.balance -= update_cost
-
-        user_id = user.id
-        boost_name = boost.name
-        level = update_info.boost_level
-        balance = user.balance
-
-        session.add(user)
         await session.commit()
-        await session.refresh(user)
 
-        return {
-            "status": "success",
-            "message": "Boosts info updated",
-            "data": {"user_id": user_id, "boost_name": boost_name, "level": level,
-                     "balance": balance}
-        }
+    await replica_router.mark_write(update_info.user_id)
+    await user_cache.invalidate(update_info.user_id)
+    await leaderboard.update(update_info.user_id, balance)
+    await ledger.record(update_info.user_id, -boost.upgrade_cost(update_info.boost_level), BOOST)
+    await energy_limiter.reset_limits(update_info.user_id)
 
+    return {
+        "status": "success",
+        "message": "Boosts info updated",
+        "data": {"user_id": update_info.user_id, "boost_name": boost.name, "level": update_info.boost_level,
+                 "balance": balance}
+    }
 
-@router.patch("/update-user-tasks")
+
+@router.patch("/update-user-tasks", response_model=ResponseScheme[UpdateUserTasksDataScheme],
+              response_model_exclude_unset=True)
 async def update_user_tasks(update_info: UpdateUserTasksScheme, user_telegram_id: int = Depends(check_auth_header)):
     if update_info.user_id != user_telegram_id:
         return {
@@ -276,61 +366,48 @@ async def update_user_tasks(update_info: UpdateUserTasksScheme, user_telegram_id
             "message": "Telegram id does not match"
         }
 
-    async with async_session_factory() as session:
-        user = await session.execute(
-            select(User).where(User.id == update_info.user_id)
-        )
-        user = user.scalar()
-        if not user:
-            return {
-                "status": "error",
-                "message": "User not found"
-            }
-
-        task = await session.execute(
-            select(Task).where(Task.id == update_info.task_id)
-        )
-        task = task.scalar()
-        if not task:
-            return {
-                "status": "error",
-                "message": f"Task with id {update_info.task_id} not found"
-            }
-
-        task_already_completed = await session.execute(
-            select(users_tasks)
-            .where(users_tasks.c.user_id == user.id)
-            .where(users_tasks.c.task_id == task.id)
-        )
-        task_already_completed = task_already_completed.scalar() is not None
+    task = catalog.get_task(update_info.task_id)
+    if not task:
+        return {
+            "status": "error",
+            "message": f"Task with id {update_info.task_id} not found"
+        }
 
-        if task_already_completed:
+    async with async_session_factory() as session:
+        balance = await complete_task(session, update_info.user_id, task)
+        if balance is None:
+            if not await user_exists(session, update_info.user_id):
+                return {
+                    "status": "error",
+                    "message": "User not found"
+                }
             return {
                 "status": "error",
                 "message": "Task already completed"
             }
 
-        await session.execute(users_tasks.insert().values(user_id=user.id, task_id=task.id))
-
-        user.balance += task.reward
-
-        user_id = user.id
-        task_id = task.id
-        user_balance = user.balance
-        reward = task.reward
-
-        session.add(user)
+        commissions = await credit_referral_commissions(session, {update_info.user_id: task.reward})
         await session.commit()
-        await session.refresh(user)
-
-        return {
-            "status": "success",
-            "message": "User tasks updated",
-            "data": {"user_id": user_id, "tasks_id": task_id, "balance": user_balance, "reward": reward}
-        }
 
-
-@router.patch("/update-user-balance")
+    written = [update_info.user_id] + [referrer_id for referrer_id, _, _ in commissions]
+    await replica_router.mark_writes(written)
+    await completed_tasks_cache.invalidate(update_info.user_id)
+    await user_cache.invalidate_many(written)
+    await leaderboard.update_many([(update_info.user_id, balance)] +
+                                  [(referrer_id, referrer_balance) for referrer_id, referrer_balance, _ in commissions])
+    await token_stats.add_mined(task.reward + sum(credited for _, _, credited in commissions))
+    await ledger.record_many([(update_info.user_id, task.reward, TASK)] +
+                             [(referrer_id, credited, REFERRAL) for referrer_id, _, credited in commissions])
+
+    return {
+        "status": "success",
+        "message": "User tasks updated",
+        "data": {"user_id": update_info.user_id, "tasks_id": task.id, "balance": balance, "reward": task.reward}
+    }
+
+
+@router.patch("/update-user-balance", response_model=ResponseScheme[UpdateUserBalanceDataScheme],
+              response_model_exclude_unset=True)
 async def update_user_balance(update_info: UpdateUserBalanceScheme, user_telegram_id: int = Depends(check_auth_header)):
     if update_info.user_id != user_telegram_id:
         return {
@@ -338,95 +415,194 @@ async def update_user_balance(update_info: UpdateUserBalanceScheme, user_telegra
             "message": "Telegram id does not match"
         }
 
-    async with async_session_factory() as session:
-        user = await session.execute(
-            select(User).where(User.id == update_info.user_id)
-        )
-        user = user.scalar()
-        if not user:
-            return {
-                "status": "error",
-                "message": "User not found"
-            }
-
-        user.balance += update_info.tokens
+    # Taps only earn, balances go down through boost upgrades which check the balance
+    if update_info.tokens < 0:
+        return {
+            "status": "error",
+            "message": "Tokens must not be negative"
+        }
 
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
+    # Limits come from the bucket, the boost levels are read only when it does not know them
+    charge = await energy_limiter.consume(update_info.user_id, update_info.tokens)
+
+    if not settings.TAP_BUFFER_ENABLED:
+        async with async_session_factory() as session:
+            if charge is None:
+                levels = await get_boost_levels(session, update_info.user_id)
+                if levels is None:
+                    return {
+                        "status": "error",
+                        "message": "User not found"
+                    }
+                charge = await energy_limiter.consume(update_info.user_id, update_info.tokens, levels)
+            tokens, energy = charge
+            if update_info.tokens > 0 and not tokens:
+                return {
+                    "status": "error",
+                    "message": "Not enough energy"
+                }
+
+            # Energy of tokens that were not written goes back to the bucket
+            try:
+                balance = await add_balance(session, update_info.user_id, tokens)
+                if balance is not None:
+                    commissions = await credit_referral_commissions(session, {update_info.user_id: tokens})
+                    await session.commit()
+            except Exception:
+                await energy_limiter.refund(update_info.user_id, tokens)
+                raise
+            if balance is None:
+                await energy_limiter.refund(update_info.user_id, tokens)
+                return {
+                    "status": "error",
+                    "message": "User not found"
+                }
+
+        written = [update_info.user_id] + [referrer_id for referrer_id, _, _ in commissions]
+        await replica_router.mark_writes(written)
+        await user_cache.invalidate_many(written)
+        await leaderboard.update_many([(update_info.user_id, balance)] +
+                                      [(referrer_id, referrer_balance)
+                                       for referrer_id, referrer_balance, _ in commissions])
+        await token_stats.add_mined(max(tokens, 0) + sum(credited for _, _, credited in commissions))
+        await ledger.record_many([(update_info.user_id, tokens, TAP)] +
+                                 [(referrer_id, credited, REFERRAL) for referrer_id, _, credited in commissions])
 
         return {
             "status": "success",
             "message": "User balance updated",
-            "data": {"user_id": user.id, "balance": user.balance}
+            "data": {"user_id": update_info.user_id, "balance": balance, "tokens": tokens, "energy": energy}
+        }
+
+    async with async_session_factory() as session:
+        if charge is None:
+            user = await get_balance_and_boost_levels(session, update_info.user_id)
+            if user is None:
+                return {
+                    "status": "error",
+                    "message": "User not found"
+                }
+            balance, levels = user
+            charge = await energy_limiter.consume(update_info.user_id, update_info.tokens, levels)
+        else:
+            try:
+                balance = await get_balance(session, update_info.user_id)
+            except Exception:
+                await energy_limiter.refund(update_info.user_id, charge[0])
+                raise
+            if balance is None:
+                await energy_limiter.refund(update_info.user_id, charge[0])
+                return {
+                    "status": "error",
+                    "message": "User not found"
+                }
+
+    tokens, energy = charge
+    if update_info.tokens > 0 and not tokens:
+        return {
+            "status": "error",
+            "message": "Not enough energy"
         }
 
+    # The delta is buffered and written together with other taps by the tap buffer flusher
+    try:
+        pending = await tap_buffer.add(update_info.user_id, tokens)
+    except Exception:
+        await energy_limiter.refund(update_info.user_id, tokens)
+        raise
+    await replica_router.mark_write(update_info.user_id)
+
+    return {
+        "status": "success",
+        "message": "User balance updated",
+        "data": {"user_id": update_info.user_id, "balance": balance + pending, "tokens": tokens, "energy": energy}
+    }
+
+
+socket_manager = WebSocketManager()
 
-# socket_manager = WebSocketManager()
-
-
-# @router.websocket("/{user_id}")
-# async def websocket_mining_tokens(websocket: WebSocket, user_id: int, user_telegram_id: int = Depends(check_auth_header)):
-#     await websocket.accept()
-
-    # if user_id != user_telegram_id:
-    #     await websocket.send_text(json.dumps({"status": "error", "message": "Telegram id does not match"}))
-    #     await websocket.close()
-
-    # async with async_session_factory() as session:
-    #     user = await session.execute(
-    #         select(User).where(User.id == user_id)
-    #     )
-    #     user = user.scalar()
-    #
-    # if not user:
-    #     await websocket.send_text(json.dumps({"status": "error", "message": "User not found"}))
-    #     await websocket.close()
-    #     return
-    #
-    # room_id = f"user_{user_id}"
-    # user_maximizer_boost = user.boosts_info.get(settings.BOOST_MAXIMIZER_NAME, {})
-    # user_charger_boost = user.boosts_info.get(settings.BOOST_CHARGER_NAME, {})
-    # user_tap_boost = user.boosts_info.get(settings.BOOST_TAP_NAME, {})
-    # user_energy = user_maximizer_boost.get("base_value", 0) + (user_maximizer_boost.get('value_per_level', 0) * (user_maximizer_boost.get("level", 1) - 1))
-    # user_charger_speed = user_charger_boost.get("base_value", 0) + (user_charger_boost.get('value_per_level', 0) * (user_charger_boost.get("level", 1) - 1))
-    # user_tap_count = user_tap_boost.get("base_value", 0) + (user_tap_boost.get('value_per_level', 0) * (user_tap_boost.get("level", 1) - 1))
-    #
-    # await socket_manager.add_user_to_room(room_id, websocket)
-    # message = {
-    #     "user_id": user_id,
-    #     "room_id": room_id,
-    #     "message": f"User {user_id} connected to room - {room_id}"
-    # }
-    # await socket_manager.broadcast_to_room(room_id, json.dumps(message))
-    # try:
-    #     time_now = datetime.datetime.now()
-    #     while True:
-    #         data = WebSocketMiningTokensMessageScheme.model_validate(json.loads(await websocket.receive_text()))
-    #
-    #         used_energy = data.tokens // user_tap_count
-    #         if user_energy >= used_energy:
-    #             user.balance += data.tokens
-    #             user_energy -= used_energy
-    #             if (datetime.datetime.now() - time_now).total_seconds() > 1:
-    #                 user_energy += user_charger_speed
-    #                 time_now = datetime.datetime.now()
-    #         else:
-    #             user_energy = 0
-    #
-    #         message = {
-    #             "user_id": user_id,
-    #             "user_balance": user.balance,
-    #             "user_energy": user_energy,
-    #         }
-    #         await socket_manager.broadcast_to_room(room_id, json.dumps(message))
-    #
-    # except WebSocketDisconnect:
-    #     await socket_manager.remove_user_from_room(room_id, websocket)
-    #
-    #     message = {
-    #         "user_id": user_id,
-    #         "room_id": room_id,
-    #         "message": f"User {user_id} disconnected from room - {room_id}"
-    #     }
-    #     await socket_manager.broadcast_to_room(room_id, json.dumps(message))
+
+@router.websocket("/{user_id}")
+async def websocket_mining_tokens(websocket: WebSocket, user_id: int,
+                                  user_telegram_id: int = Depends(check_websocket_auth)):
+    await websocket.accept()
+
+    if user_id != user_telegram_id:
+        await websocket.send_text(json.dumps({"status": "error", "message": "Telegram id does not match"}))
+        await websocket.close()
+        return
+
+    mining_session = mining_sessions.get(user_id)
+    if mining_session is None:
+        async with async_session_factory() as session:
+            balance = await get_balance(session, user_id)
+
+        if balance is None:
+            await websocket.send_text(json.dumps({"status": "error", "message": "User not found"}))
+            await websocket.close()
+            return
+
+        pending = await tap_buffer.get_pending(user_id)
+        mining_session = mining_sessions.setdefault(user_id, MiningSession(user_id, balance + pending))
+
+    mining_session.connections += 1
+    room_id = f"user_{user_id}"
+
+    await socket_manager.add_user_to_room(room_id, websocket)
+    message = {
+        "user_id": user_id,
+        "room_id": room_id,
+        "message": f"User {user_id} connected to room - {room_id}"
+    }
+    await socket_manager.broadcast_to_room(room_id, json.dumps(message))
+    try:
+        while True:
+            try:
+                data = WebSocketMiningTokensMessageScheme.model_validate_json(await websocket.receive_text())
+            except ValidationError:
+                await websocket.send_text(json.dumps({"status": "error", "message": "Invalid message"}))
+                continue
+
+            # Same bucket as update-user-balance, the boost levels are read only when it does not know them
+            charge = await energy_limiter.consume(user_id, data.tokens)
+            if charge is None:
+                async with async_session_factory() as session:
+                    levels = await get_boost_levels(session, user_id)
+                if levels is None:
+                    await websocket.send_text(json.dumps({"status": "error", "message": "User not found"}))
+                    continue
+                charge = await energy_limiter.consume(user_id, data.tokens, levels)
+            mining_session.credit(*charge)
+
+            # Mined tokens reach the tap buffer at most once per MINING_FLUSH_INTERVAL per user
+            now = time.monotonic()
+            if mining_session.unflushed and now - mining_session.flushed_at >= settings.MINING_FLUSH_INTERVAL:
+                await tap_buffer.add(user_id, mining_session.take_unflushed(now))
+                await replica_router.mark_write(user_id)
+
+            message = {
+                "user_id": user_id,
+                "user_balance": mining_session.balance,
+                "user_energy": int(mining_session.energy) if mining_session.energy is not None else None,
+            }
+            await socket_manager.broadcast_to_room(room_id, json.dumps(message))
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        mining_session.connections -= 1
+        if mining_session.unflushed:
+            await tap_buffer.add(user_id, mining_session.take_unflushed(time.monotonic()))
+            await replica_router.mark_write(user_id)
+        if mining_session.connections == 0:
+            mining_sessions.pop(user_id, None)
+
+        await socket_manager.remove_user_from_room(room_id, websocket)
+
+    message = {
+        "user_id": user_id,
+        "room_id": room_id,
+        "message": f"User {user_id} disconnected from room - {room_id}"
+    }
+    await socket_manager.broadcast_to_room(room_id, json.dumps(message))
@@ -49,6 +49,93 @@ class TasksGetScheme(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class UserDataScheme(BaseModel):
+    user: UserGetScheme
+
+
+class BoostInfoScheme(BaseModel):
+    id: int
+    level: int
+    base_value: int
+    value_per_level: int
+    base_upgrade_cost: int
+    upgrade_cost_per_level: int
+    max_level: int
+
+
+class UserBoostsDataScheme(BaseModel):
+    user_id: int
+    boosts_info: Dict[str, BoostInfoScheme]
+
+
+class UserTasksDataScheme(BaseModel):
+    user_id: int
+    completed_tasks: List[TasksGetScheme]
+    uncompleted_tasks: List[TasksGetScheme]
+
+
+class UserFriendsDataScheme(BaseModel):
+    user_id: int
+    referrals: List[ReferralsGetScheme]
+    total: int
+    next_cursor: Optional[str] = None
+
+
+class UserRankDataScheme(BaseModel):
+    user_id: int
+    rank: int
+    balance: int
+    total: int
+
+
+class LeaderboardUserScheme(BaseModel):
+    rank: int
+    id: int
+    username: str
+    photo: Optional[str] = None
+    balance: int
+
+
+class LeaderboardDataScheme(BaseModel):
+    users: List[LeaderboardUserScheme]
+    total: int
+
+
+class ReferralLeaderboardUserScheme(BaseModel):
+    rank: int
+    id: int
+    username: str
+    photo: Optional[str] = None
+    referral_count: int
+
+
+class ReferralLeaderboardDataScheme(BaseModel):
+    users: List[ReferralLeaderboardUserScheme]
+    total: int
+
+
+class UpdateUserBoostsInfoDataScheme(BaseModel):
+    user_id: int
+    boost_name: str
+    level: int
+    balance: int
+
+
+class UpdateUserTasksDataScheme(BaseModel):
+    user_id: int
+    tasks_id: int
+    balance: int
+    reward: int
+
+
+class UpdateUserBalanceDataScheme(BaseModel):
+    user_id: int
+    balance: int
+    # Tokens credited, fewer than sent when the energy ran out
+    tokens: Optional[int] = None
+    energy: Optional[float] = None
+
+
 class UpdateUserBoostsInfoScheme(BaseModel):
     user_id: int
     boost_id: int
@@ -0,0 +1,254 @@
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import (BigInteger, Float, Integer, Row, cast, column, delete, exists, func, literal, select, text,
+                        update, values)
+from sqlalchemy.dialects.postgresql import insert
+
+from src.config import settings
+from src.users.catalog import BoostEntry, TaskEntry
+from src.users.models import User, applied_tap_batch, user_boost, users_tasks
+
+# Two bind parameters per row, asyncpg accepts at most 32767 per statement
+BULK_CHUNK_SIZE = 10_000
+
+# Plain SQL: SQLAlchemy does not cache the compiled form of an INSERT ... SELECT inside a CTE, and compiling
+# it took longer than the round trip. Arrays bind any number of signups as three parameters
+CREATE_USERS = text("""
+    WITH inserted AS (
+        INSERT INTO "user" (id, username, referrer_id, balance, is_active)
+        SELECT DISTINCT ON (signups.id) signups.id, signups.username, referrer.id, 0, true
+        FROM unnest(CAST(:ids AS bigint[]), CAST(:usernames AS varchar[]), CAST(:referrer_ids AS bigint[]))
+            WITH ORDINALITY AS signups (id, username, referrer_id, position)
+        LEFT JOIN "user" referrer ON referrer.id = signups.referrer_id AND referrer.id <> signups.id
+        ORDER BY signups.id, signups.position
+        ON CONFLICT (id) DO NOTHING
+        RETURNING id, username, photo, balance, joined_at, is_active, referrer_id
+    ), referred AS (
+        UPDATE "user" SET referral_count = "user".referral_count + referrals.count
+        FROM (
+            SELECT referrer_id, count(*) AS count FROM inserted WHERE referrer_id IS NOT NULL GROUP BY referrer_id
+        ) AS referrals
+        WHERE "user".id = referrals.referrer_id
+        RETURNING "user".id, "user".referral_count
+    )
+    SELECT inserted.*, referred.referral_count AS referrer_referral_count
+    FROM inserted LEFT JOIN referred ON referred.id = inserted.referrer_id
+""")
+
+
+async def add_balance(session, user_id: int, delta: int) -> Optional[int]:
+    """
+    Adds a delta to a user balance with a single UPDATE ... RETURNING.
+
+    Returns:
+        int: New balance, None if the user does not exist.
+    """
+    return await session.scalar(
+        update(User)
+        .where(User.id == user_id)
+        .values(balance=User.balance + delta)
+        .returning(User.balance)
+    )
+
+
+async def create_users(session, signups: List[Tuple[int, str, Optional[int]]]) -> List[Row]:
+    """
+    Inserts new users and counts them as referrals of their referrers in a single statement.
+    INSERT ... ON CONFLICT (id) DO NOTHING skips ids that already exist, referrers are resolved by a
+    join in the same INSERT and a data-modifying CTE adds the new referrals to their counters. Signups
+    whose referrer signs up in the same call take one more statement.
+
+    Args:
+        session (AsyncSession): Session the statements are executed in, the caller commits.
+        signups (list): (user_id, username, referrer_id) triples, of repeated ids one wins. Referrers
+            that do not exist are dropped.
+
+    Returns:
+        list: Rows of the USER_COLUMNS fields, referrer_id and the new referral count of the referrer, for the
+            inserted users only.
+    """
+    rows = []
+    pending = signups
+    while pending:
+        # The INSERT only sees users that existed before it, so signups referred by another signup of
+        # the batch wait for the next statement of the transaction
+        user_ids = {user_id for user_id, _, _ in pending}
+        deferred = [referrer_id in user_ids and referrer_id != user_id for user_id, _, referrer_id in pending]
+        if all(deferred):
+            # Signups referring to each other, the remaining links are dropped
+            deferred = [False] * len(pending)
+        ready = [signup for signup, defer in zip(pending, deferred) if not defer]
+        pending = [signup for signup, defer in zip(pending, deferred) if defer]
+
+        result = await session.execute(CREATE_USERS, {
+            "ids": [user_id for user_id, _, _ in ready],
+            "usernames": [username for _, username, _ in ready],
+            "referrer_ids": [referrer_id for _, _, referrer_id in ready],
+        })
+        rows.extend(result.all())
+
+    return rows
+
+
+async def apply_balance_deltas(session, deltas: Dict[int, int]) -> List[Tuple[int, int]]:
+    """
+    Adds per-user deltas to balances with one UPDATE ... FROM (VALUES ...) statement per chunk.
+
+    Args:
+        session (AsyncSession): Session the statements are executed in, the caller commits.
+        deltas (dict): Mapping of user id to the balance delta.
+
+    Returns:
+        list: (user_id, balance) pairs of the updated users.
+    """
+    rows = []
+    items = [(user_id, delta) for user_id, delta in deltas.items() if delta]
+    for start in range(0, len(items), BULK_CHUNK_SIZE):
+        deltas_table = values(
+            column("id", BigInteger), column("delta", BigInteger), name="deltas"
+        ).data(items[start:start + BULK_CHUNK_SIZE])
+
+        result = await session.execute(
+            update(User)
+            .where(User.id == deltas_table.c.id)
+            .values(balance=User.balance + deltas_table.c.delta)
+            .returning(User.id, User.balance)
+        )
+        rows.extend(result.tuples().all())
+
+    return rows
+
+
+async def mark_tap_batch_applied(session, batch_id: str) -> bool:
+    """
+    Records a tap buffer batch as written, in the transaction that applies its deltas.
+
+    Returns:
+        bool: False if the batch was written before and must be skipped.
+    """
+    result = await session.execute(
+        insert(applied_tap_batch).values(id=batch_id).on_conflict_do_nothing().returning(applied_tap_batch.c.id)
+    )
+    return result.first() is not None
+
+
+async def prune_applied_tap_batches(session, older_than: float) -> int:
+    result = await session.execute(
+        delete(applied_tap_batch).where(applied_tap_batch.c.applied_at < func.now() - timedelta(seconds=older_than))
+    )
+    return result.rowcount
+
+
+async def credit_referral_commissions(session, earnings: Dict[int, int]) -> List[Tuple[int, int, int]]:
+    """
+    Pays every referrer up the referrer_id chain a share of what the given users earned, with one
+    statement per chunk: a recursive CTE resolves the ancestors of the whole batch up to
+    len(REFERRAL_COMMISSION_PERCENTS) levels and a single UPDATE ... FROM credits them.
+
+    Args:
+        session (AsyncSession): Session the statements are executed in, the caller commits.
+        earnings (dict): Mapping of user id to the tokens earned, non-positive amounts are ignored.
+
+    Returns:
+        list: (user_id, balance, credited) triples of the credited referrers.
+    """
+    percents = settings.REFERRAL_COMMISSION_PERCENTS
+    items = [(user_id, amount) for user_id, amount in earnings.items() if amount > 0]
+    if not percents or not items:
+        return []
+
+    rates = values(column("depth", Integer), column("percent", Float), name="rates").data(
+        list(enumerate(percents, start=1))
+    )
+    rows = []
+    for start in range(0, len(items), BULK_CHUNK_SIZE):
+        earned = values(column("user_id", BigInteger), column("amount", BigInteger), name="earned").data(
+            items[start:start + BULK_CHUNK_SIZE]
+        )
+        chain = (
+            select(User.referrer_id.label("ancestor_id"), earned.c.amount, literal(1).label("depth"))
+            .join(earned, earned.c.user_id == User.id)
+            .where(User.referrer_id.is_not(None))
+            .cte("chain", recursive=True)
+        )
+        chain = chain.union_all(
+            select(User.referrer_id, chain.c.amount, chain.c.depth + 1)
+            .join(chain, chain.c.ancestor_id == User.id)
+            .where(User.referrer_id.is_not(None), chain.c.depth < len(percents))
+        )
+        credits = (
+            select(
+                chain.c.ancestor_id.label("id"),
+                cast(func.floor(func.sum(chain.c.amount * rates.c.percent / 100)), BigInteger).label("amount"),
+            )
+            .join(rates, rates.c.depth == chain.c.depth)
+            .group_by(chain.c.ancestor_id)
+            .cte("credits")
+        )
+
+        result = await session.execute(
+            update(User)
+            .where(User.id == credits.c.id, credits.c.amount > 0)
+            .values(balance=User.balance + credits.c.amount)
+            .returning(User.id, User.balance, credits.c.amount)
+            .execution_options(synchronize_session=False)
+        )
+        rows.extend(result.tuples().all())
+
+    return rows
+
+
+async def upgrade_boost(session, user_id: int, boost: BoostEntry, level: int) -> Optional[int]:
+    """
+    Charges the upgrade cost and stores the boost level in one statement, the level is only written
+    when the conditional balance UPDATE matched, so the balance can never go below zero
+    under concurrent upgrades.
+
+    Returns:
+        int: New balance, None if the user does not exist or cannot afford the upgrade.
+    """
+    charged = (
+        update(User)
+        .where(User.id == user_id, User.balance >= boost.upgrade_cost(level))
+        .values(balance=User.balance - boost.upgrade_cost(level))
+        .returning(User.id, User.balance)
+        .cte("charged")
+    )
+    upgraded = insert(user_boost).from_select(
+        ["user_id", "boost_id", "level"], select(charged.c.id, literal(boost.id), literal(level))
+    )
+    upgraded = upgraded.on_conflict_do_update(
+        index_elements=[user_boost.c.user_id, user_boost.c.boost_id], set_={"level": upgraded.excluded.level}
+    ).cte("upgraded")
+
+    return await session.scalar(select(charged.c.balance).add_cte(upgraded))
+
+
+async def complete_task(session, user_id: int, task: TaskEntry) -> Optional[int]:
+    """
+    Records a task completion and pays its reward in a single statement,
+    INSERT ... ON CONFLICT DO NOTHING makes a second completion a no-op.
+
+    Returns:
+        int: New balance, None if the user does not exist or already completed the task.
+    """
+    completion = (
+        insert(users_tasks)
+        .from_select(
+            ["user_id", "task_id"],
+            select(literal(user_id, BigInteger), literal(task.id)).where(exists().where(User.id == user_id)),
+        )
+        .on_conflict_do_nothing()
+        .returning(users_tasks.c.user_id)
+        .cte("completion")
+    )
+
+    return await session.scalar(
+        update(User)
+        .where(User.id == completion.c.user_id)
+        .values(balance=User.balance + task.reward)
+        .returning(User.balance)
+        .execution_options(synchronize_session=False)
+    )
+
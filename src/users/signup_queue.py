@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Row
+
+from src.config import settings
+from src.database import async_session_factory
+from src.replicas import replica_router
+from src.users.cache import user_cache
+from src.users.leaderboard import leaderboard, referral_leaderboard
+from src.users.service import create_users
+
+logger = logging.getLogger(__name__)
+
+Signup = Tuple[int, str, Optional[int]]
+
+
+async def insert_signups(signups: List[Signup]) -> Dict[int, Row]:
+    """
+    Inserts new users in one transaction and updates the caches and leaderboards of the batch.
+
+    Returns:
+        dict: Mapping of user id to the row returned by create_users(), for the inserted users only.
+    """
+    async with async_session_factory() as session:
+        rows = await create_users(session, signups)
+        await session.commit()
+
+    await replica_router.mark_writes([row.id for row in rows])
+    await user_cache.invalidate_many([row.id for row in rows])
+    await leaderboard.update_many([(row.id, row.balance) for row in rows])
+    # Rows come in statement order, the last count of a referrer is the latest
+    await referral_leaderboard.update_many({row.referrer_id: row.referrer_referral_count
+                                            for row in rows if row.referrer_id is not None}.items())
+    return {row.id: row for row in rows}
+
+
+class SignupQueue:
+    """
+        Coalesces concurrent signups into multi-row inserts.
+
+        A single flusher takes everything queued, lingers up to max_delay seconds for more and inserts
+        the batch with one statement, so a burst of signups costs a few round trips instead of one
+        transaction each. Of several signups of the same id only the first one gets the new user.
+
+    Args:
+        max_batch (int): Signups inserted by one statement at most.
+        max_delay (float): Seconds the flusher waits for a batch to fill up.
+    """
+
+    def __init__(self, max_batch: int, max_delay: float):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.inserted = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the flusher after inserting everything queued.
+        """
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, user_id: int, username: str, referrer_id: Optional[int]) -> Optional[Row]:
+        """
+        Returns:
+            Row: New user as returned by create_users(), None if the id already exists.
+        """
+        if self._task is None:
+            return (await insert_signups([(user_id, username, referrer_id)])).get(user_id)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(((user_id, username, referrer_id), future))
+        return await future
+
+    async def _collect(self, first) -> Tuple[list, bool]:
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _flush(self, batch: list) -> None:
+        try:
+            rows = await insert_signups([signup for signup, _ in batch])
+        except Exception as error:
+            if len(batch) > 1:
+                logger.exception("Failed to insert %d signups, inserting them one by one", len(batch))
+                # One bad signup must not fail the whole batch
+                for item in batch:
+                    await self._flush([item])
+                return
+            rows, failure = {}, error
+        else:
+            failure = None
+
+        self.batches += 1
+        self.inserted += len(rows)
+        for (user_id, _, _), future in batch:
+            if future.done():
+                continue
+            if failure is not None:
+                future.set_exception(failure)
+            else:
+                # Later signups of the same id find it existing
+                future.set_result(rows.pop(user_id, None))
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch, stopping = await self._collect(item)
+            await self._flush(batch)
+
+        # Signups queued after the stop marker
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                await self._flush([item])
+
+
+signup_queue = SignupQueue(
+    max_batch=settings.SIGNUP_BATCH_SIZE,
+    max_delay=settings.SIGNUP_BATCH_DELAY,
+)
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+
+from src.config import settings
+from src.database import async_session_factory
+from src.redis_client import get_redis
+from src.replicas import replica_router
+from src.token_stats import token_stats
+from src.users.cache import user_cache
+from src.users.leaderboard import leaderboard
+from src.users.ledger import REFERRAL, TAP, ledger
+from src.users.service import (apply_balance_deltas, credit_referral_commissions, mark_tap_batch_applied,
+                               prune_applied_tap_batches)
+
+logger = logging.getLogger(__name__)
+
+
+def batch_token(batch_id: str) -> str:
+    # The uuid at the end of the id stays the same when a batch is claimed again under a new key
+    return batch_id.rsplit(":", 1)[-1]
+
+
+class MemoryTapStore:
+    """
+        Keeps pending deltas in process memory, used when Redis is disabled.
+
+        Deltas that were not flushed are lost if the worker dies.
+    """
+
+    def __init__(self):
+        self.pending: Dict[int, int] = {}
+        self.batches: Dict[str, Dict[int, int]] = {}
+
+    async def add(self, user_id: int, tokens: int) -> int:
+        pending = self.pending.get(user_id, 0) + tokens
+        self.pending[user_id] = pending
+        return pending
+
+    async def get_pending(self, user_id: int) -> int:
+        return self.pending.get(user_id, 0)
+
+    async def take(self) -> Optional[Tuple[str, Dict[int, int]]]:
+        if not self.pending:
+            return None
+
+        batch_id = uuid.uuid4().hex
+        self.batches[batch_id], self.pending = self.pending, {}
+        return batch_id, self.batches[batch_id]
+
+    async def claim(self, batch_id: str) -> Optional[Tuple[str, Dict[int, int]]]:
+        if batch_id not in self.batches:
+            return None
+        return batch_id, self.batches[batch_id]
+
+    async def ack(self, batch_id: str) -> None:
+        self.batches.pop(batch_id, None)
+
+    async def abandoned(self) -> List[str]:
+        return []
+
+
+class RedisTapStore:
+    """
+        Keeps pending deltas in a Redis hash shared by all workers.
+
+        A flush atomically renames the pending hash to an in-flight key and deletes it only after the
+        Postgres transaction commits, so deltas survive a worker crash and are replayed by any worker
+        once the in-flight key is older than stale_after seconds. A claimed batch keeps its uuid, which
+        the flush records in Postgres to skip batches that were written before the crash.
+
+    Args:
+        stale_after (float): Age in seconds after which an in-flight batch is considered abandoned.
+    """
+
+    PENDING_KEY = "taps:pending"
+    INFLIGHT_PREFIX = "taps:inflight:"
+
+    def __init__(self, stale_after: float):
+        self.stale_after = stale_after
+
+    def _new_key(self, batch_id: str) -> str:
+        token = batch_token(batch_id) if batch_id.startswith(self.INFLIGHT_PREFIX) else uuid.uuid4().hex
+        return f"{self.INFLIGHT_PREFIX}{time.time():.3f}:{token}"
+
+    async def _read(self, key: str) -> Dict[int, int]:
+        data = await get_redis().hgetall(key)
+        return {int(user_id): int(delta) for user_id, delta in data.items()}
+
+    async def add(self, user_id: int, tokens: int) -> int:
+        return await get_redis().hincrby(self.PENDING_KEY, str(user_id), tokens)
+
+    async def get_pending(self, user_id: int) -> int:
+        pending = await get_redis().hget(self.PENDING_KEY, str(user_id))
+        return int(pending) if pending is not None else 0
+
+    async def take(self) -> Optional[Tuple[str, Dict[int, int]]]:
+        return await self.claim(self.PENDING_KEY)
+
+    async def claim(self, batch_id: str) -> Optional[Tuple[str, Dict[int, int]]]:
+        """
+        Moves a hash to a fresh in-flight key, only one worker can win the rename.
+        """
+        key = self._new_key(batch_id)
+        try:
+            await get_redis().rename(batch_id, key)
+        except ResponseError:
+            # The key is gone: nothing is pending or another worker claimed the batch
+            return None
+        return key, await self._read(key)
+
+    async def ack(self, batch_id: str) -> None:
+        await get_redis().delete(batch_id)
+
+    async def abandoned(self) -> List[str]:
+        now = time.time()
+        batch_ids = []
+        async for key in get_redis().scan_iter(match=f"{self.INFLIGHT_PREFIX}*", count=1000):
+            key = key.decode()
+            created_at = float(key[len(self.INFLIGHT_PREFIX):].split(":")[0])
+            if now - created_at > self.stale_after:
+                batch_ids.append(key)
+        return batch_ids
+
+
+class TapBuffer:
+    """
+        Buffers per-user token deltas and flushes them to Postgres in bulk.
+
+    Args:
+        flush_interval (float): Seconds between periodic flushes.
+        flush_threshold (int): Number of buffered taps that triggers an early flush.
+        stale_after (float): Age in seconds after which in-flight batches of dead workers are replayed.
+    """
+
+    def __init__(self, flush_interval: float, flush_threshold: int, stale_after: float):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.stale_after = stale_after
+        self.store = None
+        self.flushes = 0
+        self.flushed_rows = 0
+        self._buffered = 0
+        self._failed: List[str] = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self.store = RedisTapStore(self.stale_after) if settings.REDIS_ENABLED else MemoryTapStore()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the background flusher after a final flush of everything buffered.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def add(self, user_id: int, tokens: int) -> int:
+        """
+        Buffers a balance delta for a user.
+
+        Returns:
+            int: Delta pending for the user that is not yet written to Postgres.
+        """
+        pending = await self.store.add(user_id, tokens)
+        self._buffered += 1
+        if self._buffered >= self.flush_threshold:
+            self._wakeup.set()
+        return pending
+
+    async def get_pending(self, user_id: int) -> int:
+        return await self.store.get_pending(user_id)
+
+    async def flush(self) -> int:
+        """
+        Writes all buffered deltas, retrying batches that failed earlier.
+
+        Returns:
+            int: Number of user rows updated.
+        """
+        async with self._lock:
+            self._buffered = 0
+            batches = []
+            failed, self._failed = self._failed, []
+            for batch_id in failed:
+                batch = await self.store.claim(batch_id)
+                if batch is not None:
+                    batches.append(batch)
+
+            batch = await self.store.take()
+            if batch is not None:
+                batches.append(batch)
+
+            updated = 0
+            for batch_id, deltas in batches:
+                try:
+                    async with async_session_factory() as session:
+                        # A batch acked too late, e.g. by a worker that died after the commit, is replayed
+                        if not await mark_tap_batch_applied(session, batch_token(batch_id)):
+                            rows = None
+                        else:
+                            rows = await apply_balance_deltas(session, deltas)
+                            # Committed with the deltas, so a replayed batch never pays twice
+                            commissions = await credit_referral_commissions(session, deltas)
+                            await session.commit()
+                except Exception:
+                    logger.exception("Failed to flush %d buffered balance deltas", len(deltas))
+                    self._failed.append(batch_id)
+                    continue
+
+                await self._ack(batch_id)
+                if rows is None:
+                    logger.warning("Skipped tap batch %s, it was written before", batch_id)
+                    continue
+                written = [user_id for user_id, _ in rows] + [user_id for user_id, _, _ in commissions]
+                await replica_router.mark_writes(written)
+                await user_cache.invalidate_many(written)
+                await leaderboard.update_many(rows + [(user_id, balance) for user_id, balance, _ in commissions])
+                await token_stats.add_mined(sum(max(deltas[user_id], 0) for user_id, _ in rows) +
+                                            sum(credited for _, _, credited in commissions))
+                await ledger.record_many([(user_id, deltas[user_id], TAP) for user_id, _ in rows] +
+                                         [(user_id, credited, REFERRAL) for user_id, _, credited in commissions])
+                self.flushes += 1
+                self.flushed_rows += len(rows)
+                updated += len(rows)
+
+            return updated
+
+    async def _ack(self, batch_id: str) -> None:
+        # The deltas are committed, a batch left behind is skipped when it is replayed
+        try:
+            await self.store.ack(batch_id)
+        except Exception:
+            logger.exception("Failed to acknowledge tap batch %s", batch_id)
+
+    async def _prune(self) -> None:
+        async with async_session_factory() as session:
+            await prune_applied_tap_batches(session, settings.TAP_APPLIED_BATCH_RETENTION)
+            await session.commit()
+
+    async def _run(self) -> None:
+        last_recovery = 0.0
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                if time.monotonic() - last_recovery > self.stale_after:
+                    last_recovery = time.monotonic()
+                    self._failed.extend(await self.store.abandoned())
+                    await self._prune()
+                await self.flush()
+            except Exception:
+                logger.exception("Tap buffer flush failed")
+
+        await self.flush()
+
+
+tap_buffer = TapBuffer(
+    flush_interval=settings.TAP_FLUSH_INTERVAL,
+    flush_threshold=settings.TAP_FLUSH_THRESHOLD,
+    stale_after=settings.TAP_BATCH_STALE_AFTER,
+)
@@ -1,5 +1,8 @@
 import hashlib
 import hmac
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import Tuple
 
 
 def hmac_sha256(key, message):
@@ -8,3 +11,18 @@ def hmac_sha256(key, message):
         message.encode("utf-8"),
         hashlib.sha256
     )
+
+
+def encode_cursor(joined_at: datetime, user_id: int) -> str:
+    return urlsafe_b64encode(f"{joined_at.isoformat()}|{user_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decodes a keyset cursor into the joined_at and id of the last row of the previous page.
+
+    Raises:
+        ValueError: The cursor is malformed.
+    """
+    joined_at, user_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(joined_at), int(user_id)
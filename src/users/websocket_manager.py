@@ -1,10 +1,126 @@
 import asyncio
+from collections import deque
 
-from fastapi import WebSocket
+from fastapi import WebSocket, status
 
+from src.config import settings
 from src.users.redis_pub_sub_manager import RedisPubSubManager
 
 
+class SocketSender:
+    """
+        Delivers room messages to a single WebSocket without letting a slow client stall the room.
+
+        A send runs inline and only gets a writer task if the socket suspends it, so a healthy socket
+        is written synchronously without a task per message. While the writer is pending, further
+        messages wait in a bounded queue.
+
+    Args:
+        websocket (WebSocket): WebSocket connection object.
+        queue_size (int): Maximum number of messages waiting behind a suspended send.
+        policy (str): What to do when the queue is full, "drop" discards the oldest queued message,
+            "disconnect" closes the slow socket.
+    """
+
+    __slots__ = ("websocket", "queue", "queue_size", "policy", "dropped", "task", "closed")
+
+    def __init__(self, websocket: WebSocket, queue_size: int, policy: str):
+        self.websocket = websocket
+        self.queue = deque()
+        self.queue_size = queue_size
+        self.policy = policy
+        self.dropped = 0
+        self.task = None
+        self.closed = False
+
+    def send(self, data: str) -> None:
+        """
+        Sends or queues a message without waiting for the socket.
+
+        Args:
+            data (str): Message to be sent.
+        """
+        if self.closed:
+            return
+
+        if self.task is None or self.task.done():
+            send = self.websocket.send_text(data)
+            try:
+                waiting = send.send(None)
+            except StopIteration:
+                return
+            except Exception:
+                self._gone()
+                return
+            # The socket is busy, a writer finishes this send once it can go on, then drains the queue
+            self.task = asyncio.ensure_future(self._writer(send, waiting))
+            return
+
+        if len(self.queue) >= self.queue_size:
+            self.dropped += 1
+            if self.policy == "disconnect":
+                self.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+            self.queue.popleft()
+        self.queue.append(data)
+
+    def close(self, code: int = status.WS_1000_NORMAL_CLOSURE) -> None:
+        """
+        Stops delivery and closes the socket, the endpoint then sees the disconnect.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        if self.task is not None:
+            self.task.cancel()
+        asyncio.create_task(self._close(code))
+
+    def stop(self) -> None:
+        """
+        Stops delivery to a socket that already left the room.
+        """
+        self.closed = True
+        self.queue.clear()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _close(self, code: int) -> None:
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def _gone(self) -> None:
+        # The socket is gone, the endpoint removes it from the room
+        self.closed = True
+        self.queue.clear()
+
+    async def _writer(self, send, waiting) -> None:
+        """
+        Resumes a send suspended in send() and then writes the queued messages.
+
+        Args:
+            send (Coroutine): The started send_text() coroutine.
+            waiting (Future): What the send waits on, None when it only yielded to the event loop.
+        """
+        try:
+            try:
+                if waiting is not None:
+                    await asyncio.wait((waiting,))
+            except asyncio.CancelledError:
+                send.close()
+                raise
+            # A task steps the started coroutine from where it suspended
+            await asyncio.Task(send)
+            while self.queue:
+                await self.websocket.send_text(self.queue.popleft())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._gone()
+
+
 class WebSocketManager:
 
     def __init__(self):
@@ -12,40 +128,55 @@ class WebSocketManager:
         Initializes the WebSocketManager.
 
         Attributes:
-            rooms (dict): A dictionary to store WebSocket connections in different rooms.
+            rooms (dict): A dictionary to store the senders of WebSocket connections in different rooms.
             pubsub_client (RedisPubSubManager): An instance of the RedisPubSubManager class for pub-sub functionality.
         """
         self.rooms: dict = {}
-        self.pubsub_client = RedisPubSubManager()
+        self.pubsub_client = RedisPubSubManager(on_message=self.dispatch)
+
+    async def start(self) -> None:
+        """
+        Connects the shared pub/sub client, called from the application lifespan after Redis is initialized.
+        """
+        if settings.REDIS_ENABLED:
+            await self.pubsub_client.connect()
+
+    async def stop(self) -> None:
+        for room in self.rooms.values():
+            for sender in room.values():
+                sender.stop()
+        self.rooms.clear()
+        await self.pubsub_client.close()
 
     async def add_user_to_room(self, room_id: str, websocket: WebSocket) -> None:
         """
-        Adds a user's WebSocket connection to a room.
+        Adds an accepted WebSocket connection to a room.
 
         Args:
             room_id (str): Room ID or channel name.
             websocket (WebSocket): WebSocket connection object.
         """
-        await websocket.accept()
+        sender = SocketSender(websocket, settings.WEBSOCKET_SEND_QUEUE_SIZE, settings.WEBSOCKET_SLOW_CONSUMER_POLICY)
 
         if room_id in self.rooms:
-            self.rooms[room_id].append(websocket)
+            self.rooms[room_id][websocket] = sender
         else:
-            self.rooms[room_id] = [websocket]
-
-            await self.pubsub_client.connect()
-            pubsub_subscriber = await self.pubsub_client.subscribe(room_id)
-            await asyncio.create_task(self._pubsub_data_reader(pubsub_subscriber))
+            self.rooms[room_id] = {websocket: sender}
+            if settings.REDIS_ENABLED:
+                await self.pubsub_client.subscribe(room_id)
 
     async def broadcast_to_room(self, room_id: str, message: str) -> None:
         """
-        Broadcasts a message to all connected WebSockets in a room.
+        Broadcasts a message to all connected WebSockets in a room, across workers when Redis is enabled.
 
         Args:
             room_id (str): Room ID or channel name.
             message (str): Message to be broadcasted.
         """
-        await self.pubsub_client._publish(room_id, message)
+        if settings.REDIS_ENABLED:
+            await self.pubsub_client._publish(room_id, message)
+        else:
+            self.dispatch(room_id, message)
 
     async def remove_user_from_room(self, room_id: str, websocket: WebSocket) -> None:
         """
@@ -55,24 +186,30 @@ class WebSocketManager:
             room_id (str): Room ID or channel name.
             websocket (WebSocket): WebSocket connection object.
         """
-        self.rooms[room_id].remove(websocket)
+        room = self.rooms.get(room_id)
+        if room is None or websocket not in room:
+            return
+        room.pop(websocket).stop()
 
-        if len(self.rooms[room_id]) == 0:
+        if len(room) == 0:
             del self.rooms[room_id]
-            await self.pubsub_client.unsubscribe(room_id)
+            if settings.REDIS_ENABLED:
+                await self.pubsub_client.unsubscribe(room_id)
 
-    async def _pubsub_data_reader(self, pubsub_subscriber):
+    def dispatch(self, room_id: str, data: str) -> None:
         """
-        Reads and broadcasts messages received from Redis PubSub.
+        Queues a message for every WebSocket in a room without waiting for any of them.
 
         Args:
-            pubsub_subscriber (aioredis.ChannelSubscribe): PubSub object for the subscribed channel.
-        """
-        while True:
-            message = await pubsub_subscriber.get_message(ignore_subscribe_messages=True)
-            if message is not None:
-                room_id = message['channel'].decode('utf-8')
-                all_sockets = self.rooms[room_id]
-                for socket in all_sockets:
-                    data = message['data'].decode('utf-8')
-                    await socket.send_text(data)
+            room_id (str): Room ID or channel name.
+            data (str): Decoded message.
+        """
+        for sender in self.rooms.get(room_id, {}).values():
+            sender.send(data)
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self.rooms),
+            "sockets": sum(len(room) for room in self.rooms.values()),
+            **self.pubsub_client.stats(),
+        }